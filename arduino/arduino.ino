@@ -21,6 +21,14 @@
 // Note that one byte is reserved for the null terminator ('\0')
 #define COMMAND_BUFSIZE 128
 
+// The first byte of a binary command, followed by 7 little-endian int16 values and a little-endian CRC-16/XMODEM
+// of those values
+// These should match client/serial_protocol.py
+#define BINARY_SYNC_BYTE 0xA5
+#define BINARY_PAYLOAD_SIZE 14
+// The reply sent to a query ('?' followed by a newline) to indicate that binary commands are supported
+#define BINARY_REPLY "BIN1\n"
+
 // The 'OFF' pulse width for the motor ESCs, in microseconds
 // At this value, the motors are completely stopped
 #define MOTORS_OFF 1500
@@ -44,7 +52,11 @@ const int stepper_pins[4] = {STEPPER_PINS};
 int stepper_direction;
 
 void run_stepper(void);
-bool read_command(char *buffer);
+int read_byte(unsigned long start_millis);
+bool read_command(int *motor_speeds, int *stepper_speed);
+bool read_ascii_command(unsigned long start_millis, int *motor_speeds, int *stepper_speed);
+bool read_binary_command(unsigned long start_millis, int *motor_speeds, int *stepper_speed);
+uint16_t crc16(const uint8_t *data, int length);
 
 void setup() {
     // Initialize the serial connection and built-in LED
@@ -62,25 +74,10 @@ void setup() {
 }
 
 void loop() {
-    char command_buffer[COMMAND_BUFSIZE];
     int motor_speeds[6], stepper_speed;
-    bool valid_command_received = false;
 
     // Try and read a command from serial
-    if (read_command(command_buffer)) {
-        // If a command was received, try and parse it
-        auto fields_filled = sscanf(command_buffer, "!%d,%d,%d,%d,%d,%d,%d",
-            &motor_speeds[0],
-            &motor_speeds[1],
-            &motor_speeds[2],
-            &motor_speeds[3],
-            &motor_speeds[4],
-            &motor_speeds[5],
-            &stepper_speed);
-
-        // Check whether all of the fields were filled
-        valid_command_received = fields_filled == 7;
-    }
+    bool valid_command_received = read_command(motor_speeds, &stepper_speed);
 
     // Update the built-in LED to show whether a valid command was received
     digitalWrite(LED_BUILTIN, valid_command_received);
@@ -110,29 +107,107 @@ void run_stepper() {
         stepper.stepCCW();
 }
 
-// Reads a command from serial (ending with '\n') into the provided buffer
-// Returns whether the read completed successfully within the timeout
+// Waits for a single byte from serial, until COMMAND_TIMEOUT has passed since start_millis
+// Returns the byte, or -1 if the wait timed out
 // run_stepper() is called while waiting for data
-bool read_command(char *buffer) {
-    auto index = 0;
+int read_byte(unsigned long start_millis) {
+    while (millis() - start_millis < COMMAND_TIMEOUT) {
+        if (Serial.available())
+            return Serial.read();
+        // Run the stepper while waiting for data
+        run_stepper();
+    }
+    return -1;
+}
+
+// Reads a command from serial in either the ASCII or binary format
+// Bytes that do not start a command are skipped, and queries are answered
+// Returns whether a valid command was read within the timeout
+bool read_command(int *motor_speeds, int *stepper_speed) {
     auto start_millis = millis();
+    int first_byte;
+
+    while ((first_byte = read_byte(start_millis)) >= 0) {
+        if (first_byte == '!') {
+            return read_ascii_command(start_millis, motor_speeds, stepper_speed);
+        } else if (first_byte == BINARY_SYNC_BYTE) {
+            return read_binary_command(start_millis, motor_speeds, stepper_speed);
+        } else if (first_byte == '?') {
+            // Skip the rest of the query, and reply that binary commands are supported
+            int query_byte;
+            while ((query_byte = read_byte(start_millis)) >= 0 && query_byte != '\n');
+            Serial.print(BINARY_REPLY);
+        }
+    }
+    // Timed out, return false (failure)
+    return false;
+}
 
-    while (millis() - start_millis < COMMAND_TIMEOUT) {
-        if (Serial.available()) {
-            // Read a character into the buffer, and check if it is a newline
-            if ((buffer[index++] = Serial.read()) == '\n') {
-                // If it is a newline, append NUL and return true (success)
-                buffer[index] = '\0';
-                return true;
-            }
-            // If at the end of the buffer, return false (failure)
-            if (index == COMMAND_BUFSIZE - 1)
-                return false;
-        } else {
-            // Run the stepper while waiting for data
-            run_stepper();
+// Reads the rest of an ASCII command (after the '!') ending with '\n', and parses it
+// Returns whether the command was read and parsed successfully
+bool read_ascii_command(unsigned long start_millis, int *motor_speeds, int *stepper_speed) {
+    char buffer[COMMAND_BUFSIZE];
+    auto index = 0;
+    int next_byte;
+
+    while ((next_byte = read_byte(start_millis)) >= 0) {
+        // Read a character into the buffer, and check if it is a newline
+        if ((buffer[index++] = next_byte) == '\n') {
+            // If it is a newline, append NUL and parse the command
+            buffer[index] = '\0';
+            auto fields_filled = sscanf(buffer, "%d,%d,%d,%d,%d,%d,%d",
+                &motor_speeds[0],
+                &motor_speeds[1],
+                &motor_speeds[2],
+                &motor_speeds[3],
+                &motor_speeds[4],
+                &motor_speeds[5],
+                stepper_speed);
+            // Check whether all of the fields were filled
+            return fields_filled == 7;
         }
+        // If at the end of the buffer, return false (failure)
+        if (index == COMMAND_BUFSIZE - 1)
+            return false;
     }
     // Timed out, return false (failure)
     return false;
 }
+
+// Reads the rest of a binary command (after the sync byte), and checks its CRC
+// Returns whether the command was read successfully and its CRC matched
+bool read_binary_command(unsigned long start_millis, int *motor_speeds, int *stepper_speed) {
+    uint8_t payload[BINARY_PAYLOAD_SIZE];
+    int next_byte;
+
+    for (auto i = 0; i < BINARY_PAYLOAD_SIZE; i++) {
+        if ((next_byte = read_byte(start_millis)) < 0)
+            return false;
+        payload[i] = next_byte;
+    }
+    uint16_t crc = 0;
+    for (auto i = 0; i < 2; i++) {
+        if ((next_byte = read_byte(start_millis)) < 0)
+            return false;
+        crc |= (uint16_t) next_byte << (i * 8);
+    }
+    if (crc != crc16(payload, BINARY_PAYLOAD_SIZE))
+        return false;
+
+    // Decode the little-endian int16 values
+    for (auto i = 0; i < 6; i++)
+        motor_speeds[i] = (int16_t) (payload[i * 2] | (uint16_t) payload[i * 2 + 1] << 8);
+    *stepper_speed = (int16_t) (payload[12] | (uint16_t) payload[13] << 8);
+    return true;
+}
+
+// Computes the CRC-16/XMODEM (polynomial 0x1021, initial value 0) of the data
+uint16_t crc16(const uint8_t *data, int length) {
+    uint16_t crc = 0;
+    for (auto i = 0; i < length; i++) {
+        crc ^= (uint16_t) data[i] << 8;
+        for (auto bit = 0; bit < 8; bit++)
+            crc = crc & 0x8000 ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+    return crc;
+}
@@ -0,0 +1,130 @@
+import sys
+import threading
+from argparse import ArgumentParser
+from time import perf_counter, sleep
+from typing import List, Optional, Tuple
+
+from benchmarks.serial import percentile
+from client.camera_stream import CameraSelector, CameraStream, Gst
+
+"""Measure how long switching cameras takes, with separate pipelines and with a single input-selector pipeline
+
+Each camera is replaced by a live videotestsrc showing a solid colour, and the UDP sink by a fakesink. The switch
+latency is the time from requesting a switch until the encoder outputs the first frame from the new camera.
+
+Run with `python3 -m benchmarks.camera_switch [--switches N] [--resolution WIDTHxHEIGHT]`.
+"""
+
+# Solid videotestsrc patterns for each camera, and the luma of their pixels in I420
+PATTERNS = (('white', 235), ('black', 16), ('red', 81))
+
+
+class TestCameraStream(CameraStream):
+    @staticmethod
+    def _get_source_description(source: str, resolution: Tuple[int, int], framerate: int) -> str:
+        return 'videotestsrc is-live=true pattern={} ! video/x-raw, format=I420, width={}, height={}, ' \
+               'framerate={}/1'.format(source, resolution[0], resolution[1], framerate)
+
+    @staticmethod
+    def _get_sink_description(host: str, port: int) -> str:
+        return 'fakesink name=sink sync=false'
+
+
+class TestCameraSelector(CameraSelector):
+    _get_source_description = staticmethod(TestCameraStream._get_source_description)
+    _get_sink_description = staticmethod(TestCameraStream._get_sink_description)
+
+
+class SwitchProbe:
+    """Records when the encoder of a pipeline first outputs a frame from an expected camera after a switch"""
+
+    def __init__(self, pipeline: Gst.Element) -> None:
+        self.expected_luma = None  # type: Optional[int]
+        self.frame_time = None  # type: Optional[float]
+        self.frame_encoding = False
+        self.frame_done = threading.Event()
+        encoder = pipeline.get_by_name('encoder')
+        encoder.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self._on_raw_frame)
+        encoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self._on_encoded_frame)
+
+    def expect(self, luma: int) -> None:
+        """Wait for the next frame whose first pixel has a luma"""
+        self.frame_time = None
+        self.frame_encoding = False
+        self.frame_done.clear()
+        self.expected_luma = luma
+
+    def _on_raw_frame(self, pad: Gst.Pad, info: Gst.PadProbeInfo) -> Gst.PadProbeReturn:
+        if self.expected_luma is not None and abs(info.get_buffer().extract_dup(0, 1)[0] - self.expected_luma) < 8:
+            self.expected_luma = None
+            self.frame_encoding = True
+        return Gst.PadProbeReturn.OK
+
+    def _on_encoded_frame(self, pad: Gst.Pad, info: Gst.PadProbeInfo) -> Gst.PadProbeReturn:
+        if self.frame_encoding:
+            self.frame_encoding = False
+            self.frame_time = perf_counter()
+            self.frame_done.set()
+        return Gst.PadProbeReturn.OK
+
+
+def measure_switches(inputs: list, probes: List[SwitchProbe], switches: int, timeout: float) -> List[float]:
+    """Switch between inputs in turn, returning the latency of each switch"""
+    latencies = []
+    active = 0
+    inputs[active].set_playing()
+    sleep(0.5)
+    for switch in range(switches):
+        new = (active + 1) % len(inputs)
+        probe = probes[new]
+        probe.expect(PATTERNS[new][1])
+        start = perf_counter()
+        inputs[active].set_paused()
+        inputs[new].set_playing()
+        if probe.frame_done.wait(timeout):
+            latencies.append(probe.frame_time - start)
+        else:
+            print('switch {} timed out'.format(switch), file=sys.stderr)
+        active = new
+        # Let the new camera run for a while, as a pilot would
+        sleep(0.2)
+    return latencies
+
+
+def report(name: str, latencies: List[float]) -> None:
+    if not latencies:
+        print('{:<16} no successful switches'.format(name), file=sys.stderr)
+        return
+    print('{:<16} {} switches, mean={:.1f}ms p50={:.1f}ms p95={:.1f}ms max={:.1f}ms'.format(
+        name, len(latencies), sum(latencies) / len(latencies) * 1e3, percentile(latencies, 0.5) * 1e3,
+        percentile(latencies, 0.95) * 1e3, max(latencies) * 1e3), file=sys.stderr)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--switches', type=int, default=20)
+    parser.add_argument('--resolution', default='1280x720')
+    parser.add_argument('--framerate', type=int, default=30)
+    parser.add_argument('--timeout', type=float, default=5.0, help='time to wait for a frame after each switch')
+    args = parser.parse_args()
+    resolution = tuple(int(size) for size in args.resolution.split('x'))
+    sources = [(pattern, resolution, args.framerate) for pattern, _ in PATTERNS]
+
+    streams = [TestCameraStream(source, source_resolution, framerate, '', 0)
+               for source, source_resolution, framerate in sources]
+    for stream in streams:
+        stream.set_paused()
+    probes = [SwitchProbe(stream._pipeline) for stream in streams]
+    report('separate', measure_switches(streams, probes, args.switches, args.timeout))
+    for stream in streams:
+        stream.set_stopped()
+
+    selector = TestCameraSelector(sources, resolution, args.framerate, '', 0)
+    # Every input shares the same encoder
+    probe = SwitchProbe(selector._pipeline)
+    report('input-selector', measure_switches(selector.inputs, [probe] * len(sources), args.switches, args.timeout))
+    selector.set_stopped()
+
+
+if __name__ == '__main__':
+    main()
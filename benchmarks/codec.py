@@ -0,0 +1,47 @@
+import pickle
+from timeit import Timer
+
+from common import codec
+from common.command import SetMotorSpeedsCommand, SetCameraCommand, PlaySoundCommand
+from common.message import SystemInfoMessage, ArduinoConnectionMessage
+
+"""Micro-benchmark comparing the binary codec against pickle
+
+Run with `python3 -m benchmarks.codec`.
+"""
+
+SAMPLE_OBJECTS = [
+    SetMotorSpeedsCommand((1620, 1380, 1540, 1460, 1500, 1500, 1)),
+    SetMotorSpeedsCommand(None),
+    SetCameraCommand(1),
+    PlaySoundCommand('/home/rov/obs_release.wav'),
+    SystemInfoMessage(23.5, 48.3, 41.2),
+    ArduinoConnectionMessage(True)
+]
+
+
+def time_ns_per_op(func, arg, repeat: int = 5) -> float:
+    """Return the best time taken to call a function with a single argument, in nanoseconds per call"""
+    timer = Timer(lambda: func(arg))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def main() -> None:
+    row_fmt = '{:<28} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10}'
+    print(row_fmt.format('type', 'pkl B', 'bin B', 'pkl enc', 'bin enc', 'pkl dec', 'bin dec'))
+    for obj in SAMPLE_OBJECTS:
+        pickle_data, codec_data = pickle.dumps(obj), codec.encode(obj)
+        print(row_fmt.format(
+            type(obj).__name__ + ('(None)' if getattr(obj, 'motor_speeds', True) is None else ''),
+            len(pickle_data),
+            len(codec_data),
+            '{:.0f}ns'.format(time_ns_per_op(pickle.dumps, obj)),
+            '{:.0f}ns'.format(time_ns_per_op(codec.encode, obj)),
+            '{:.0f}ns'.format(time_ns_per_op(pickle.loads, pickle_data)),
+            '{:.0f}ns'.format(time_ns_per_op(codec.decode, codec_data))
+        ))
+
+
+if __name__ == '__main__':
+    main()
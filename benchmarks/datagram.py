@@ -0,0 +1,58 @@
+import random
+import socket
+from argparse import ArgumentParser
+
+from common.command import SetMotorSpeedsCommand
+from common.datagram import DatagramReceiver, DatagramSender
+
+"""Loopback test of the datagram channel with simulated loss and reordering
+
+Run with `python3 -m benchmarks.datagram [--count N] [--loss P] [--reorder P]`.
+"""
+
+
+class LossySocket:
+    """Socket wrapper that randomly drops datagrams, or holds them back to be sent after the next one"""
+
+    def __init__(self, sock: socket, loss: float, reorder: float) -> None:
+        self.sock = sock
+        self.loss = loss
+        self.reorder = reorder
+        self.held = None
+
+    def sendto(self, data: bytes, addr) -> None:
+        if random.random() < self.loss:
+            return
+        if self.held is None and random.random() < self.reorder:
+            self.held = data
+            return
+        self.sock.sendto(data, addr)
+        if self.held is not None:
+            self.sock.sendto(self.held, addr)
+            self.held = None
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--loss', type=float, default=0.01)
+    parser.add_argument('--reorder', type=float, default=0.01)
+    args = parser.parse_args()
+
+    recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    recv_sock.bind(('127.0.0.1', 0))
+    send_sock = LossySocket(socket.socket(socket.AF_INET, socket.SOCK_DGRAM), args.loss, args.reorder)
+    sender = DatagramSender(send_sock, recv_sock.getsockname())
+    receiver = DatagramReceiver(recv_sock)
+
+    command = SetMotorSpeedsCommand((1620, 1380, 1540, 1460, 1500, 1500, 1))
+    for _ in range(args.count):
+        sender.send(command)
+        receiver.recv_all()
+    receiver.recv_all()
+
+    print('sent={}, {}'.format(args.count, receiver.stats))
+
+
+if __name__ == '__main__':
+    main()
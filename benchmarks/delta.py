@@ -0,0 +1,124 @@
+import random
+from argparse import ArgumentParser
+from typing import List
+
+from benchmarks.session import synthetic_session
+from client.arduino import Arduino
+from client.virtual_arduino import COMMAND_TIMEOUT, MOTORS_OFF
+from common.command import SetMotorSpeedsCommand
+from common.delta import DeltaFilter
+from common.protocol import pack_obj
+from server.control_loop import ControlLoop
+from server.mixer import Mixer
+
+"""Measure the network and serial bytes saved by delta mode over a synthetic session
+
+Holding the speeds steady is then simulated with jittered control loop ticks and network latency, feeding both the
+server's keepalive filter and the client's write filter, to check that the gaps between serial writes stay within the
+Arduino's COMMAND_TIMEOUT. The same hold is run with the client's refresh interval equal to the server's keepalive
+interval for comparison, which drops keepalives that arrive slightly early.
+
+Run with `python3 -m benchmarks.delta [--duration SECONDS] [--rate HZ] [--jitter SECONDS] [--latency MIN,MAX]`.
+"""
+
+# Approximate per-segment overhead of TCP/IPv4 headers, in bytes
+TCP_OVERHEAD = 40
+
+
+class FakeSerial:
+    """Serial connection that discards everything written to it"""
+
+    is_open = True
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+
+class FakeClock:
+    """Clock that only advances when told to"""
+
+    def __init__(self) -> None:
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+
+def run_session(duration: float, rate: float, delta_mode: bool) -> dict:
+    """Return the number of commands and bytes sent over the network and to the Arduino for a session"""
+    clock = FakeClock()
+    server_filter = DeltaFilter(ControlLoop.DELTA_THRESHOLDS, ControlLoop.KEEPALIVE_INTERVAL, clock)
+    arduino = Arduino()
+    arduino.connection = FakeSerial()
+    if delta_mode:
+        arduino.write_filter = DeltaFilter((0,) * 7, Arduino.REFRESH_INTERVAL, clock)
+    else:
+        arduino.write_filter = DeltaFilter((0,) * 7, 0, clock)
+    mixer = Mixer()
+    commands, network_bytes = 0, 0
+    for timestamp, joystick_data in synthetic_session(duration, rate):
+        clock.time = timestamp
+        motor_speeds = mixer.mix(joystick_data)
+        if delta_mode and not server_filter.should_send(motor_speeds):
+            continue
+        commands += 1
+        network_bytes += len(pack_obj(SetMotorSpeedsCommand(motor_speeds))) + TCP_OVERHEAD
+        arduino.write_speeds(motor_speeds)
+    return {'commands': commands, 'network_bytes': network_bytes, 'serial_bytes': arduino.bytes_written}
+
+
+def run_hold(duration: float, rate: float, jitter: float, min_latency: float, max_latency: float,
+             refresh_interval: float, seed: int = 0) -> List[float]:
+    """Return the gaps between serial writes while holding the speeds steady in delta mode
+
+    Each tick starts up to jitter seconds after its deadline, and each command sent takes between min_latency and
+    max_latency seconds to arrive, in order.
+    """
+    rng = random.Random(seed)
+    clock = FakeClock()
+    server_filter = DeltaFilter(ControlLoop.DELTA_THRESHOLDS, ControlLoop.KEEPALIVE_INTERVAL, clock)
+    client_filter = DeltaFilter((0,) * 7, refresh_interval, clock)
+    send_times = []
+    for tick in range(int(duration * rate)):
+        clock.time = tick / rate + rng.uniform(0, jitter)
+        if server_filter.should_send(MOTORS_OFF):
+            send_times.append(clock.time)
+    write_times = []
+    arrival_time = 0.0
+    for send_time in send_times:
+        # TCP delivers commands in order, so a command never arrives before the previous one
+        arrival_time = max(arrival_time, send_time + rng.uniform(min_latency, max_latency))
+        clock.time = arrival_time
+        if client_filter.should_send(MOTORS_OFF):
+            write_times.append(arrival_time)
+    return [time - last_time for last_time, time in zip(write_times, write_times[1:])]
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--duration', type=float, default=600)
+    parser.add_argument('--rate', type=float, default=20)
+    parser.add_argument('--jitter', type=float, default=0.002, help='maximum lateness of a control loop tick')
+    parser.add_argument('--latency', default='0.001,0.006', help='minimum and maximum network latency')
+    args = parser.parse_args()
+    min_latency, max_latency = (float(latency) for latency in args.latency.split(','))
+
+    full = run_session(args.duration, args.rate, False)
+    delta = run_session(args.duration, args.rate, True)
+    print('{:<14} {:>10} {:>10} {:>8}'.format('', 'full', 'delta', 'saved'))
+    for key in ('commands', 'network_bytes', 'serial_bytes'):
+        saved = 1 - delta[key] / full[key] if full[key] else 0
+        print('{:<14} {:>10} {:>10} {:>7.1f}%'.format(key, full[key], delta[key], saved * 100))
+    print('network: {:.0f} B/s full, {:.0f} B/s delta'.format(full['network_bytes'] / args.duration,
+                                                              delta['network_bytes'] / args.duration))
+
+    refresh_name = 'refresh {:.0f}ms'.format(Arduino.REFRESH_INTERVAL * 1e3)
+    for name, refresh_interval in ((refresh_name, Arduino.REFRESH_INTERVAL),
+                                   ('refresh = keepalive', ControlLoop.KEEPALIVE_INTERVAL)):
+        gaps = run_hold(args.duration, args.rate, args.jitter, min_latency, max_latency, refresh_interval)
+        print('hold, {:<20} max serial gap {:>5.0f}ms, {:>5} gaps >= 200ms, {:>5} gaps >= COMMAND_TIMEOUT'.format(
+            name, max(gaps) * 1e3, sum(gap >= 0.2 for gap in gaps), sum(gap >= COMMAND_TIMEOUT for gap in gaps)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import gc
+import os
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Callable, List
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+
+from benchmarks.session import synthetic_session
+from server.control_loop import ControlLoop
+from server.joystick import Joystick, JoystickData
+
+"""Compare the cost and GC pressure of sampling the joystick by polling, polling in place, and applying events
+
+A fake Pygame joystick replays a synthetic session. Polling reads every axis and button on each tick, either into new
+lists like the original Joystick.read_all or in place, while event-driven sampling applies the Pygame events between
+ticks and reads nothing. Each method is timed per sample, then run again with the garbage collector disabled and every
+sample kept alive, which counts the GC-tracked objects it allocates per sample. Every GC-tracked object that outlives
+a tick, such as a sample held by the window's control snapshot, counts towards the next generation 0 collection.
+
+A whole ControlLoop.step is counted the same way for both polling and event-driven sampling, keeping every snapshot
+and every command it sends, which includes mixing the sample and building the snapshot and motor speeds command.
+
+Run with `python3 -m benchmarks.joystick [--duration SECONDS] [--rate HZ]`.
+"""
+
+
+class FakeDevice:
+    """Stand-in for a pygame.joystick.Joystick that returns the values of the current sample"""
+
+    def __init__(self, sample: JoystickData) -> None:
+        self.sample = sample
+
+    def get_numaxes(self) -> int:
+        return len(self.sample.axes)
+
+    def get_numbuttons(self) -> int:
+        return len(self.sample.buttons)
+
+    def get_axis(self, index: int) -> float:
+        return self.sample.axes[index]
+
+    def get_button(self, index: int) -> bool:
+        return self.sample.buttons[index]
+
+    def get_hat(self, index: int) -> tuple:
+        return self.sample.hat
+
+
+def read_all_allocating(device: FakeDevice) -> JoystickData:
+    """Read the joystick the way Joystick.read_all originally did, into new lists and a new JoystickData"""
+    axes = [device.get_axis(i) for i in range(device.get_numaxes())]
+    buttons = [device.get_button(i) for i in range(device.get_numbuttons())]
+    hat = device.get_hat(0)
+    return JoystickData(axes, buttons, hat)
+
+
+def get_events(previous: JoystickData, sample: JoystickData) -> List[pygame.event.EventType]:
+    """Return the Pygame events a joystick would generate when changing from one sample to the next"""
+    events = [pygame.event.Event(pygame.JOYAXISMOTION, joy=0, axis=index, value=value)
+              for index, (value, previous_value) in enumerate(zip(sample.axes, previous.axes))
+              if value != previous_value]
+    events += [pygame.event.Event(pygame.JOYBUTTONDOWN if pressed else pygame.JOYBUTTONUP, joy=0, button=index)
+               for index, (pressed, was_pressed) in enumerate(zip(sample.buttons, previous.buttons))
+               if pressed != was_pressed]
+    if sample.hat != previous.hat:
+        events.append(pygame.event.Event(pygame.JOYHATMOTION, joy=0, hat=0, value=sample.hat))
+    return events
+
+
+def run_method(samples: List[JoystickData], sample_function: Callable[[int], JoystickData]) -> tuple:
+    """Return the time per sample, and the GC-tracked objects allocated per sample, of a sampling function"""
+    start = perf_counter()
+    for index in range(len(samples)):
+        sample_function(index)
+    elapsed = perf_counter() - start
+
+    # Keep every sample alive with the collector disabled, so that the generation 0 count only grows
+    kept = [None] * len(samples)
+    gc.collect()
+    gc.disable()
+    count = gc.get_count()[0]
+    for index in range(len(samples)):
+        kept[index] = sample_function(index)
+    allocations = gc.get_count()[0] - count
+    gc.enable()
+    return elapsed / len(samples), allocations / len(samples)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--duration', type=float, default=600)
+    parser.add_argument('--rate', type=float, default=250)
+    args = parser.parse_args()
+
+    samples = [joystick_data for _, joystick_data in synthetic_session(args.duration, args.rate)]
+    tick_events = [get_events(previous, sample) for previous, sample in zip(samples[:1] + samples, samples)]
+    device = FakeDevice(samples[0])
+    joystick = Joystick(0)
+    joystick.joystick = device
+    joystick.data = JoystickData([0.0] * device.get_numaxes(), [False] * device.get_numbuttons(), (0, 0))
+    event_joystick = Joystick(0, event_driven=True)
+    event_joystick.joystick = device
+    event_joystick.data = samples[0].copy()
+
+    def allocating(index: int) -> JoystickData:
+        device.sample = samples[index]
+        return read_all_allocating(device)
+
+    def polling(index: int) -> JoystickData:
+        device.sample = samples[index]
+        return joystick.read_all()
+
+    def event_driven(index: int) -> JoystickData:
+        for event in tick_events[index]:
+            event_joystick.handle_event(event)
+        return event_joystick.read_all()
+
+    # Check that applying the events reproduces every sample
+    mismatches = 0
+    for index, sample in enumerate(samples):
+        data = event_driven(index)
+        mismatches += data.axes != sample.axes or data.buttons != sample.buttons or tuple(data.hat) != sample.hat
+    event_count = sum(len(events) for events in tick_events)
+    print('{} samples at {:.0f}Hz, {:.2f} events per sample, {} event-driven mismatches'.format(
+        len(samples), args.rate, event_count / len(samples), mismatches))
+
+    # Keep every command sent by the control loops, so that it is counted even though nothing else holds it
+    sent = []
+    polling_loop = ControlLoop(joystick, sent.append)
+    event_loop = ControlLoop(event_joystick, sent.append)
+
+    def polling_step(index: int) -> object:
+        device.sample = samples[index]
+        return polling_loop.step()
+
+    def event_driven_step(index: int) -> object:
+        for event in tick_events[index]:
+            event_joystick.handle_event(event)
+        return event_loop.step()
+
+    for name, sample_function in (('poll (new lists)', allocating), ('poll (in place)', polling),
+                                  ('event-driven', event_driven), ('step (polling)', polling_step),
+                                  ('step (event-driven)', event_driven_step)):
+        per_sample, allocations = run_method(samples, sample_function)
+        sent.clear()
+        print('{:<19} {:>7.0f}ns/sample {:>5.2f} GC-tracked allocations/sample {:>8.0f} allocations/s at {:.0f}Hz'
+              .format(name, per_sample * 1e9, allocations, allocations * args.rate, args.rate))
+
+
+if __name__ == '__main__':
+    main()
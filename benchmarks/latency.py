@@ -0,0 +1,176 @@
+import json
+import os
+import platform
+import socket
+import statistics
+import threading
+from argparse import ArgumentParser
+from bisect import bisect_right
+from time import perf_counter, sleep
+from typing import Dict, List, Optional
+
+# Render the server window without a display, and keep standard output clean for the results
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+
+from benchmarks.serial import percentile
+from benchmarks.session import SweepJoystick
+from client.arduino import Arduino
+from client.client import Client
+from client.virtual_arduino import VirtualArduino
+from common import logging
+from server.mixer import Mixer
+from server.server import Server
+from server.window import Window
+
+"""End-to-end control latency benchmark
+
+The real Server and Client run in one process over loopback, with a synthetic joystick on the server and a virtual
+Arduino on the client. Each joystick sample is matched to the serial command it produced, measuring the latency from
+the joystick read to the command arriving at the Arduino at each control rate. Results are printed as JSON, so that
+runs can be compared across commits.
+
+Run with `python3 -m benchmarks.latency [--rates 20,50,...] [--duration S] [--udp] [--output FILE]`.
+"""
+
+# Time to let the connection settle before recording samples, in seconds
+WARMUP = 0.5
+
+
+def get_free_port(kind: int) -> int:
+    """Return a port on the loopback interface that is currently free"""
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def summarize(samples: List[float]) -> Dict[str, Optional[float]]:
+    """Summarize samples in seconds as statistics in milliseconds"""
+    if not samples:
+        return {'mean': None, 'stdev': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    return {
+        'mean': round(statistics.mean(samples) * 1e3, 3),
+        'stdev': round((statistics.stdev(samples) if len(samples) > 1 else 0.0) * 1e3, 3),
+        'p50': round(percentile(samples, 0.5) * 1e3, 3),
+        'p95': round(percentile(samples, 0.95) * 1e3, 3),
+        'p99': round(percentile(samples, 0.99) * 1e3, 3),
+        'max': round(max(samples) * 1e3, 3)
+    }
+
+
+def run_client(client: Client, stopped: threading.Event) -> None:
+    while not stopped.is_set():
+        client.connect_and_run()
+        stopped.wait(0.05)
+
+
+def run(rate: float, duration: float, use_udp: bool, protocol: str, delta_mode: bool,
+        emulate_baud_rate: bool) -> dict:
+    """Run the server and client at a control rate for a duration, returning the measured latencies"""
+    virtual_arduino = VirtualArduino(emulate_baud_rate=emulate_baud_rate)
+    virtual_arduino.start()
+    arduino = Arduino(virtual_arduino.port, protocol)
+    arduino.connect()
+
+    port = get_free_port(socket.SOCK_STREAM)
+    datagram_port = get_free_port(socket.SOCK_DGRAM) if use_udp else None
+    client = Client('127.0.0.1', port, arduino, [], datagram_port)
+    client_stopped = threading.Event()
+    client_thread = threading.Thread(target=run_client, args=(client, client_stopped), name='client', daemon=True)
+
+    joystick = SweepJoystick(perf_counter)
+    window = Window()
+    window.show()
+    server = Server('127.0.0.1', port, joystick, window, rate, delta_mode=delta_mode)
+
+    # Stop the server from another thread once the run is over, the same way closing the window does
+    start_time = perf_counter()
+    threading.Timer(WARMUP + duration, pygame.event.post, args=(pygame.event.Event(pygame.QUIT),)).start()
+    client_thread.start()
+    try:
+        server.run()
+    except SystemExit:
+        pass
+    finally:
+        client_stopped.set()
+        client_thread.join()
+        window.hide()
+        arduino.disconnect()
+        virtual_arduino.stop()
+
+    # Match each received command to the most recent joystick read that produced the same speeds
+    read_times = {}  # type: Dict[tuple, List[float]]
+    mixer = Mixer()
+    for read_time, joystick_data in joystick.reads:
+        read_times.setdefault(mixer.mix(joystick_data), []).append(read_time)
+    latencies = []
+    frame_times = []
+    unmatched = 0
+    for frame in virtual_arduino.get_valid_frames():
+        times = read_times.get(frame.motor_speeds, [])
+        index = bisect_right(times, frame.timestamp)
+        if index == 0:
+            unmatched += 1
+        elif times[index - 1] >= start_time + WARMUP:
+            latencies.append(frame.timestamp - times[index - 1])
+            frame_times.append(frame.timestamp)
+
+    read_intervals = [b[0] - a[0] for a, b in zip(joystick.reads, joystick.reads[1:]) if a[0] >= start_time + WARMUP]
+    frame_intervals = [b - a for a, b in zip(frame_times, frame_times[1:])]
+    return {
+        'rate': rate,
+        'joystick_reads': len([read for read in joystick.reads if read[0] >= start_time + WARMUP]),
+        'commands_received': len(latencies),
+        'commands_unmatched': unmatched,
+        'serial_overwrites': arduino.writer.stats.overwrites,
+        'latency_ms': summarize(latencies),
+        'tick_interval_ms': summarize(read_intervals),
+        'command_interval_ms': summarize(frame_intervals)
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--rates', default='20,50,100,200,500', help='comma-separated control rates in Hz')
+    parser.add_argument('--duration', type=float, default=5.0, help='duration of each run in seconds')
+    parser.add_argument('--udp', action='store_true', help='send motor speeds over the datagram channel')
+    parser.add_argument('--protocol', default=Arduino.PROTOCOL_AUTO, help='serial protocol to use')
+    parser.add_argument('--delta-mode', action='store_true')
+    parser.add_argument('--emulate-baud-rate', action='store_true')
+    parser.add_argument('--output', help='write the results to a file instead of standard output')
+    args = parser.parse_args()
+
+    # Keep the client and server quiet, since they log disconnections at the end of every run
+    if os.getenv('DEBUG') is None:
+        logging.MIN_LEVEL = logging.LVL_FATAL
+
+    pygame.init()
+    runs = []
+    for rate in [float(rate) for rate in args.rates.split(',')]:
+        runs.append(run(rate, args.duration, args.udp, args.protocol, args.delta_mode, args.emulate_baud_rate))
+        # Give the client's last connection attempt time to fail before the next server starts
+        sleep(0.1)
+    pygame.quit()
+
+    results = {
+        'benchmark': 'latency',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'duration': args.duration,
+        'transport': 'udp' if args.udp else 'tcp',
+        'protocol': args.protocol,
+        'delta_mode': args.delta_mode,
+        'emulate_baud_rate': args.emulate_baud_rate,
+        'runs': runs
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
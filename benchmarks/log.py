@@ -0,0 +1,66 @@
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from time import perf_counter, sleep
+
+from benchmarks.serial import percentile
+from common import logging
+
+"""Measure how long logging blocks the caller, with a fast and a slow standard output
+
+The synchronous baseline formats and prints each message on the calling thread, as common.logging did before it
+queued records for a writer thread.
+
+Run with `python3 -m benchmarks.log [--count N] [--write-delay SECONDS]`.
+"""
+
+
+class SlowOutput:
+    """Stand-in for a slow terminal or SSH session, which blocks for a fixed time on every write"""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+
+    def write(self, data: str) -> int:
+        if self.delay:
+            sleep(self.delay)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+def log_synchronously(fmt: str, *fmt_args) -> None:
+    timestamp = datetime.now().strftime('%H:%M:%S')
+    print("[{}] {}: {}".format(timestamp, 'DEBUG', fmt.format(*fmt_args)))
+
+
+def measure(name: str, log, count: int) -> None:
+    times = []
+    for index in range(count):
+        start = perf_counter()
+        log('Server command: {} {}', index, (1500, 1500, 1500, 1500, 1500, 1500, 0))
+        times.append(perf_counter() - start)
+    print('{:<24} mean={:.2f}us p99={:.2f}us max={:.2f}us'.format(
+        name, sum(times) / count * 1e6, percentile(times, 0.99) * 1e6, max(times) * 1e6), file=sys.stderr)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--write-delay', type=float, default=0.001, help='time each write to the slow output takes')
+    args = parser.parse_args()
+
+    logging.MIN_LEVEL = logging.LVL_DEBUG
+    stdout = sys.stdout
+    for output_name, output in (('fast', SlowOutput(0)), ('slow', SlowOutput(args.write_delay))):
+        sys.stdout = output
+        measure('synchronous, {}'.format(output_name), log_synchronously, args.count)
+        measure('queued, {}'.format(output_name), logging.debug, args.count)
+        logging.flush(10)
+    sys.stdout = stdout
+    print('Logging: {}'.format(logging.get_stats()), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
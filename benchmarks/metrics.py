@@ -0,0 +1,71 @@
+import json
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+from urllib.request import urlopen
+
+from common.metrics import MetricsRegistry, MetricsServer
+
+"""Measure the cost of updating metrics, and of serving them over HTTP
+
+Each kind of update is run in a loop and timed, less the cost of an empty loop, so the cost includes the call. A
+registry with as many metrics as the server registers is then served by a MetricsServer, and both endpoints are
+fetched and checked.
+
+Run with `python3 -m benchmarks.metrics [--updates N]`.
+"""
+
+
+def time_loop(function, count: int) -> float:
+    """Return the time per call of a function in seconds, less the time per iteration of an empty loop"""
+    values = [0.003] * count
+    start = perf_counter()
+    for value in values:
+        function(value)
+    elapsed = perf_counter() - start
+    start = perf_counter()
+    for value in values:
+        pass
+    return (elapsed - (perf_counter() - start)) / count
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--updates', type=int, default=2000000)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    counter = registry.counter('benchmark_total', 'Counter updated by the benchmark')
+    gauge = registry.gauge('benchmark_gauge', 'Gauge updated by the benchmark')
+    histogram = registry.histogram('benchmark_seconds', 'Histogram updated by the benchmark')
+
+    for name, function in (('Counter.inc', counter.inc), ('Gauge.set', gauge.set),
+                           ('Histogram.observe', histogram.observe)):
+        per_update = time_loop(function, args.updates)
+        print('{:<18} {:>6.0f}ns/update'.format(name, per_update * 1e9), file=sys.stderr)
+
+    for index in range(12):
+        registry.counter('extra_{}_total'.format(index), 'Extra counter')
+    for index in range(5):
+        registry.histogram('extra_{}_seconds'.format(index), 'Extra histogram').observe(0.001 * index)
+    server = MetricsServer('127.0.0.1', 0, registry)
+    server.start()
+    url = 'http://127.0.0.1:{}'.format(server.port)
+    try:
+        text = urlopen(url + '/metrics').read().decode()
+        values = json.loads(urlopen(url + '/metrics.json').read().decode())
+        assert 'benchmark_total {}'.format(counter.value) in text
+        assert values['benchmark_seconds']['count'] == histogram.get_count()
+        start = perf_counter()
+        for _ in range(args.requests):
+            urlopen(url + '/metrics').read()
+        per_request = (perf_counter() - start) / args.requests
+    finally:
+        server.stop()
+    print('{} metrics served in {} bytes of text, {:.2f}ms/request'.format(len(registry.metrics), len(text),
+                                                                            per_request * 1e3), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+from argparse import ArgumentParser
+from time import perf_counter
+
+from benchmarks.session import synthetic_session
+from server.mixer import Mixer, pack_samples
+from server.motor_vectoring import calculate_motor_speeds
+
+"""Check that the mixer matches calculate_motor_speeds, one sample at a time and in batches, and compare their cost per
+sample
+
+The batch cost is given with and without packing the samples into an array, which server.replay --mix-only also does.
+
+Run with `python3 -m benchmarks.mixer [--duration SECONDS] [--rate HZ]`.
+"""
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--duration', type=float, default=3600)
+    parser.add_argument('--rate', type=float, default=20)
+    args = parser.parse_args()
+
+    samples = [joystick_data for _, joystick_data in synthetic_session(args.duration, args.rate)]
+    mixer = Mixer()
+
+    start = perf_counter()
+    expected = [calculate_motor_speeds(joystick_data) for joystick_data in samples]
+    reference_time = perf_counter() - start
+
+    start = perf_counter()
+    single = [mixer.mix(joystick_data) for joystick_data in samples]
+    single_time = perf_counter() - start
+
+    start = perf_counter()
+    packed = pack_samples(samples)
+    pack_time = perf_counter() - start
+    start = perf_counter()
+    batch = mixer.mix_batch(packed)
+    batch_time = perf_counter() - start
+
+    single_mismatches = sum(a != b for a, b in zip(expected, single))
+    batch_mismatches = sum(a != tuple(b) for a, b in zip(expected, batch.tolist()))
+    print('{} samples, {} single mismatches, {} batch mismatches'.format(len(samples), single_mismatches,
+                                                                         batch_mismatches))
+    for name, elapsed in (('calculate_motor_speeds', reference_time), ('Mixer.mix', single_time),
+                          ('Mixer.mix_batch', batch_time), ('pack + Mixer.mix_batch', pack_time + batch_time)):
+        print('{:<24} {:>10.0f} ns/sample'.format(name, elapsed / len(samples) * 1e9))
+
+
+if __name__ == '__main__':
+    main()
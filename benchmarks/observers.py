@@ -0,0 +1,131 @@
+import socket
+import statistics
+import sys
+import threading
+from argparse import ArgumentParser
+from time import perf_counter, sleep
+from typing import List
+
+from benchmarks.serial import percentile
+from common import logging
+from common.command import SetMotorSpeedsCommand
+from common.message import ClientConnectionMessage, SystemInfoMessage
+from common.protocol import FrameReader, recv_all_obj, send_obj
+from server.network import EVENT_MESSAGE, NetworkCore
+
+"""Observer fan-out benchmark
+
+A NetworkCore is run on loopback with a controlling client and a number of observers, some of which read everything
+they are sent while the rest never read at all. Commands are sent to the client at a high rate while it sends messages
+back, measuring how long each send takes, how many frames the reading observers receive, and how many frames are
+dropped for the stalled observers. The send times should not depend on the number of stalled observers.
+
+Run with `python3 -m benchmarks.observers [--observers N] [--stalled N] [--commands N] [--rate HZ]`.
+"""
+
+
+def get_free_port() -> int:
+    """Return a TCP port on the loopback interface that is currently free"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ObserverReader:
+    """Observer that reads and decodes everything it is sent on a thread"""
+
+    def __init__(self, port: int) -> None:
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.reader = FrameReader(self.sock)
+        self.received = 0
+        self.connection_messages = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self.sock.close()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                objs = recv_all_obj(self.reader, 0.05)
+            except socket.error:
+                return
+            self.received += len(objs)
+            self.connection_messages += sum(1 for obj in objs if isinstance(obj, ClientConnectionMessage))
+
+
+def run(observer_count: int, stalled_count: int, command_count: int, rate: float) -> None:
+    port = get_free_port()
+    observer_port = get_free_port()
+    network = NetworkCore('127.0.0.1', port, observer_port)
+    network.start()
+
+    readers = [ObserverReader(observer_port) for _ in range(observer_count)]
+    # Stalled observers connect with a small receive buffer and never read, so their queues fill up
+    stalled = []  # type: List[socket.socket]
+    for _ in range(stalled_count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(('127.0.0.1', observer_port))
+        stalled.append(sock)
+    client = socket.create_connection(('127.0.0.1', port))
+    client_reader = FrameReader(client)
+    sleep(0.2)
+
+    send_times = []
+    messages_received = 0
+    command = SetMotorSpeedsCommand([1500] * 7)
+    message = SystemInfoMessage(25.0, 50.0, 40.0)
+    deadline = perf_counter()
+    for index in range(command_count):
+        # Send at a fixed rate, like the control loop, instead of faster than the network thread can keep up with
+        deadline += 1 / rate
+        sleep(max(deadline - perf_counter(), 0))
+        start = perf_counter()
+        network.send_to_client(command)
+        send_times.append(perf_counter() - start)
+        if index % 10 == 0:
+            send_obj(client, message)
+        # Keep the client's receive buffer from filling, as the real client would
+        recv_all_obj(client_reader)
+        messages_received += sum(1 for event_type, _ in network.get_events() if event_type == EVENT_MESSAGE)
+    sleep(0.5)
+    messages_received += sum(1 for event_type, _ in network.get_events() if event_type == EVENT_MESSAGE)
+
+    stalled_addrs = [sock.getsockname() for sock in stalled]
+    dropped = [observer.dropped for observer in network.observers.values() if observer.addr not in stalled_addrs]
+    stalled_dropped = [observer.dropped for observer in network.observers.values() if observer.addr in stalled_addrs]
+    client.close()
+    for reader in readers:
+        reader.stop()
+    for sock in stalled:
+        sock.close()
+    network.stop()
+
+    print('{} observers, {} stalled: send mean {:.1f}us p99 {:.1f}us max {:.1f}us, {}/{} messages received, '
+          'observers received {} dropped {}, stalled observers dropped {}'.format(
+              observer_count, stalled_count, statistics.mean(send_times) * 1e6,
+              percentile(send_times, 0.99) * 1e6, max(send_times) * 1e6, messages_received,
+              (command_count + 9) // 10, [reader.received for reader in readers], dropped, stalled_dropped),
+          file=sys.stderr)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--observers', type=int, default=4, help='number of observers that read what they are sent')
+    parser.add_argument('--stalled', default='0,1,8', help='comma-separated numbers of stalled observers')
+    parser.add_argument('--commands', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=5000, help='rate to send commands at, in Hz')
+    args = parser.parse_args()
+
+    logging.MIN_LEVEL = logging.LVL_WARN
+    for stalled_count in [int(count) for count in args.stalled.split(',')]:
+        run(args.observers, stalled_count, args.commands, args.rate)
+
+
+if __name__ == '__main__':
+    main()
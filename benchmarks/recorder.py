@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+from argparse import ArgumentParser
+from time import perf_counter
+
+from benchmarks.serial import percentile
+from common.command import SetMotorSpeedsCommand
+from common.message import SystemInfoMessage
+from common.recorder import FlightLog, FlightRecorder
+from server.joystick import JoystickData
+
+"""Measure the cost of recording a dive and of reading time ranges back from the log
+
+A simulated dive records joystick input and motor speeds at the control rate, and system info every second. The
+recorder's clock is simulated too, so that a long dive can be recorded in a few seconds. Range queries through the seek
+index are compared against scanning the log from the start.
+
+Run with `python3 -m benchmarks.recorder [--duration SECONDS] [--control-rate HZ] [--queries N]`.
+"""
+
+
+class SimulatedClock:
+    """Clock that only advances when told to"""
+
+    def __init__(self) -> None:
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+
+def record_dive(path: str, duration: float, control_rate: float) -> None:
+    clock = SimulatedClock()
+    recorder = FlightRecorder(path, clock)
+    # The simulated dive is recorded far faster than real time, so allow the whole dive to be pending at once
+    recorder.MAX_PENDING = int(duration * (control_rate * 2 + 1))
+    joystick_data = JoystickData([0.25, -0.5, 0.0, 1.0], [False] * 12, (0, 1))
+    command = SetMotorSpeedsCommand((1620, 1380, 1540, 1460, 1500, 1500, 1))
+    system_info = SystemInfoMessage(23.5, 48.3, 41.2)
+    ticks = int(duration * control_rate)
+    times = []
+    start = perf_counter()
+    for tick in range(ticks):
+        clock.time = tick / control_rate
+        record_start = perf_counter()
+        recorder.record(joystick_data)
+        recorder.record(command)
+        if tick % int(control_rate) == 0:
+            recorder.record(system_info)
+        times.append(perf_counter() - record_start)
+    recorder.close()
+    elapsed = perf_counter() - start
+    print('record: {} records, {:.1f}s simulated in {:.2f}s, {:.0f} records/s, {:.2f}MB'.format(
+        recorder.recorded, duration, elapsed, recorder.recorded / elapsed, os.path.getsize(path) / 1e6),
+        file=sys.stderr)
+    print('record per tick: mean={:.2f}us p99={:.2f}us max={:.2f}us (dropped {}, failed {})'.format(
+        sum(times) / ticks * 1e6, percentile(times, 0.99) * 1e6, max(times) * 1e6, recorder.dropped,
+        recorder.failed), file=sys.stderr)
+
+
+def scan_range(log: FlightLog, start: float, end: float) -> int:
+    # Baseline that reads every record from the start of the log, as there would be without a seek index
+    count = 0
+    for timestamp, _, _ in log._scan(log.seek(float('-inf'))):
+        if timestamp > end:
+            break
+        if timestamp >= start:
+            count += 1
+    return count
+
+
+def query_ranges(path: str, duration: float, queries: int) -> None:
+    log = FlightLog(path)
+    # Query ten seconds at evenly spaced points through the dive
+    ranges = [(duration * index / queries, duration * index / queries + 10) for index in range(queries)]
+    for name, query in (('indexed', lambda start, end: sum(1 for _ in log.read_raw(start, end))),
+                        ('full scan', lambda start, end: scan_range(log, start, end))):
+        start_time = perf_counter()
+        counts = [query(start, end) for start, end in ranges]
+        elapsed = perf_counter() - start_time
+        print('{:<10} {} queries, {:.2f}ms per query, {} records'.format(
+            name, queries, elapsed / queries * 1e3, sum(counts)), file=sys.stderr)
+    start_time = perf_counter()
+    time_range = log.get_time_range()
+    print('time range: {} in {:.2f}ms'.format(time_range, (perf_counter() - start_time) * 1e3), file=sys.stderr)
+    log.close()
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--duration', type=float, default=3600, help='simulated dive duration in seconds')
+    parser.add_argument('--control-rate', type=float, default=20)
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dive.rec')
+        record_dive(path, args.duration, args.control_rate)
+        query_ranges(path, args.duration, args.queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+
+from benchmarks.session import synthetic_session
+from server.replay import ReplayServer
+
+"""Measure how fast the server replays joystick input, with and without delta mode
+
+Run with `python3 -m benchmarks.replay [--duration SECONDS] [--rate HZ]`.
+"""
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--duration', type=float, default=3600, help='simulated session duration in seconds')
+    parser.add_argument('--rate', type=float, default=20, help='joystick sample rate in Hz')
+    args = parser.parse_args()
+
+    samples = list(synthetic_session(args.duration, args.rate))
+    for delta_mode in (False, True):
+        server = ReplayServer(delta_mode=delta_mode)
+        start = perf_counter()
+        commands = sum(1 for _ in server.replay(samples))
+        elapsed = perf_counter() - start
+        print('delta_mode={!s:<5} {} samples, {} commands in {:.2f}s: {:.0f} samples/s ({:.0f}x realtime)'.format(
+            delta_mode, len(samples), commands, elapsed, len(samples) / elapsed, args.duration / elapsed),
+            file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+from argparse import ArgumentParser
+from time import perf_counter, sleep
+
+from client.arduino import Arduino
+from client.virtual_arduino import VirtualArduino
+
+"""Serial throughput and latency benchmark against a virtual Arduino
+
+Run with `python3 -m benchmarks.serial [--count N] [--rate HZ] [--emulate-baud-rate]`.
+"""
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Return the value at a fraction of the way through the sorted samples"""
+    return sorted(samples)[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def run(protocol: str, count: int, rate: float, emulate_baud_rate: bool) -> None:
+    virtual_arduino = VirtualArduino(emulate_baud_rate=emulate_baud_rate)
+    virtual_arduino.start()
+    arduino = Arduino(virtual_arduino.port, protocol)
+    arduino.connect()
+
+    # Give every command unique speeds, so that received frames can be matched to the time they were submitted
+    submit_times = {}
+    start_time = perf_counter()
+    for index in range(count):
+        motor_speeds = (1100 + index % 800,) * 6 + (index // 800 + 1,)
+        submit_times[motor_speeds] = perf_counter()
+        arduino.submit_speeds(motor_speeds)
+        if rate:
+            sleep(max(start_time + (index + 1) / rate - perf_counter(), 0))
+    arduino.stop_writer()
+    elapsed = perf_counter() - start_time
+    sleep(0.1)
+    arduino.disconnect()
+    virtual_arduino.stop()
+
+    latencies = [frame.timestamp - submit_times[frame.motor_speeds] for frame in virtual_arduino.get_valid_frames()
+                 if frame.motor_speeds in submit_times]
+    print('{:<7} received {}/{} ({} overwritten), {:.0f} frames/s, {:.0f} B/s, latency p50={:.2f}ms p95={:.2f}ms '
+          'p99={:.2f}ms'.format(protocol, len(latencies), count, arduino.writer.stats.overwrites,
+                                len(latencies) / elapsed, virtual_arduino.bytes_received / elapsed,
+                                percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.95) * 1e3,
+                                percentile(latencies, 0.99) * 1e3))
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200, help='submission rate in Hz, or 0 for as fast as possible')
+    parser.add_argument('--emulate-baud-rate', action='store_true')
+    args = parser.parse_args()
+
+    for protocol in (Arduino.PROTOCOL_ASCII, Arduino.PROTOCOL_BINARY):
+        run(protocol, args.count, args.rate, args.emulate_baud_rate)
+
+
+if __name__ == '__main__':
+    main()
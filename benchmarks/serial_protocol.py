@@ -0,0 +1,40 @@
+import random
+from timeit import Timer
+
+from client import serial_protocol
+from client.serial_protocol import CommandParser
+from client.arduino import Arduino
+
+"""Round-trip check and size comparison of the ASCII and binary Arduino command formats
+
+Run with `python3 -m benchmarks.serial_protocol`.
+"""
+
+# Bits sent per byte on the serial line (start bit, 8 data bits, stop bit)
+BITS_PER_BYTE = 10
+
+
+def main() -> None:
+    rng = random.Random(0)
+    samples = [tuple(rng.randint(1100, 1900) for _ in range(6)) + (rng.randint(-1, 1),) for _ in range(10000)]
+
+    for name, encode in (('ascii', serial_protocol.encode_ascii), ('binary', serial_protocol.encode_binary)):
+        parser = CommandParser()
+        stream = b''.join(encode(motor_speeds) for motor_speeds in samples)
+        # Feed the stream in small chunks to exercise reassembly across reads
+        decoded = []
+        for index in range(0, len(stream), 7):
+            decoded += parser.feed(stream[index:index + 7])
+        mismatches = sum(a != b for a, b in zip(samples, decoded)) + abs(len(samples) - len(decoded))
+
+        mean_size = len(stream) / len(samples)
+        wire_time = mean_size * BITS_PER_BYTE / Arduino.BAUD_RATE
+        timer = Timer(lambda: encode(samples[0]))
+        number, _ = timer.autorange()
+        encode_time = min(timer.repeat(5, number)) / number
+        print('{:<8} {:>5.1f} B/frame {:>6.2f} ms/frame on the wire {:>6.0f} ns/encode {} round-trip mismatches'.format(
+            name, mean_size, wire_time * 1e3, encode_time * 1e9, mismatches))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import math
+import random
+from time import perf_counter
+from typing import Callable, Iterator, List, Tuple
+
+from server.joystick import JoystickData
+
+"""Synthetic joystick sessions for benchmarks"""
+
+NUM_AXES = 4
+NUM_BUTTONS = 12
+
+
+def synthetic_session(duration: float, rate: float, seed: int = 0) -> Iterator[Tuple[float, JoystickData]]:
+    """Generate (timestamp, JoystickData) samples alternating between idle, cruising, and maneuvering phases
+
+    Idle phases only contain noise within the deadband, cruising phases hold the stick roughly steady, and maneuvering
+    phases sweep the stick continuously.
+    """
+    rng = random.Random(seed)
+    interval = 1 / rate
+    time = 0.0
+    while time < duration:
+        phase, phase_duration = rng.choice(('idle', 'cruise', 'maneuver')), rng.uniform(2, 20)
+        cruise_axes = [rng.uniform(-1, 1) for _ in range(3)]
+        phase_end = min(time + phase_duration, duration)
+        while time < phase_end:
+            if phase == 'idle':
+                axes = [rng.uniform(-0.05, 0.05) for _ in range(3)]
+            elif phase == 'cruise':
+                axes = [axis + rng.uniform(-0.002, 0.002) for axis in cruise_axes]
+            else:
+                axes = [math.sin(time * (index + 1)) for index in range(3)]
+            buttons = [False] * NUM_BUTTONS
+            hat = (0, 0)
+            yield time, JoystickData(axes + [-1.0], buttons, hat)
+            time += interval
+
+
+class SweepJoystick:
+    """Stand-in for server.joystick.Joystick that sweeps the forwards axis, recording when each sample was read
+
+    Every sample in a sweep produces distinct motor speeds, so that speeds seen downstream can be matched back to the
+    sample they were calculated from.
+    """
+
+    SWEEP_MIN, SWEEP_STEP, SWEEP_STEPS = 0.1, 0.005, 160
+    event_driven = False
+
+    def __init__(self, clock: Callable[[], float] = perf_counter) -> None:
+        self.clock = clock
+        self.index = 0
+        self.reads = []  # type: List[Tuple[float, JoystickData]]
+
+    def is_connected(self) -> bool:
+        return True
+
+    def connect(self) -> bool:
+        return True
+
+    def read_all(self) -> JoystickData:
+        forwards = self.SWEEP_MIN + self.SWEEP_STEP * (self.index % self.SWEEP_STEPS)
+        self.index += 1
+        joystick_data = JoystickData([0.0, -forwards, 0.0, -1.0], [False] * NUM_BUTTONS, (0, 0))
+        self.reads.append((self.clock(), joystick_data))
+        return joystick_data
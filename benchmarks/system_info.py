@@ -0,0 +1,49 @@
+from argparse import ArgumentParser
+from subprocess import check_output, CalledProcessError, DEVNULL
+from time import perf_counter
+
+from benchmarks.serial import percentile
+from client.system_info import SystemSampler, TemperatureReader
+
+"""Measure the cost per sample of the system sampler, compared with running vcgencmd for each temperature reading
+
+Run with `python3 -m benchmarks.system_info [--count N]`.
+"""
+
+
+def read_temp_vcgencmd() -> None:
+    # How the temperature was read before the sampler, forking a process for every reading
+    try:
+        check_output(['sudo', '-n', '/opt/vc/bin/vcgencmd', 'measure_temp'], stderr=DEVNULL)
+    except (OSError, CalledProcessError):
+        pass
+
+
+def measure(name: str, func, count: int) -> None:
+    times = []
+    for _ in range(count):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    print('{:<22} mean={:.1f}us p50={:.1f}us p99={:.1f}us max={:.1f}us'.format(
+        name, sum(times) / count * 1e6, percentile(times, 0.5) * 1e6, percentile(times, 0.99) * 1e6,
+        max(times) * 1e6))
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--count', type=int, default=1000)
+    args = parser.parse_args()
+
+    reader = TemperatureReader()
+    sampler = SystemSampler()
+    print('Temperature source: {}'.format('sysfs thermal zone' if reader.fd is not None else 'psutil'))
+    measure('vcgencmd subprocess', read_temp_vcgencmd, min(args.count, 100))
+    measure('temperature reader', reader.read, args.count)
+    measure('sampler.sample', sampler.sample, args.count)
+    measure('sampler.get_message', sampler.get_message, args.count)
+    reader.close()
+
+
+if __name__ == '__main__':
+    main()
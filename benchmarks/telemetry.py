@@ -0,0 +1,60 @@
+import os
+from argparse import ArgumentParser
+from time import perf_counter
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+from server.telemetry import RingBuffer, downsample_min_max
+from server.widget import SparklineWidget
+
+"""Measure the cost of redrawing a sparkline as the number of samples in its window grows
+
+Each redraw follows one frame's worth of new samples, as in the window. The cost of downsampling the whole window from
+scratch with downsample_min_max is shown for comparison.
+
+Run with `python3 -m benchmarks.telemetry [--width PIXELS] [--redraws N] [--frame-rate HZ]`.
+"""
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--width', type=int, default=308)
+    parser.add_argument('--redraws', type=int, default=300)
+    parser.add_argument('--frame-rate', type=float, default=30)
+    args = parser.parse_args()
+
+    pygame.init()
+    rng = np.random.default_rng(0)
+    duration = 60.0
+    for samples in (100, 1000, 10000, 100000, 1000000):
+        interval = duration / samples
+        buffer = RingBuffer(samples)
+        for index in range(samples):
+            buffer.append(index * interval, rng.uniform(0, 100))
+        sparkline = SparklineWidget((0, 0), (args.width, 40), buffer, duration, (0, 100))
+        sparkline.render()
+
+        per_frame = max(int(samples / duration / args.frame_rate), 1)
+        redraw_time = full_time = 0.0
+        for _ in range(args.redraws):
+            for _ in range(per_frame):
+                buffer.append(buffer.appended * interval, rng.uniform(0, 100))
+            start = perf_counter()
+            sparkline.render()
+            redraw_time += perf_counter() - start
+            end = buffer.get_last()[0]
+            start = perf_counter()
+            downsample_min_max(*buffer.get_range(end - duration, end), end - duration, end, args.width)
+            full_time += perf_counter() - start
+        print('{:>8} samples in window: {:.3f}ms per redraw ({:.3f}ms to downsample from scratch), {} bytes buffered'
+              .format(samples, redraw_time / args.redraws * 1e3, full_time / args.redraws * 1e3,
+                      buffer.times.nbytes + buffer.values.nbytes))
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import os
+from argparse import ArgumentParser
+from time import perf_counter
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+
+from server.text_render import TextRenderCache
+from server.widget import TextWidget
+
+"""Compare the cost of drawing changing telemetry numbers with the font, the render cache, and a glyph atlas
+
+Run with `python3 -m benchmarks.text [--count N] [--values N]`.
+"""
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--values', type=int, default=1000, help='number of distinct values cycled through')
+    args = parser.parse_args()
+
+    pygame.init()
+    font = pygame.font.SysFont(*TextWidget.FONT_MD)
+    color = TextWidget.DEFAULT_FG_COLOR
+    texts = ['{:>6.1f}%'.format(index % args.values / 10) for index in range(args.count)]
+    target = pygame.Surface(font.size(texts[0]), pygame.SRCALPHA)
+
+    start = perf_counter()
+    for text in texts:
+        target.blit(font.render(text, True, color), (0, 0))
+    font_time = perf_counter() - start
+
+    cache = TextRenderCache()
+    start = perf_counter()
+    for text in texts:
+        target.blit(cache.render(font, text, color), (0, 0))
+    cache_time = perf_counter() - start
+
+    atlas = cache.get_glyph_atlas(font, color)
+    start = perf_counter()
+    for text in texts:
+        atlas.blit(target, text, (0, 0))
+    atlas_time = perf_counter() - start
+
+    print('{} strings, {} distinct, {}'.format(args.count, args.values, cache))
+    for name, elapsed in (('font.render', font_time), ('render cache', cache_time), ('glyph atlas', atlas_time)):
+        print('{:<12} {:.2f}us per string'.format(name, elapsed / args.count * 1e6))
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import sys
+from argparse import ArgumentParser
+from time import perf_counter, sleep
+from typing import Tuple
+
+from client.camera_stream import CameraStream, ENCODER_H264, ENCODER_JPEG, Gst, QUALITY_LEVELS
+from client.video_quality import VideoQualityController
+
+"""Compare video encoders and quality levels on loopback
+
+A live videotestsrc is encoded and sent over UDP to a receiving pipeline in the same process, which counts the frames
+it receives. Every quality level is measured with each encoder, then the adaptive controller is run against a bitrate
+budget, with the receiver's counts as its feedback.
+
+Run with `python3 -m benchmarks.video [--pattern PATTERN] [--duration SECONDS] [--max-bitrate KBITS]`.
+"""
+
+PORT = 5600
+DEPAYLOADERS = {
+    ENCODER_JPEG: 'application/x-rtp, encoding-name=JPEG, payload=26 ! rtpjpegdepay',
+    ENCODER_H264: 'application/x-rtp, media=video, clock-rate=90000, encoding-name=H264, payload=96 ! rtph264depay'
+}
+
+
+class TestPatternStream(CameraStream):
+    """CameraStream that sends a videotestsrc pattern instead of a camera"""
+
+    @staticmethod
+    def _get_source_description(source: str, resolution: Tuple[int, int], framerate: int) -> str:
+        return 'videotestsrc is-live=true pattern={} ! video/x-raw, format=I420, width={}, height={}, ' \
+               'framerate={}/1'.format(source, resolution[0], resolution[1], framerate)
+
+
+class Receiver:
+    """Pipeline that receives and depayloads the video, counting the bytes and frames received"""
+
+    def __init__(self, encoder: str, port: int) -> None:
+        self.bytes_received = 0
+        self.frames_received = 0
+        self._pipeline = Gst.parse_launch('udpsrc name=source port={} buffer-size=4194304 ! {} name=depay ! '
+                                          'fakesink sync=false'.format(port, DEPAYLOADERS[encoder]))
+        self._pipeline.get_by_name('source').get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self._on_packet)
+        self._pipeline.get_by_name('depay').get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self._on_frame)
+        self._pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self) -> None:
+        self._pipeline.set_state(Gst.State.NULL)
+
+    def _on_packet(self, pad: Gst.Pad, info: Gst.PadProbeInfo) -> Gst.PadProbeReturn:
+        self.bytes_received += info.get_buffer().get_size()
+        return Gst.PadProbeReturn.OK
+
+    def _on_frame(self, pad: Gst.Pad, info: Gst.PadProbeInfo) -> Gst.PadProbeReturn:
+        self.frames_received += 1
+        return Gst.PadProbeReturn.OK
+
+
+def measure_level(encoder: str, pattern: str, resolution: Tuple[int, int], level: int, duration: float) -> None:
+    receiver = Receiver(encoder, PORT)
+    stream = TestPatternStream(pattern, resolution, 30, '127.0.0.1', PORT, encoder)
+    stream.set_quality(QUALITY_LEVELS[level])
+    stream.set_playing()
+    sleep(duration)
+    stream.set_stopped()
+    receiver.stop()
+    stats = stream.stats
+    print('{:<5} level {} {:<72} {:>8.0f}kbit/s {:>5.1f}fps sent {:>5} dropped {:>5} received'.format(
+        encoder, level, repr(QUALITY_LEVELS[level]), stats.bytes_sent * 8 / 1000 / duration,
+        stats.frames_sent / duration, stats.frames_dropped, receiver.frames_received), file=sys.stderr)
+
+
+def run_adaptive(encoder: str, pattern: str, resolution: Tuple[int, int], max_bitrate: float,
+                 duration: float) -> None:
+    receiver = Receiver(encoder, PORT)
+    stream = TestPatternStream(pattern, resolution, 30, '127.0.0.1', PORT, encoder)
+    controller = VideoQualityController([stream], max_bitrate)
+    stream.set_playing()
+    start = perf_counter()
+    frames_received = 0
+    frames_sent = 0
+    while perf_counter() - start < duration:
+        sleep(controller.interval)
+        # Report what the receiver got as the server would, counting frames that were sent but not received as lost
+        received = receiver.frames_received - frames_received
+        sent = stream.stats.frames_sent - frames_sent
+        frames_received, frames_sent = receiver.frames_received, stream.stats.frames_sent
+        controller.handle_feedback(received, max(sent - received, 0))
+        rates = controller.update()
+        print('{:<5} adaptive t={:>4.0f}s level {} {}'.format(encoder, perf_counter() - start, controller.level, rates),
+              file=sys.stderr)
+    stream.set_stopped()
+    receiver.stop()
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--pattern', default='ball', help='videotestsrc pattern to send')
+    parser.add_argument('--resolution', default='1280x720')
+    parser.add_argument('--duration', type=float, default=5.0, help='time to measure each quality level for')
+    parser.add_argument('--max-bitrate', type=float, default=2000,
+                        help='bitrate budget for the adaptive run, in kbit/s')
+    parser.add_argument('--adaptive-duration', type=float, default=20.0)
+    parser.add_argument('--encoders', default='jpeg,h264')
+    args = parser.parse_args()
+    resolution = tuple(int(size) for size in args.resolution.split('x'))
+
+    for encoder in args.encoders.split(','):
+        for level in range(len(QUALITY_LEVELS)):
+            measure_level(encoder, args.pattern, resolution, level, args.duration)
+    for encoder in args.encoders.split(','):
+        run_adaptive(encoder, args.pattern, resolution, args.max_bitrate, args.adaptive_duration)
+
+
+if __name__ == '__main__':
+    main()
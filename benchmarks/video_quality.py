@@ -0,0 +1,83 @@
+from typing import List, Tuple
+
+from client.camera_stream import QUALITY_LEVELS, QualityLevel, VideoStats
+from client.video_quality import VideoQualityController
+from common import logging
+
+"""Check the decisions of the adaptive video quality controller against scripted rates
+
+Fake pipelines count the bytes and frames they are told to send, and a fake clock advances one interval per update, so
+VideoQualityController.update runs exactly as it does on the client without GStreamer sending any video. Each scenario
+scripts the rates of every interval and checks the quality level the controller ends up at.
+
+Run with `python3 -m benchmarks.video_quality`.
+"""
+
+MAX_BITRATE = 2000
+FRAME_RATE = 30
+
+
+class FakePipeline:
+    """Stand-in for a VideoPipeline that only has stats and a quality level"""
+
+    def __init__(self) -> None:
+        self.stats = VideoStats()
+        self.quality_level = QUALITY_LEVELS[0]
+
+    def set_quality(self, quality_level: QualityLevel) -> None:
+        self.quality_level = quality_level
+
+
+class FakeClock:
+    """Clock that only advances when told to"""
+
+    def __init__(self) -> None:
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+
+def run_scenario(intervals: List[Tuple[float, int, int]]) -> List[int]:
+    """Return the quality level after each interval, given the (budget fraction, frames dropped, frames lost) of each"""
+    clock = FakeClock()
+    pipeline = FakePipeline()
+    controller = VideoQualityController([pipeline], MAX_BITRATE, clock=clock)
+    levels = []
+    for budget_fraction, frames_dropped, frames_lost in intervals:
+        clock.time += controller.interval
+        pipeline.stats.bytes_sent += int(MAX_BITRATE * budget_fraction * 1000 / 8 * controller.interval)
+        pipeline.stats.frames_sent += FRAME_RATE - frames_dropped
+        pipeline.stats.frames_dropped += frames_dropped
+        controller.handle_feedback(FRAME_RATE - frames_dropped - frames_lost, frames_lost)
+        controller.update()
+        assert pipeline.quality_level is QUALITY_LEVELS[controller.level]
+        levels.append(controller.level)
+    return levels
+
+
+def main() -> None:
+    logging.MIN_LEVEL = logging.LVL_WARN
+    # Each scenario is a list of (budget fraction, frames dropped, frames lost) per interval, and the expected levels
+    scenarios = [
+        ('within budget', [(0.7, 0, 0)] * 10, [0] * 10),
+        ('keyframe drops', [(0.7, 1, 0), (0.7, 0, 0), (0.7, 2, 0)] * 4, [0] * 12),
+        ('encoder behind', [(0.7, 6, 0)] * 2, [1, 2]),
+        ('network loss', [(0.7, 0, 0), (0.7, 0, 3)], [0, 1]),
+        ('over budget, recover', [(0.95, 0, 0)] + [(0.3, 0, 0)] * 6, [1, 1, 1, 1, 1, 1, 0]),
+        ('backoff doubles', [(0.95, 0, 0)] * 2 + [(0.3, 0, 0)] * 12, [1, 2] + [2] * 11 + [1]),
+    ]
+    failures = 0
+    for name, intervals, expected in scenarios:
+        levels = run_scenario(intervals)
+        passed = levels == expected
+        failures += not passed
+        print('{:<22} {} levels {}'.format(name, 'ok  ' if passed else 'FAIL', levels))
+        if not passed:
+            print('{:<27} expected {}'.format('', expected))
+    if failures:
+        raise SystemExit('{} scenarios failed'.format(failures))
+
+
+if __name__ == '__main__':
+    main()
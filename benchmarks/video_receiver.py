@@ -0,0 +1,66 @@
+import os
+import sys
+from argparse import ArgumentParser
+from time import perf_counter, sleep
+
+import pygame
+
+from benchmarks.serial import percentile
+from benchmarks.video import TestPatternStream
+from server.video_receiver import VideoReceiver, get_pixel_format
+
+"""Measure the in-process video receiver against a videotestsrc sender on loopback
+
+The sender and receiver run in the same process, and the receiver draws into a window on SDL's dummy video driver at a
+fixed frame rate. A render delay can be added to each window update to show that a slow window drops frames instead of
+building up a backlog.
+
+Run with `python3 -m benchmarks.video_receiver [--duration SECONDS] [--frame-rate HZ] [--render-delay SECONDS]`.
+"""
+
+PORT = 5602
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--encoder', default='jpeg')
+    parser.add_argument('--pattern', default='ball', help='videotestsrc pattern to send')
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--frame-rate', type=float, default=60, help='rate to update the window at')
+    parser.add_argument('--render-delay', type=float, default=0.0, help='extra time each window update takes')
+    args = parser.parse_args()
+    size = tuple(int(value) for value in args.size.split('x'))
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    surface = pygame.display.set_mode(size)
+    receiver = VideoReceiver(PORT, size, args.encoder, get_pixel_format(surface.get_bitsize(), surface.get_masks()))
+    sender = TestPatternStream(args.pattern, size, 30, '127.0.0.1', PORT, args.encoder)
+    receiver.start()
+    sender.set_playing()
+
+    draw_times = []
+    start = perf_counter()
+    deadline = start
+    while perf_counter() - start < args.duration:
+        draw_start = perf_counter()
+        if receiver.draw_frame(surface):
+            draw_times.append(perf_counter() - draw_start)
+            pygame.display.flip()
+        sleep(args.render_delay)
+        deadline += 1 / args.frame_rate
+        sleep(max(deadline - perf_counter(), 0))
+
+    sender.set_stopped()
+    receiver.stop()
+    print('Sent: {}'.format(sender.stats), file=sys.stderr)
+    print('Received: {}'.format(receiver.stats), file=sys.stderr)
+    if draw_times:
+        print('Draw: mean={:.2f}ms p99={:.2f}ms ({} frames, pixel format {})'.format(
+            sum(draw_times) / len(draw_times) * 1e3, percentile(draw_times, 0.99) * 1e3, len(draw_times),
+            receiver.pixel_format), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
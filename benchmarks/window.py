@@ -0,0 +1,99 @@
+import os
+import random
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Callable, List
+
+# Render the window without a display
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+
+from benchmarks.serial import percentile
+from server.widget import BarWidget, HorizontalLayoutWidget, LabeledContainerWidget, TextWidget, \
+    VerticalLayoutWidget, Widget
+from server.window import Window
+
+"""Frame time benchmark for the window with a large synthetic widget tree
+
+Each scenario changes a different share of the widgets every frame, from none to all of them, and "full" marks every
+widget dirty to measure the cost of redrawing the whole tree as the window did before dirty tracking.
+
+Run with `python3 -m benchmarks.window [--frames N] [--panels N]`.
+"""
+
+
+def create_tree(panels: int) -> VerticalLayoutWidget:
+    """Create a root widget filled with panels of bars and text, roughly like a telemetry display"""
+    children = []
+    for panel in range(panels):
+        bars = [BarWidget((0, 0), (20, 24), BarWidget.FROM_BOTTOM) for _ in range(8)]
+        text = TextWidget((0, 0), '{:>6.1f}'.format(0), TextWidget.FONT_SM)
+        row = HorizontalLayoutWidget((0, 0), bars + [text], alignment=HorizontalLayoutWidget.ALIGN_MIDDLE)
+        children.append(LabeledContainerWidget((0, 0), 316, row, 'PANEL {}'.format(panel)))
+    return VerticalLayoutWidget((4, 4), children=children, spacing=2, name='root')
+
+
+def find_widgets(widget: Widget, widget_type: type) -> List[Widget]:
+    """Recursively find every widget of a type"""
+    found = [widget] if isinstance(widget, widget_type) else []
+    for child in widget.children:
+        found += find_widgets(child, widget_type)
+    return found
+
+
+def run(name: str, window: Window, frames: int, change: Callable[[int], None]) -> None:
+    frame_times = []
+    for frame in range(frames):
+        start = perf_counter()
+        change(frame)
+        window.update()
+        frame_times.append(perf_counter() - start)
+    print('{:<8} mean={:.3f}ms p50={:.3f}ms p99={:.3f}ms'.format(
+        name, sum(frame_times) / len(frame_times) * 1e3, percentile(frame_times, 0.5) * 1e3,
+        percentile(frame_times, 0.99) * 1e3))
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--panels', type=int, default=12)
+    args = parser.parse_args()
+
+    pygame.init()
+    window = Window()
+    root = create_tree(args.panels)
+    window.widgets = root.get_name_dict()
+    window.show()
+
+    rng = random.Random(0)
+    all_widgets = find_widgets(root, Widget)
+    bars = find_widgets(root, BarWidget)
+    texts = find_widgets(root, TextWidget)
+    print('{} widgets, {} bars'.format(len(all_widgets), len(bars)))
+
+    def change_bars(count: int) -> Callable[[int], None]:
+        def change(frame: int) -> None:
+            for bar in rng.sample(bars, count):
+                bar.value = rng.random()
+        return change
+
+    def change_all(frame: int) -> None:
+        for widget in all_widgets:
+            widget.mark_dirty()
+
+    run('idle', window, args.frames, lambda frame: None)
+    run('one bar', window, args.frames, change_bars(1))
+    run('10% bars', window, args.frames, change_bars(len(bars) // 10))
+    run('all bars', window, args.frames, change_bars(len(bars)))
+    run('text', window, args.frames, lambda frame: setattr(texts[frame % len(texts)], 'text',
+                                                           '{:>6.1f}'.format(frame / 10)))
+    run('full', window, args.frames, change_all)
+
+    window.hide()
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
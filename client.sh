@@ -9,19 +9,69 @@
 export HOST=localhost
 export PORT=1234
 
+## Uncomment to receive motor speeds as UDP datagrams on this port.
+## Other commands are still sent over the TCP connection.
+#export UDP_PORT=1235
+
 ## Port to send video on.
 export GST_PORT=5000
 
+## Video encoder (jpeg, or h264 for software H.264 with x264).
+## This should match the encoder set in `server.sh`.
+export VIDEO_ENCODER=jpeg
+
+## Uncomment to adapt the video quality to a bitrate budget, in kbit/s.
+## The JPEG quality or H.264 bitrate, framerate, and resolution are lowered
+## when the video nears the budget or the server reports lost frames.
+#export VIDEO_MAX_BITRATE=8000
+
 ## Arduino serial port.
 ## If not set, the client will try to detect it automatically.
 ## However, you should probably set it manually if you can.
 #export ARDUINO_PORT=/dev/ttyUSB0
 
+## Format to send motor speeds to the Arduino in (ascii, binary, or auto).
+## When set to auto, the binary format is used if the Arduino supports it.
+export ARDUINO_PROTOCOL=auto
+
+## Uncomment to run the client on an asyncio event loop.
+## Receiving commands, writing to the Arduino, sending system info, and
+## switching cameras then run independently of each other.
+#export ASYNC_CLIENT=1
+
+## Uncomment to capture from every camera in a single GStreamer pipeline.
+## Switching cameras then only changes which camera is encoded, instead of
+## restarting a pipeline, at the cost of keeping every camera capturing.
+#export CAMERA_SELECTOR=1
+
+## Uncomment to also write log messages to a file, which is rotated at 10MB.
+#export LOG_FILE=/tmp/client.log
+
+## Uncomment to record every log message in a compact binary trace.
+## Print it with `python3 -m common.logging FILE`.
+#export LOG_BINARY_FILE=/tmp/client.trace
+
+## Uncomment to record every command and message (and joystick input on the
+## server) in an indexed flight recorder log, for replaying dives later.
+#export FLIGHT_RECORDER_FILE=/tmp/client.rec
+
+## Uncomment to serve the client's metrics over HTTP, as text at /metrics and
+## as JSON at /metrics.json. Set METRICS_HOST=0.0.0.0 to watch them from the
+## surface during a dive.
+#export METRICS_PORT=9100
+#export METRICS_HOST=localhost
+
+## Interval in seconds between samples of CPU usage, temperature, and memory.
+## Samples are taken on a background thread, and the latest one is sent to
+## the server every second.
+export SYSTEM_SAMPLE_INTERVAL=1.0
+
 
 echo "----------------"
 echo "HOST=$HOST"
 echo "PORT=$PORT"
 echo "GST_PORT=$GST_PORT"
+echo "VIDEO_ENCODER=$VIDEO_ENCODER"
 echo "----------------"
 
 python3 -m client
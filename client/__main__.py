@@ -1,9 +1,15 @@
+import asyncio
 import os
 from time import sleep
 
 from client.arduino import Arduino
-from client.camera_stream import CameraStream
+from client.async_client import AsyncClient
+from client.camera_stream import CameraSelector, CameraStream, ENCODER_JPEG
 from client.client import Client
+from client.system_info import SystemSampler
+from client.video_quality import VideoQualityController
+from common.metrics import MetricsServer
+from common.recorder import FlightRecorder
 
 if __name__ == '__main__':
     # Read configuration details from the environment
@@ -12,9 +18,30 @@ if __name__ == '__main__':
 
     gst_port = int(os.getenv('GST_PORT', '5000'))
     arduino_port = os.getenv('ARDUINO_PORT')
+    arduino_protocol = os.getenv('ARDUINO_PROTOCOL', Arduino.PROTOCOL_AUTO)
+    udp_port = int(os.getenv('UDP_PORT')) if os.getenv('UDP_PORT') else None
+
+    use_async_client = os.getenv('ASYNC_CLIENT') is not None
+
+    use_camera_selector = os.getenv('CAMERA_SELECTOR') is not None
+    video_encoder = os.getenv('VIDEO_ENCODER', ENCODER_JPEG)
+    video_max_bitrate = float(os.getenv('VIDEO_MAX_BITRATE')) if os.getenv('VIDEO_MAX_BITRATE') else None
+
+    system_sample_interval = float(os.getenv('SYSTEM_SAMPLE_INTERVAL', '1.0'))
+
+    flight_recorder_file = os.getenv('FLIGHT_RECORDER_FILE')
+
+    metrics_port = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None
+    metrics_host = os.getenv('METRICS_HOST', 'localhost')
+
+    # Serve metrics, if enabled
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = MetricsServer(metrics_host, metrics_port)
+        metrics_server.start()
 
     # Initialize the Arduino connection
-    arduino = Arduino(arduino_port)
+    arduino = Arduino(arduino_port, arduino_protocol)
     arduino.connect()
 
     # Initialize the camera streams
@@ -23,21 +50,53 @@ if __name__ == '__main__':
         ('/dev/video1', (1280, 720), 30),
         ('/dev/video2', (640, 480), 30)
     ]
-    camera_streams = [CameraStream(settings[0], settings[1], settings[2], host, gst_port)
-                      for settings in camera_stream_settings]
+    if use_camera_selector:
+        # Capture from every camera in one pipeline, and stream the selected camera at the highest resolution
+        camera_selector = CameraSelector(camera_stream_settings, (1280, 720), 30, host, gst_port, video_encoder)
+        camera_streams = camera_selector.inputs
+        video_pipelines = [camera_selector]
+    else:
+        camera_streams = [CameraStream(settings[0], settings[1], settings[2], host, gst_port, video_encoder)
+                          for settings in camera_stream_settings]
+        video_pipelines = camera_streams
+
+    # Adapt the video quality to the bitrate budget, if enabled
+    video_controller = None
+    if video_max_bitrate is not None:
+        video_controller = VideoQualityController(video_pipelines, video_max_bitrate)
+        video_controller.start()
 
     # Set the camera streams to PAUSED so that they are ready to send video
     for stream in camera_streams:
         stream.set_paused()
 
+    # Start sampling the state of the system in the background
+    system_sampler = SystemSampler(system_sample_interval)
+    system_sampler.start()
+
+    # Start recording commands and messages, if enabled
+    recorder = FlightRecorder(flight_recorder_file) if flight_recorder_file else None
+
     # Create the client
-    client = Client(host, port, arduino, camera_streams)
+    if use_async_client:
+        client = AsyncClient(host, port, arduino, camera_streams, system_sampler, recorder, video_controller)
+    else:
+        client = Client(host, port, arduino, camera_streams, udp_port, system_sampler, recorder, video_controller)
 
     # Set the first camera stream to PLAYING
     camera_streams[0].set_playing()
     client.active_camera_stream = camera_streams[0]
 
     # Run the client
-    while True:
-        client.connect_and_run()
-        sleep(client.RECONNECT_DELAY)
+    try:
+        if use_async_client:
+            asyncio.run(client.run())
+        else:
+            while True:
+                client.connect_and_run()
+                sleep(client.RECONNECT_DELAY)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if metrics_server is not None:
+            metrics_server.stop()
@@ -1,18 +1,41 @@
-from typing import Optional, Tuple
+from typing import Callable, Optional, Tuple
 
 import serial
 from serial.tools import list_ports
 
+from client import serial_protocol
+from client.serial_writer import SerialWriter
+from common import metrics
+from common.delta import DeltaFilter
+
+CONNECTS = metrics.counter('arduino_connects_total', 'Connections made to the Arduino')
+SERIAL_WRITE_FAILURES = metrics.counter('arduino_serial_write_failures_total', 'Failed writes to the Arduino')
+SERIAL_BYTES_WRITTEN = metrics.counter('arduino_serial_bytes_written_total', 'Bytes of motor speeds written')
+
 
 class Arduino:
     """Wrapper for a serial connection to an Arduino"""
 
     BAUD_RATE = 57600
     WRITE_TIMEOUT = 0.05
+    # Identical speeds received within this interval of the last write are not rewritten. It must be clearly shorter
+    # than the server's ControlLoop.KEEPALIVE_INTERVAL, or a keepalive that arrives slightly early is dropped and the
+    # gap between writes doubles. Keepalives then reach the Arduino within KEEPALIVE_INTERVAL plus a tick and some
+    # network jitter, well within COMMAND_TIMEOUT (250ms) in arduino/arduino.ino.
+    REFRESH_INTERVAL = 0.05
+    # Time to wait for a reply when asking the Arduino whether it supports the binary format
+    QUERY_TIMEOUT = 0.1
+
+    PROTOCOL_ASCII, PROTOCOL_BINARY, PROTOCOL_AUTO = 'ascii', 'binary', 'auto'
 
-    def __init__(self, port: str = None) -> None:
+    def __init__(self, port: str = None, protocol: str = PROTOCOL_AUTO) -> None:
         self.port = port
+        self.protocol = protocol
         self.connection = None
+        self.encode_speeds = serial_protocol.encode_ascii
+        self.write_filter = DeltaFilter((0,) * 7, self.REFRESH_INTERVAL)
+        self.bytes_written = 0
+        self.writer = SerialWriter(self.write_speeds, self._close_after_failure)
 
     def is_connected(self) -> bool:
         """Return whether the Arduino is connected"""
@@ -27,25 +50,78 @@ class Arduino:
             self.connection.baudrate = self.BAUD_RATE
             self.connection.writeTimeout = self.WRITE_TIMEOUT
             self.connection.dtr = False
+            self.write_filter.reset()
             try:
                 self.connection.open()
+                self.encode_speeds = self._negotiate_format()
+                CONNECTS.inc()
                 return True
             except serial.SerialException:
                 self.connection = None
         return False
 
-    def write_speeds(self, motor_speeds: Optional[Tuple[int, int, int, int, int, int, int]]) -> None:
-        """Write target motor speeds to the Arduino, raising serial.SerialException if the write fails"""
+    def write_speeds(self, motor_speeds: Optional[Tuple[int, int, int, int, int, int, int]]) -> bool:
+        """Write target motor speeds to the Arduino, raising serial.SerialException if the write fails
+
+        The write is skipped if the speeds are the same as the last ones written within REFRESH_INTERVAL. Returns
+        whether the speeds were written.
+        """
         if motor_speeds is None:
             motor_speeds = (1500, 1500, 1500, 1500, 1500, 1500, 0)
-        data = '!{},{},{},{},{},{},{}\n'.format(*motor_speeds)
-        self.connection.write(data.encode())
+        if not self.write_filter.should_send(motor_speeds):
+            return False
+        data = self.encode_speeds(motor_speeds)
+        try:
+            self.connection.write(data)
+        except serial.SerialException:
+            SERIAL_WRITE_FAILURES.inc()
+            raise
+        SERIAL_BYTES_WRITTEN.inc(len(data))
+        self.bytes_written += len(data)
+        return True
+
+    def submit_speeds(self, motor_speeds: Optional[Tuple[int, int, int, int, int, int, int]]) -> None:
+        """Queue target motor speeds to be written by the writer thread, replacing any that have not been written yet
+
+        This never blocks. If a write fails, the connection is closed and is_connected returns False. Speeds submitted
+        while a stopped writer thread is still writing the motors-off speeds are discarded.
+        """
+        if not self.writer.is_running():
+            self.writer.start()
+        self.writer.submit(motor_speeds)
+
+    def stop_writer(self) -> None:
+        """Stop the writer thread, making sure the motors are stopped if the Arduino is connected"""
+        if self.writer.is_running():
+            self.writer.stop(self.WRITE_TIMEOUT * 2)
+        elif self.is_connected():
+            try:
+                self.write_speeds(None)
+            except serial.SerialException:
+                pass
 
     def disconnect(self) -> None:
         """Close the connection to the Arduino"""
         if self.is_connected():
             self.connection.close()
         self.connection = None
+        self.write_filter.reset()
+
+    def _close_after_failure(self) -> None:
+        # Called by the writer thread when a write fails
+        self.connection.close()
+
+    def _negotiate_format(self) -> Callable[[Tuple[int, int, int, int, int, int, int]], bytes]:
+        # Use the binary format if requested, or if the Arduino replies to a query saying that it supports it
+        if self.protocol == self.PROTOCOL_AUTO:
+            self.connection.reset_input_buffer()
+            self.connection.timeout = self.QUERY_TIMEOUT
+            self.connection.write(serial_protocol.QUERY)
+            if self.connection.read_until(serial_protocol.BINARY_REPLY).endswith(serial_protocol.BINARY_REPLY):
+                return serial_protocol.encode_binary
+        elif self.protocol == self.PROTOCOL_BINARY:
+            return serial_protocol.encode_binary
+        return serial_protocol.encode_ascii
 
     @staticmethod
     def _detect_port() -> Optional[str]:
@@ -0,0 +1,208 @@
+import asyncio
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+import serial
+
+from common import logging
+from client.arduino import Arduino
+from client.serial_writer import WRITE_TIME
+from client.camera_stream import CameraStream
+from client.sound_player import SoundPlayer
+from client.system_info import SystemSampler
+from client.video_quality import VideoQualityController
+from common.command import SetMotorSpeedsCommand, SetCameraCommand, PlaySoundCommand, VideoFeedbackCommand
+from common.message import ArduinoConnectionMessage
+from common.recorder import FlightRecorder
+from common.protocol import BYTES_SENT, FRAMES_SENT, pack_obj, recv_obj_async
+
+T = TypeVar('T')
+
+
+class AsyncClient:
+    """Client that runs command receive, serial output, system info sampling, and camera changes as separate tasks"""
+
+    SOCKET_TIMEOUT = 0.5
+    RECONNECT_DELAY = 1.0
+    SYSTEM_INFO_INTERVAL = 1.0
+
+    def __init__(self, host: str, port: int, arduino: Arduino, camera_streams: List[CameraStream],
+                 system_sampler: Optional[SystemSampler] = None, recorder: Optional[FlightRecorder] = None,
+                 video_controller: Optional[VideoQualityController] = None) -> None:
+        self.host = host
+        self.port = port
+        self.arduino = arduino
+        self.camera_streams = camera_streams
+        self.active_camera_stream = None
+
+        self.sound_player = SoundPlayer()
+        self.system_sampler = system_sampler if system_sampler is not None else SystemSampler()
+        self.recorder = recorder
+        self.video_controller = video_controller
+
+        # Serial and GStreamer calls each run on their own thread so that they never block the event loop
+        self.serial_executor = ThreadPoolExecutor(max_workers=1)
+        self.camera_executor = ThreadPoolExecutor(max_workers=1)
+
+        self.stream_writer = None
+        self.motor_speeds = None
+        self.motor_speeds_changed = None
+        self.camera_indices = None
+
+        # Table of command handlers, indexed by command type
+        self.command_handlers = {
+            SetMotorSpeedsCommand: self.handle_set_motor_speeds,
+            SetCameraCommand: self.handle_set_camera,
+            PlaySoundCommand: self.handle_play_sound,
+            VideoFeedbackCommand: self.handle_video_feedback
+        }
+
+    async def run(self) -> None:
+        """Run the client, reconnecting to the server whenever the connection is lost"""
+        while True:
+            await self.connect_and_run()
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    async def connect_and_run(self) -> None:
+        """Connect to the server and run the client"""
+        logging.info('Connecting to server: {}:{}', self.host, self.port)
+        try:
+            stream_reader, self.stream_writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.SOCKET_TIMEOUT)
+        except (socket.error, asyncio.TimeoutError) as err:
+            logging.error('Unable to connect: {} (retrying in {}s)', err, self.RECONNECT_DELAY)
+            return
+        logging.info("Connected to server")
+        self.motor_speeds = None
+        self.motor_speeds_changed = asyncio.Event()
+        self.camera_indices = asyncio.Queue()
+        tasks = [
+            asyncio.ensure_future(self.receive_commands(stream_reader)),
+            asyncio.ensure_future(self.write_motor_speeds()),
+            asyncio.ensure_future(self.send_system_info()),
+            asyncio.ensure_future(self.change_cameras())
+        ]
+        try:
+            # Inform the server of the current state of the Arduino connection
+            await self.send_message(ArduinoConnectionMessage(self.arduino.is_connected()))
+            # Run until any of the tasks fails
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        except socket.error as err:
+            logging.error('Connection closed: {} (reconnecting in {}s)', err, self.RECONNECT_DELAY)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.stream_writer.close()
+            self.stream_writer = None
+            # If the Arduino is connected, try and stop the motors
+            await self._run_serial(self._write_speeds, None, False)
+            # Stop the currently playing sound, if any
+            self.sound_player.stop()
+
+    async def send_message(self, message: object) -> None:
+        """Send a message to the server"""
+        if self.recorder is not None:
+            self.recorder.record(message)
+        frame = pack_obj(message)
+        self.stream_writer.write(frame)
+        await self.stream_writer.drain()
+        FRAMES_SENT.inc()
+        BYTES_SENT.inc(len(frame))
+
+    async def receive_commands(self, stream_reader: asyncio.StreamReader) -> None:
+        """Receive and handle commands until the connection fails"""
+        while True:
+            command = await recv_obj_async(stream_reader, self.SOCKET_TIMEOUT)
+            self.handle_command(command)
+
+    async def write_motor_speeds(self) -> None:
+        """Write the latest motor speeds to the Arduino whenever they change, skipping any that were superseded"""
+        while True:
+            await self.motor_speeds_changed.wait()
+            self.motor_speeds_changed.clear()
+            was_connected = self.arduino.is_connected()
+            connected = await self._run_serial(self._write_speeds, self.motor_speeds, True)
+            if connected != was_connected:
+                # Inform the server that the Arduino connection state has changed
+                await self.send_message(ArduinoConnectionMessage(connected))
+
+    async def send_system_info(self) -> None:
+        """Periodically send the latest SystemInfoMessage from the system sampler"""
+        if not self.system_sampler.is_running():
+            self.system_sampler.start()
+        loop = asyncio.get_event_loop()
+        deadline = loop.time()
+        while True:
+            await self.send_message(self.system_sampler.get_message())
+            # Schedule the next sample relative to the previous deadline so that the period does not drift
+            deadline += self.SYSTEM_INFO_INTERVAL
+            await asyncio.sleep(max(deadline - loop.time(), 0))
+
+    async def change_cameras(self) -> None:
+        """Switch the active camera stream whenever a new camera index is requested"""
+        loop = asyncio.get_event_loop()
+        while True:
+            camera_index = await self.camera_indices.get()
+            await loop.run_in_executor(self.camera_executor, self._set_camera, camera_index)
+
+    def handle_command(self, command: object) -> None:
+        """Handle a command from the server"""
+        logging.debug('Server command: {}', command)
+        if self.recorder is not None:
+            self.recorder.record(command)
+        handler = self.command_handlers.get(type(command))
+        if handler is not None:
+            handler(command)
+
+    def handle_set_motor_speeds(self, command: SetMotorSpeedsCommand) -> None:
+        """Handle a request for new motor speeds"""
+        self.motor_speeds = command.motor_speeds
+        self.motor_speeds_changed.set()
+
+    def handle_set_camera(self, command: SetCameraCommand) -> None:
+        """Handle a request for a new camera index"""
+        self.camera_indices.put_nowait(command.camera_index)
+
+    def handle_play_sound(self, command: PlaySoundCommand) -> None:
+        """Handle a request to play a sound"""
+        # Stop the currently playing sound, if any
+        self.sound_player.stop()
+        # If a sound filename was provided, play the sound
+        if command.filename is not None:
+            self.sound_player.play(command.filename, command.vol_mb, command.amp_mb)
+
+    def handle_video_feedback(self, command: VideoFeedbackCommand) -> None:
+        """Handle a report of the video frames received by the server"""
+        if self.video_controller is not None:
+            self.video_controller.handle_feedback(command.frames_received, command.frames_lost)
+
+    async def _run_serial(self, func: Callable[..., T], *args) -> T:
+        return await asyncio.get_event_loop().run_in_executor(self.serial_executor, func, *args)
+
+    def _write_speeds(self, motor_speeds: Optional[Tuple[int, int, int, int, int, int, int]], connect: bool) -> bool:
+        # Runs on the serial thread, returning whether the Arduino is connected afterwards
+        # Try and connect to the Arduino if it is not connected
+        if connect and not self.arduino.is_connected():
+            self.arduino.connect()
+        if self.arduino.is_connected():
+            start_time = perf_counter()
+            try:
+                if self.arduino.write_speeds(motor_speeds):
+                    WRITE_TIME.observe(perf_counter() - start_time)
+            except serial.SerialException:
+                # Error writing motor speeds, disconnect
+                self.arduino.disconnect()
+        return self.arduino.is_connected()
+
+    def _set_camera(self, camera_index: int) -> None:
+        # Runs on the camera thread
+        # Set the currently playing camera stream to PAUSED
+        self.active_camera_stream.set_paused()
+        # Set the the new camera stream to PLAYING
+        self.active_camera_stream = self.camera_streams[camera_index]
+        self.active_camera_stream.set_playing()
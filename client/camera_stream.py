@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import List, Tuple
 
 import gi
 
@@ -7,28 +7,216 @@ from gi.repository import Gst
 
 Gst.init(None)
 
+"""GStreamer video streams from the cameras to the server
 
-class CameraStream:
-    """Wrapper for a GStreamer V4L2 video stream"""
+Each CameraStream is a separate pipeline, so switching cameras pauses one pipeline and plays another, which restarts
+capture and renegotiates the encoder. A CameraSelector instead keeps every camera capturing in a single pipeline,
+joined by an input-selector in front of one shared encoder and payloader, so switching cameras only changes the
+selector's active pad. Its inputs can be used in place of CameraStreams.
+
+Both send video as JPEG or software H.264, and their quality can be changed while they are playing (see
+client.video_quality).
+"""
+
+ENCODER_JPEG = 'jpeg'
+ENCODER_H264 = 'h264'
+
+
+class QualityLevel:
+    """Settings for the quality of a video stream, relative to the resolution and framerate of its source"""
+
+    def __init__(self, scale: float, framerate: int, jpeg_quality: int, h264_bitrate: int) -> None:
+        self.scale = scale
+        self.framerate = framerate
+        self.jpeg_quality = jpeg_quality
+        # In kbit/s
+        self.h264_bitrate = h264_bitrate
+
+    def __repr__(self) -> str:
+        return 'QualityLevel(scale={}, framerate={}, jpeg_quality={}, h264_bitrate={})' \
+            .format(self.scale, self.framerate, self.jpeg_quality, self.h264_bitrate)
+
+
+# Quality levels from best to worst. The first level streams the source as it is captured.
+QUALITY_LEVELS = [
+    QualityLevel(1.0, 30, 85, 4000),
+    QualityLevel(1.0, 30, 65, 3000),
+    QualityLevel(1.0, 20, 50, 2000),
+    QualityLevel(0.75, 20, 50, 1500),
+    QualityLevel(0.5, 15, 50, 1000),
+    QualityLevel(0.5, 10, 35, 500)
+]
+
+
+class VideoStats:
+    """Counters for the video sent by a pipeline, updated from its streaming thread"""
+
+    def __init__(self) -> None:
+        self.bytes_sent = 0
+        self.packets_sent = 0
+        self.frames_sent = 0
+        # Frames dropped because the encoder could not keep up
+        self.frames_dropped = 0
 
-    def __init__(self, source: str, resolution: Tuple[int, int], framerate: int, host: str, port: int) -> None:
-        self._pipeline = self._create_pipeline(source, resolution, framerate, host, port)
+    def __repr__(self) -> str:
+        return 'VideoStats(bytes_sent={}, packets_sent={}, frames_sent={}, frames_dropped={})' \
+            .format(self.bytes_sent, self.packets_sent, self.frames_sent, self.frames_dropped)
+
+
+class VideoPipeline:
+    """Base for GStreamer pipelines that encode raw video and send it to the server over RTP
+
+    The raw video passes through a capsfilter that sets the resolution and framerate sent, and a leaky queue in front
+    of the encoder, so that frames are dropped rather than delayed when the encoder falls behind.
+    """
+
+    def __init__(self, source_args: str, resolution: Tuple[int, int], framerate: int, encoder: str, host: str,
+                 port: int) -> None:
+        self.resolution = resolution
+        self.framerate = framerate
+        self.encoder = encoder
+        self.quality_level = QUALITY_LEVELS[0]
+        self.stats = VideoStats()
+
+        pipeline_args = '{} ! videorate drop-only=true ! videoscale ! capsfilter name=output caps="{}" ! ' \
+                        'queue name=encoder_queue leaky=downstream max-size-buffers=1 ! {} ! {}'.format(
+                            source_args, self._get_output_caps(self.quality_level),
+                            self._get_encoder_description(encoder, framerate, self.quality_level),
+                            self._get_sink_description(host, port))
+        self._pipeline = Gst.parse_launch(pipeline_args)
+        self._output = self._pipeline.get_by_name('output')
+        self._encoder = self._pipeline.get_by_name('encoder')
+        self._pipeline.get_by_name('encoder_queue').connect('overrun', self._on_overrun)
+        self._encoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self._on_frame)
+        self._pipeline.get_by_name('sink').get_static_pad('sink').add_probe(
+            Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self._on_packets)
+
+    def set_quality(self, quality_level: QualityLevel) -> None:
+        """Change the quality of the video while it is playing
+
+        Changing the encoder quality takes effect on the next frame. Changing the resolution or framerate renegotiates
+        the encoder, which interrupts the video briefly.
+        """
+        if self.encoder == ENCODER_H264:
+            self._encoder.set_property('bitrate', quality_level.h264_bitrate)
+        else:
+            self._encoder.set_property('quality', quality_level.jpeg_quality)
+        if (quality_level.scale, quality_level.framerate) != (self.quality_level.scale, self.quality_level.framerate):
+            self._output.set_property('caps', Gst.Caps.from_string(self._get_output_caps(quality_level)))
+        self.quality_level = quality_level
 
     def set_playing(self) -> None:
-        """Set the video stream state to PLAYING"""
+        """Set the pipeline state to PLAYING"""
         self._pipeline.set_state(Gst.State.PLAYING)
 
     def set_paused(self) -> None:
-        """Set the video stream state to PAUSED"""
+        """Set the pipeline state to PAUSED"""
         self._pipeline.set_state(Gst.State.PAUSED)
 
     def set_stopped(self) -> None:
-        """Set the video stream state to NULL"""
+        """Set the pipeline state to NULL"""
         self._pipeline.set_state(Gst.State.NULL)
 
+    def _get_output_caps(self, quality_level: QualityLevel) -> str:
+        # Encoders need even dimensions
+        width = int(self.resolution[0] * quality_level.scale) // 2 * 2
+        height = int(self.resolution[1] * quality_level.scale) // 2 * 2
+        return 'video/x-raw, width={}, height={}, framerate={}/1'.format(
+            width, height, min(quality_level.framerate, self.framerate))
+
+    @staticmethod
+    def _get_encoder_description(encoder: str, framerate: int, quality_level: QualityLevel) -> str:
+        if encoder == ENCODER_H264:
+            # Send a keyframe every second and the stream configuration with each one, so the server can join late
+            return 'x264enc name=encoder tune=zerolatency speed-preset=ultrafast bitrate={} key-int-max={} ! ' \
+                   'rtph264pay config-interval=-1 pt=96'.format(quality_level.h264_bitrate, framerate)
+        if encoder == ENCODER_JPEG:
+            return 'jpegenc name=encoder quality={} ! rtpjpegpay'.format(quality_level.jpeg_quality)
+        raise ValueError('unknown video encoder: {}'.format(encoder))
+
+    @staticmethod
+    def _get_source_description(source: str, resolution: Tuple[int, int], framerate: int) -> str:
+        return 'v4l2src device="{}" ! video/x-raw, format=I420, width={}, height={}, framerate={}/1' \
+            .format(source, resolution[0], resolution[1], framerate)
+
     @staticmethod
-    def _create_pipeline(source: str, resolution: Tuple[int, int], framerate: int, host: str, port: int) -> Gst.Element:
-        pipeline_args = 'v4l2src device="{}" ! video/x-raw, format=I420, width={}, height={}, framerate={}/1 ! ' \
-                        'jpegenc ! rtpjpegpay ! udpsink host="{}" port={}' \
-            .format(source, resolution[0], resolution[1], framerate, host, port)
-        return Gst.parse_launch(pipeline_args)
+    def _get_sink_description(host: str, port: int) -> str:
+        return 'udpsink name=sink host="{}" port={}'.format(host, port)
+
+    def _on_overrun(self, queue: Gst.Element) -> None:
+        self.stats.frames_dropped += 1
+
+    def _on_frame(self, pad: Gst.Pad, info: Gst.PadProbeInfo) -> Gst.PadProbeReturn:
+        self.stats.frames_sent += 1
+        return Gst.PadProbeReturn.OK
+
+    def _on_packets(self, pad: Gst.Pad, info: Gst.PadProbeInfo) -> Gst.PadProbeReturn:
+        if info.type & Gst.PadProbeType.BUFFER_LIST:
+            buffers = info.get_buffer_list()
+            for index in range(buffers.length()):
+                self.stats.bytes_sent += buffers.get(index).get_size()
+            self.stats.packets_sent += buffers.length()
+        else:
+            self.stats.bytes_sent += info.get_buffer().get_size()
+            self.stats.packets_sent += 1
+        return Gst.PadProbeReturn.OK
+
+
+class CameraStream(VideoPipeline):
+    """Wrapper for a GStreamer V4L2 video stream"""
+
+    def __init__(self, source: str, resolution: Tuple[int, int], framerate: int, host: str, port: int,
+                 encoder: str = ENCODER_JPEG) -> None:
+        super().__init__(self._get_source_description(source, resolution, framerate), resolution, framerate, encoder,
+                         host, port)
+
+
+class CameraSelector(VideoPipeline):
+    """Single GStreamer pipeline that captures from every camera and streams the selected one
+
+    Every source is scaled to the same resolution and framerate, so the shared encoder never has to renegotiate when
+    the selected source changes. Keeping every camera capturing costs some CPU and USB bandwidth on the client.
+    """
+
+    def __init__(self, sources: List[Tuple[str, Tuple[int, int], int]], resolution: Tuple[int, int], framerate: int,
+                 host: str, port: int, encoder: str = ENCODER_JPEG) -> None:
+        branches = []
+        for index, (source, source_resolution, source_framerate) in enumerate(sources):
+            # Inactive sources are dropped by the selector, and the leaky queue stops a stalled camera blocking others
+            branches.append('{} ! videoscale ! videorate ! video/x-raw, format=I420, width={}, height={}, '
+                            'framerate={}/1 ! queue leaky=downstream max-size-buffers=2 ! selector.sink_{}'
+                            .format(self._get_source_description(source, source_resolution, source_framerate),
+                                    resolution[0], resolution[1], framerate, index))
+        super().__init__('{} input-selector name=selector'.format(' '.join(branches)), resolution, framerate, encoder,
+                         host, port)
+        self._selector = self._pipeline.get_by_name('selector')
+        self.inputs = [SelectorInput(self, index) for index in range(len(sources))]
+
+    def select(self, index: int) -> None:
+        """Stream the source with an index, without interrupting the pipeline"""
+        self._selector.set_property('active-pad', self._selector.get_static_pad('sink_{}'.format(index)))
+
+
+class SelectorInput:
+    """Source of a CameraSelector, with the same interface as a CameraStream
+
+    Playing an input selects it, and pausing it does nothing, since the source keeps capturing so that it can be
+    selected again immediately.
+    """
+
+    def __init__(self, selector: CameraSelector, index: int) -> None:
+        self.selector = selector
+        self.index = index
+
+    def set_playing(self) -> None:
+        """Select this input, starting the selector's pipeline if needed"""
+        self.selector.select(self.index)
+        self.selector.set_playing()
+
+    def set_paused(self) -> None:
+        """Do nothing, since the next input to be played replaces this one"""
+        pass
+
+    def set_stopped(self) -> None:
+        """Stop the selector's pipeline"""
+        self.selector.set_stopped()
@@ -1,17 +1,27 @@
 import socket
-from typing import List
+import threading
+from select import select
+from time import perf_counter
+from typing import List, Optional
 
-import serial
-
-from common import logging
+from common import logging, metrics
 from client.arduino import Arduino
 from client.camera_stream import CameraStream
 from client.sound_player import SoundPlayer
-from client.system_info import get_system_info_message
-from common.command import SetMotorSpeedsCommand, SetCameraCommand, PlaySoundCommand
-from common.message import ArduinoConnectionMessage
-from common.protocol import send_obj, recv_obj
-from common.timer import Timer
+from client.system_info import SystemSampler
+from client.video_quality import VideoQualityController
+from common.command import SetMotorSpeedsCommand, SetCameraCommand, PlaySoundCommand, VideoFeedbackCommand
+from common.datagram import DatagramReceiver
+from common.message import ArduinoConnectionMessage, DatagramChannelMessage
+from common.recorder import FlightRecorder
+from common.protocol import FrameReader, send_obj, recv_obj, recv_all_obj
+from common.timer import PeriodicScheduler, Timer
+
+CONNECTS = metrics.counter('client_connects_total', 'Connections made to the server')
+CONNECT_FAILURES = metrics.counter('client_connect_failures_total', 'Failed attempts to connect to the server')
+DISCONNECTS = metrics.counter('client_disconnects_total', 'Connections to the server that were closed')
+CONNECTED = metrics.gauge('client_connected', 'Whether the client is connected to the server')
+COMMAND_TIME = metrics.histogram('client_command_seconds', 'Time taken to handle a command from the server')
 
 
 class Client:
@@ -19,16 +29,36 @@ class Client:
     RECONNECT_DELAY = 1.0
     SYSTEM_INFO_INTERVAL = 1.0
 
-    def __init__(self, host: str, port: int, arduino: Arduino, camera_streams: List[CameraStream]) -> None:
+    def __init__(self, host: str, port: int, arduino: Arduino, camera_streams: List[CameraStream],
+                 datagram_port: Optional[int] = None, system_sampler: Optional[SystemSampler] = None,
+                 recorder: Optional[FlightRecorder] = None,
+                 video_controller: Optional[VideoQualityController] = None) -> None:
         self.host = host
         self.port = port
+        self.datagram_port = datagram_port
         self.arduino = arduino
         self.camera_streams = camera_streams
         self.active_camera_stream = None
 
         self.sound_player = SoundPlayer()
+        self.system_sampler = system_sampler if system_sampler is not None else SystemSampler()
+        self.recorder = recorder
+        self.video_controller = video_controller
 
         self.sock = None
+        self.datagram_receiver = None
+        self.arduino_connected = False
+        # Held while sending to the server, since system info is sent from the scheduler thread
+        self.send_lock = threading.Lock()
+        self.scheduler = PeriodicScheduler('client-scheduler')
+
+        # Table of command handlers, indexed by command type
+        self.command_handlers = {
+            SetMotorSpeedsCommand: self.handle_set_motor_speeds,
+            SetCameraCommand: self.handle_set_camera,
+            PlaySoundCommand: self.handle_play_sound,
+            VideoFeedbackCommand: self.handle_video_feedback
+        }
 
     def connect_and_run(self) -> None:
         """Connect to the server and run the client"""
@@ -39,59 +69,140 @@ class Client:
             self.sock.connect((self.host, self.port))
         except socket.error as err:
             logging.error('Unable to connect: {} (retrying in {}s)', err, self.RECONNECT_DELAY)
+            CONNECT_FAILURES.inc()
             return
         logging.info("Connected to server")
-        # Initialize a timer to periodically send a SystemInfoMessage
-        send_system_info_timer = Timer(self.SYSTEM_INFO_INTERVAL, start_expired=True)
+        CONNECTS.inc()
+        CONNECTED.set(1)
+        if not self.system_sampler.is_running():
+            self.system_sampler.start()
+        if not self.scheduler.is_running():
+            self.scheduler.start()
+        reader = FrameReader(self.sock)
+        system_info_job = None
         try:
             # Inform the server of the current state of the Arduino connection
-            send_obj(self.sock, ArduinoConnectionMessage(self.arduino.is_connected()))
+            self.arduino_connected = self.arduino.is_connected()
+            self.send_message(ArduinoConnectionMessage(self.arduino_connected))
+            # Periodically send the latest SystemInfoMessage, starting now
+            system_info_job = self.scheduler.add_job('system-info', self.SYSTEM_INFO_INTERVAL, self.send_system_info,
+                                                     delay=0)
+            # Ask the server to send motor speeds as datagrams, if enabled
+            if self.datagram_port is not None:
+                self.open_datagram_channel()
+            receive_timer = Timer(self.SOCKET_TIMEOUT)
             while True:
-                # Send a SystemInfoMessage if send_stats_interval has elapsed
-                if send_system_info_timer.is_expired():
-                    send_obj(self.sock, get_system_info_message())
-                    send_system_info_timer.restart()
                 # Receive and handle a command
-                command = recv_obj(self.sock, self.SOCKET_TIMEOUT)
-                self.handle_command(command)
+                if self.datagram_receiver is None:
+                    command = recv_obj(reader, self.SOCKET_TIMEOUT)
+                    self.handle_command(command)
+                else:
+                    self.receive_commands(reader, receive_timer)
         except socket.error as err:
             logging.error('Connection closed: {} (reconnecting in {}s)', err, self.RECONNECT_DELAY)
         finally:
-            self.sock.close()
+            DISCONNECTS.inc()
+            CONNECTED.set(0)
+            if system_info_job is not None:
+                self.scheduler.remove_job(system_info_job)
+                logging.debug('System info: {}', system_info_job)
+            with self.send_lock:
+                self.sock.close()
+            if self.datagram_receiver is not None:
+                logging.info('Datagram channel closed: {}', self.datagram_receiver.stats)
+                self.datagram_receiver.sock.close()
+                self.datagram_receiver = None
             # If the Arduino is connected, try and stop the motors
-            if self.arduino.is_connected():
-                try:
-                    self.arduino.write_speeds(None)
-                except serial.SerialException:
-                    pass
+            self.arduino.stop_writer()
+            logging.debug('Serial writer: {}', self.arduino.writer.stats)
             # Stop the currently playing sound, if any
             self.sound_player.stop()
 
+    def send_message(self, message: object) -> None:
+        """Send a message to the server"""
+        if self.recorder is not None:
+            self.recorder.record(message)
+        with self.send_lock:
+            send_obj(self.sock, message)
+
+    def send_system_info(self, jitter: float) -> None:
+        """Send the latest SystemInfoMessage from the system sampler"""
+        try:
+            self.send_message(self.system_sampler.get_message())
+        except socket.error as err:
+            # The main thread will notice the broken connection when it next reads from it
+            logging.debug('Unable to send system info: {}', err)
+
+    def open_datagram_channel(self) -> None:
+        """Bind a UDP socket and ask the server to send motor speeds to it"""
+        datagram_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            datagram_sock.bind(('', self.datagram_port))
+        except socket.error as err:
+            logging.error('Unable to open datagram channel: {} (using TCP only)', err)
+            datagram_sock.close()
+            return
+        self.datagram_receiver = DatagramReceiver(datagram_sock)
+        self.send_message(DatagramChannelMessage(self.datagram_port))
+
+    def receive_commands(self, reader: FrameReader, receive_timer: Timer) -> None:
+        """Receive and handle commands from both channels
+
+        Raises socket.error if no commands arrive before the timer expires.
+        """
+        commands = recv_all_obj(reader)
+        # Motor speeds are the only commands sent as datagrams, so only the newest one matters
+        commands += self.datagram_receiver.recv_all()[-1:]
+        if commands:
+            receive_timer.restart()
+            for command in commands:
+                self.handle_command(command)
+        elif receive_timer.is_expired():
+            raise socket.error('timed out')
+        else:
+            select([self.sock, self.datagram_receiver.sock], [], [], receive_timer.get_remaining_time())
+
     def handle_command(self, command: object) -> None:
         """Handle a command from the server"""
+        start_time = perf_counter()
         logging.debug('Server command: {}', command)
-        if isinstance(command, SetMotorSpeedsCommand):  # Server requested new motor speeds
-            # Try and connect to the Arduino if it is not connected
-            if not self.arduino.is_connected() and self.arduino.connect():
-                # Inform the server that the Arduino connection state has changed
-                send_obj(self.sock, ArduinoConnectionMessage(True))
-            # Try and write the motor speeds to the Arduino if it is connected
-            if self.arduino.is_connected():
-                try:
-                    self.arduino.write_speeds(command.motor_speeds)
-                except serial.SerialException:
-                    # Error writing motor speeds, disconnect and inform the server
-                    self.arduino.disconnect()
-                    send_obj(self.sock, ArduinoConnectionMessage(False))
-        elif isinstance(command, SetCameraCommand):  # Server requested new camera index
-            # Set the currently playing camera stream to PAUSED
-            self.active_camera_stream.set_paused()
-            # Set the the new camera stream to PLAYING
-            self.active_camera_stream = self.camera_streams[command.camera_index]
-            self.active_camera_stream.set_playing()
-        elif isinstance(command, PlaySoundCommand):  # Server requested that a sound be played
-            # Stop the currently playing sound, if any
-            self.sound_player.stop()
-            # If a sound filename was provided, play the sound
-            if command.filename is not None:
-                self.sound_player.play(command.filename, command.vol_mb, command.amp_mb)
+        if self.recorder is not None:
+            self.recorder.record(command)
+        handler = self.command_handlers.get(type(command))
+        if handler is not None:
+            handler(command)
+        COMMAND_TIME.observe(perf_counter() - start_time)
+
+    def handle_set_motor_speeds(self, command: SetMotorSpeedsCommand) -> None:
+        """Handle a request for new motor speeds"""
+        # Try and connect to the Arduino if it is not connected
+        if not self.arduino.is_connected():
+            self.arduino.connect()
+        # Queue the motor speeds to be written to the Arduino if it is connected, without waiting for the write
+        if self.arduino.is_connected():
+            self.arduino.submit_speeds(command.motor_speeds)
+        # Inform the server if the Arduino connection state has changed, including after a failed write
+        if self.arduino.is_connected() != self.arduino_connected:
+            self.arduino_connected = self.arduino.is_connected()
+            self.send_message(ArduinoConnectionMessage(self.arduino_connected))
+
+    def handle_set_camera(self, command: SetCameraCommand) -> None:
+        """Handle a request for a new camera index"""
+        # Set the currently playing camera stream to PAUSED
+        self.active_camera_stream.set_paused()
+        # Set the the new camera stream to PLAYING
+        self.active_camera_stream = self.camera_streams[command.camera_index]
+        self.active_camera_stream.set_playing()
+
+    def handle_play_sound(self, command: PlaySoundCommand) -> None:
+        """Handle a request to play a sound"""
+        # Stop the currently playing sound, if any
+        self.sound_player.stop()
+        # If a sound filename was provided, play the sound
+        if command.filename is not None:
+            self.sound_player.play(command.filename, command.vol_mb, command.amp_mb)
+
+    def handle_video_feedback(self, command: VideoFeedbackCommand) -> None:
+        """Handle a report of the video frames received by the server"""
+        if self.video_controller is not None:
+            self.video_controller.handle_feedback(command.frames_received, command.frames_lost)
@@ -0,0 +1,108 @@
+import struct
+from binascii import crc_hqx
+from typing import List, Optional, Tuple
+
+"""Encoding and decoding of motor speed commands sent to the Arduino
+
+Two formats are supported by arduino/arduino.ino:
+
+- ASCII: '!' followed by seven comma-separated integers and a newline, for example `!1500,1500,...,0\\n`
+- Binary: SYNC_BYTE, seven little-endian int16 values, and a little-endian CRC-16/XMODEM of those values
+
+A newline-terminated line starting with QUERY_START asks the Arduino which formats it supports. Firmware that supports
+the binary format replies with BINARY_REPLY, while older firmware ignores the query.
+"""
+
+MotorSpeeds = Tuple[int, int, int, int, int, int, int]
+
+ASCII_START = ord('!')
+QUERY_START = ord('?')
+SYNC_BYTE = 0xA5
+QUERY = b'?\n'
+BINARY_REPLY = b'BIN1\n'
+
+_PAYLOAD_STRUCT = struct.Struct('<7h')
+_BINARY_STRUCT = struct.Struct('<B7hH')
+BINARY_FRAME_SIZE = _BINARY_STRUCT.size
+
+# Maximum length of an ASCII command, matching COMMAND_BUFSIZE in arduino/arduino.ino
+ASCII_MAX_LENGTH = 127
+
+
+def encode_ascii(motor_speeds: MotorSpeeds) -> bytes:
+    """Encode motor speeds in the ASCII format"""
+    return '!{},{},{},{},{},{},{}\n'.format(*motor_speeds).encode()
+
+
+def encode_binary(motor_speeds: MotorSpeeds) -> bytes:
+    """Encode motor speeds in the binary format"""
+    return _BINARY_STRUCT.pack(SYNC_BYTE, *motor_speeds, crc_hqx(_PAYLOAD_STRUCT.pack(*motor_speeds), 0))
+
+
+def decode_binary(frame: bytes) -> MotorSpeeds:
+    """Decode a single binary frame, raising ValueError if it is malformed or fails its CRC"""
+    if len(frame) != BINARY_FRAME_SIZE or frame[0] != SYNC_BYTE:
+        raise ValueError('malformed binary frame')
+    fields = _BINARY_STRUCT.unpack(frame)
+    if crc_hqx(frame[1:-2], 0) != fields[-1]:
+        raise ValueError('CRC mismatch')
+    return fields[1:-1]
+
+
+def decode_ascii(line: bytes) -> MotorSpeeds:
+    """Decode a single ASCII command including its newline, raising ValueError if it is malformed"""
+    if not line or line[0] != ASCII_START or not line.endswith(b'\n'):
+        raise ValueError('malformed ASCII command')
+    fields = line[1:-1].split(b',')
+    if len(fields) != 7:
+        raise ValueError('expected 7 fields, got {}'.format(len(fields)))
+    return tuple(int(field) for field in fields)
+
+
+class CommandParser:
+    """Reference implementation of the command parser in arduino/arduino.ino
+
+    Bytes are fed in as they arrive, and each complete command is returned as its motor speeds, or None if it was
+    invalid. Bytes that do not start a command are skipped, and queries are recorded in queries_received.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.queries_received = 0
+
+    def feed(self, data: bytes) -> List[Optional[MotorSpeeds]]:
+        """Feed received bytes to the parser, returning any commands they complete"""
+        self.buffer += data
+        commands = []
+        while self.buffer:
+            start = self.buffer[0]
+            if start == SYNC_BYTE:
+                if len(self.buffer) < BINARY_FRAME_SIZE:
+                    break
+                frame = bytes(self.buffer[:BINARY_FRAME_SIZE])
+                del self.buffer[:BINARY_FRAME_SIZE]
+                try:
+                    commands.append(decode_binary(frame))
+                except ValueError:
+                    commands.append(None)
+            elif start == ASCII_START or start == QUERY_START:
+                end = self.buffer.find(b'\n')
+                if end < 0:
+                    if len(self.buffer) > ASCII_MAX_LENGTH:
+                        # Line too long, discard it
+                        del self.buffer[:]
+                        commands.append(None)
+                    break
+                line = bytes(self.buffer[:end + 1])
+                del self.buffer[:end + 1]
+                if start == QUERY_START:
+                    self.queries_received += 1
+                    continue
+                try:
+                    commands.append(decode_ascii(line))
+                except ValueError:
+                    commands.append(None)
+            else:
+                # Skip bytes until the start of a command
+                del self.buffer[:1]
+        return commands
@@ -0,0 +1,124 @@
+import threading
+from time import perf_counter
+from typing import Callable, Optional, Tuple
+
+import serial
+
+from common import metrics
+
+MotorSpeeds = Optional[Tuple[int, int, int, int, int, int, int]]
+
+# Upper bounds of the write latency histogram buckets in seconds, the last bucket counting everything slower
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05)
+WRITE_TIME = metrics.histogram('arduino_serial_write_seconds', 'Time taken to write motor speeds to the Arduino',
+                               LATENCY_BUCKETS)
+
+
+class SerialWriterStats:
+    """Counters for a SerialWriter, and the write latency histogram in the metrics registry
+
+    The histogram is shared by every writer in the process, of which there is normally only one.
+    """
+
+    def __init__(self) -> None:
+        self.writes = 0
+        self.skipped = 0
+        self.overwrites = 0
+        self.failures = 0
+        self.latency = WRITE_TIME
+
+    def add_latency(self, latency: float) -> None:
+        """Record the duration of a single write, in seconds"""
+        self.latency.observe(latency)
+
+    def __repr__(self) -> str:
+        buckets = ['<={:g}ms: {}'.format(bound * 1e3, count)
+                   for bound, count in zip(self.latency.buckets, self.latency.counts)]
+        buckets.append('>{:g}ms: {}'.format(self.latency.buckets[-1] * 1e3, self.latency.counts[-1]))
+        return 'SerialWriterStats(writes={}, skipped={}, overwrites={}, failures={}, latency=[{}])' \
+            .format(self.writes, self.skipped, self.overwrites, self.failures, ', '.join(buckets))
+
+
+class SerialWriter:
+    """Background thread that writes motor speeds to the Arduino through a single-slot mailbox
+
+    Submitting never blocks. If the previous speeds have not been written yet they are overwritten, so the Arduino
+    always receives the newest speeds and a stalled serial port never builds up a backlog.
+    """
+
+    def __init__(self, write_speeds: Callable[[MotorSpeeds], bool], on_failure: Callable[[], None]) -> None:
+        self.write_speeds = write_speeds
+        self.on_failure = on_failure
+        self.stats = SerialWriterStats()
+
+        self._condition = threading.Condition()
+        self._pending = False
+        self._motor_speeds = None
+        self._stopping = False
+        self._thread = None
+
+    def is_running(self) -> bool:
+        """Return whether the writer thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """Start the writer thread, returning False if a previous writer thread has not exited yet"""
+        if self.is_running():
+            return False
+        self._stopping = False
+        self._pending = False
+        self._thread = threading.Thread(target=self._run, name='serial-writer', daemon=True)
+        self._thread.start()
+        return True
+
+    def submit(self, motor_speeds: MotorSpeeds) -> None:
+        """Replace the speeds waiting to be written
+
+        Once the thread is stopping, only the motors-off speeds (None) are accepted, so they are never replaced.
+        """
+        with self._condition:
+            if self._stopping and motor_speeds is not None:
+                return
+            if self._pending:
+                self.stats.overwrites += 1
+            self._motor_speeds = motor_speeds
+            self._pending = True
+            self._condition.notify()
+
+    def stop(self, timeout: float) -> None:
+        """Write the motors-off speeds in place of any pending speeds, then stop the writer thread
+
+        If the thread is still blocked in a write after timeout seconds, it is left to write the motors-off speeds and
+        exit on its own, and is_running returns True until it has.
+        """
+        with self._condition:
+            if self._pending:
+                self.stats.overwrites += 1
+            self._motor_speeds = None
+            self._pending = True
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                motor_speeds, self._pending = self._motor_speeds, False
+            start_time = perf_counter()
+            try:
+                written = self.write_speeds(motor_speeds)
+            except serial.SerialException:
+                self.stats.failures += 1
+                self.on_failure()
+                return
+            if written:
+                self.stats.add_latency(perf_counter() - start_time)
+                self.stats.writes += 1
+            else:
+                self.stats.skipped += 1
@@ -1,31 +1,129 @@
-from subprocess import check_output, CalledProcessError, DEVNULL
+import glob
+import os
+import threading
+from time import perf_counter
 from typing import Optional
 
 import psutil
 
 from common.message import SystemInfoMessage
 
+"""Sampling of the state of the client's system
 
-def get_cpu_usage() -> float:
-    """Return the current system-wide CPU usage percentage"""
-    return psutil.cpu_percent()
+SystemSampler samples on its own thread and caches the latest SystemInfoMessage, so that sending system info never
+waits on the system. The CPU temperature is read from a sysfs thermal zone that is held open between samples, falling
+back to psutil where there is no suitable thermal zone.
+"""
+
+
+class TemperatureReader:
+    """Reader for the CPU temperature that keeps its sysfs thermal zone open between reads"""
+
+    THERMAL_ZONE_PATTERN = '/sys/class/thermal/thermal_zone*'
+    # Thermal zone types and psutil sensor names that measure the CPU, in order of preference
+    CPU_ZONE_TYPES = ('cpu-thermal', 'cpu_thermal', 'soc_thermal', 'x86_pkg_temp')
+    CPU_SENSOR_NAMES = ('cpu_thermal', 'cpu-thermal', 'coretemp', 'k10temp')
+
+    def __init__(self) -> None:
+        self.fd = self._open_thermal_zone()
+
+    def read(self) -> Optional[float]:
+        """Return the current CPU temperature (if available) in degrees celsius"""
+        if self.fd is not None:
+            try:
+                return int(os.pread(self.fd, 16, 0)) / 1000
+            except (OSError, ValueError):
+                return None
+        return self._read_sensors()
+
+    def close(self) -> None:
+        """Close the thermal zone, if it is open"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _open_thermal_zone(self) -> Optional[int]:
+        zones = {}
+        for zone in sorted(glob.glob(self.THERMAL_ZONE_PATTERN)):
+            try:
+                with open(os.path.join(zone, 'type')) as file:
+                    zones.setdefault(file.read().strip(), zone)
+            except OSError:
+                pass
+        # Use the first zone measuring the CPU, or otherwise the first zone, which is the SoC on a Raspberry Pi
+        zone = next((zones[zone_type] for zone_type in self.CPU_ZONE_TYPES if zone_type in zones),
+                    next(iter(zones.values()), None))
+        if zone is None:
+            return None
+        try:
+            return os.open(os.path.join(zone, 'temp'), os.O_RDONLY)
+        except OSError:
+            return None
+
+    def _read_sensors(self) -> Optional[float]:
+        sensors = getattr(psutil, 'sensors_temperatures', lambda: {})()
+        for name in self.CPU_SENSOR_NAMES:
+            if sensors.get(name):
+                return sensors[name][0].current
+
+
+class SystemSampler:
+    """Thread that samples the state of the system at a fixed interval, caching the latest SystemInfoMessage
+
+    The first sample is taken when the sampler is started, so get_message always has a message to return after that.
+    """
 
+    def __init__(self, interval: float = 1.0) -> None:
+        self.interval = interval
+        self.temperature_reader = TemperatureReader()
+        self.message = None
+        self.samples = 0
 
-def get_cpu_temp() -> Optional[float]:
-    """Return the current CPU temperature (if available) in degrees celsius"""
-    # TODO: Use psutil to detect temperature when not running on a Raspberry Pi
-    try:
-        temp_str = check_output(['sudo', '-n', '/opt/vc/bin/vcgencmd', 'measure_temp'], stderr=DEVNULL)
-        return float(temp_str.replace(b'temp=', b'').replace(b'\'C', b''))
-    except (OSError, CalledProcessError, ValueError):
-        pass
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def is_running(self) -> bool:
+        """Return whether the sampler thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Take a first sample, then start the sampler thread"""
+        self.sample()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='system-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the sampler thread and wait for it to exit"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sample(self) -> SystemInfoMessage:
+        """Sample the state of the system, replacing the cached message"""
+        self.message = SystemInfoMessage(get_cpu_usage(), self.temperature_reader.read(), get_mem_usage())
+        self.samples += 1
+        return self.message
+
+    def get_message(self) -> Optional[SystemInfoMessage]:
+        """Return the most recently sampled message without blocking, or None if nothing has been sampled yet"""
+        return self.message
+
+    def _run(self) -> None:
+        deadline = perf_counter()
+        while True:
+            deadline += self.interval
+            if self._stopped.wait(max(deadline - perf_counter(), 0)):
+                return
+            self.sample()
+
+
+def get_cpu_usage() -> float:
+    """Return the system-wide CPU usage percentage since the previous call"""
+    return psutil.cpu_percent()
 
 
 def get_mem_usage() -> float:
     """Return the current system-wide memory usage percentage"""
     return psutil.virtual_memory().percent
-
-
-def get_system_info_message() -> SystemInfoMessage:
-    """Return a SystemInfoMessage containing information about the current state of the system"""
-    return SystemInfoMessage(get_cpu_usage(), get_cpu_temp(), get_mem_usage())
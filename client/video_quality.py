@@ -0,0 +1,163 @@
+import threading
+from time import perf_counter
+from typing import Callable, List
+
+from client.camera_stream import QUALITY_LEVELS, VideoPipeline
+from common import logging
+
+"""Adaptive quality control for the video streams
+
+VideoQualityController measures how fast the video streams are sending, and how many frames the server reports as
+lost, and steps through QUALITY_LEVELS to keep the video within a bitrate budget. It steps down as soon as the budget
+is nearly used or more than a few frames are being lost or dropped, and only steps back up after the video has
+comfortably fit the budget for a few intervals. The number of intervals doubles every time it steps down, so that it
+settles on a level that fits instead of oscillating between two levels.
+"""
+
+
+class VideoRates:
+    """Rates measured over a single interval of a VideoQualityController"""
+
+    def __init__(self, bitrate: float, frame_rate: float, frames_sent: int, frames_dropped: int, frames_received: int,
+                 frames_lost: int) -> None:
+        # In kbit/s
+        self.bitrate = bitrate
+        self.frame_rate = frame_rate
+        self.frames_sent = frames_sent
+        self.frames_dropped = frames_dropped
+        self.frames_received = frames_received
+        self.frames_lost = frames_lost
+
+    def get_dropped(self) -> float:
+        """Return the fraction of frames dropped before the encoder, or 0 if there were none"""
+        frames = self.frames_sent + self.frames_dropped
+        return self.frames_dropped / frames if frames else 0.0
+
+    def get_loss(self) -> float:
+        """Return the fraction of frames reported lost by the server, or 0 if it did not report any"""
+        frames = self.frames_received + self.frames_lost
+        return self.frames_lost / frames if frames else 0.0
+
+    def __repr__(self) -> str:
+        return 'VideoRates(bitrate={:.0f}kbit/s, frame_rate={:.1f}fps, frames_sent={}, frames_dropped={}, ' \
+               'frames_received={}, frames_lost={})'.format(self.bitrate, self.frame_rate, self.frames_sent,
+                                                            self.frames_dropped, self.frames_received,
+                                                            self.frames_lost)
+
+
+class VideoQualityController:
+    """Thread that adapts the quality of video pipelines to a bitrate budget
+
+    Every pipeline is kept at the same quality level, and the rates are measured across all of them, since only the
+    active camera is sending at any time.
+    """
+
+    # Step down when the bitrate exceeds HIGH_WATERMARK of the budget, and step up after UP_INTERVALS intervals below
+    # LOW_WATERMARK of the budget, doubling up to MAX_UP_INTERVALS intervals every time it steps down
+    HIGH_WATERMARK = 0.9
+    LOW_WATERMARK = 0.6
+    UP_INTERVALS = 3
+    MAX_UP_INTERVALS = 48
+    # Fraction of frames reported lost by the server before stepping down
+    MAX_LOSS = 0.02
+    # Fraction of frames dropped before the encoder before stepping down, above the one or two frames that a single
+    # slow frame such as an H.264 keyframe can drop from the encoder's queue
+    MAX_DROPPED = 0.1
+
+    def __init__(self, pipelines: List[VideoPipeline], max_bitrate: float, interval: float = 1.0,
+                 clock: Callable[[], float] = perf_counter) -> None:
+        self.pipelines = pipelines
+        self.clock = clock
+        # In kbit/s
+        self.max_bitrate = max_bitrate
+        self.interval = interval
+        self.level = 0
+        self.rates = None
+        self.intervals_below = 0
+        self.up_intervals = self.UP_INTERVALS
+
+        self._lock = threading.Lock()
+        self._frames_received = 0
+        self._frames_lost = 0
+        self._last_counts = self._get_counts()
+        self._last_time = clock()
+
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def is_running(self) -> bool:
+        """Return whether the controller thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the controller thread"""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='video-quality', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the controller thread and wait for it to exit"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def handle_feedback(self, frames_received: int, frames_lost: int) -> None:
+        """Record the number of frames the server received and lost since its last report"""
+        with self._lock:
+            self._frames_received += frames_received
+            self._frames_lost += frames_lost
+
+    def update(self) -> VideoRates:
+        """Measure the rates since the last update, then change the quality level if needed"""
+        now = self.clock()
+        counts = self._get_counts()
+        elapsed = now - self._last_time
+        bytes_sent, frames_sent, frames_dropped = (count - last_count
+                                                   for count, last_count in zip(counts, self._last_counts))
+        self._last_counts, self._last_time = counts, now
+        with self._lock:
+            frames_received, frames_lost = self._frames_received, self._frames_lost
+            self._frames_received = self._frames_lost = 0
+        self.rates = VideoRates(bytes_sent * 8 / 1000 / elapsed, frames_sent / elapsed, frames_sent, frames_dropped,
+                                frames_received, frames_lost)
+
+        level = self.level
+        if self.rates.bitrate > self.max_bitrate * self.HIGH_WATERMARK or self.rates.get_loss() > self.MAX_LOSS \
+                or self.rates.get_dropped() > self.MAX_DROPPED:
+            if level < len(QUALITY_LEVELS) - 1:
+                level += 1
+                self.up_intervals = min(self.up_intervals * 2, self.MAX_UP_INTERVALS)
+            self.intervals_below = 0
+        elif self.rates.bitrate < self.max_bitrate * self.LOW_WATERMARK:
+            self.intervals_below += 1
+            if self.intervals_below >= self.up_intervals:
+                level = max(level - 1, 0)
+                self.intervals_below = 0
+        else:
+            self.intervals_below = 0
+        if level != self.level:
+            logging.info('Video quality level {} -> {}: {}', self.level, level, self.rates)
+            self.set_level(level)
+        else:
+            logging.debug('Video: {}', self.rates)
+        return self.rates
+
+    def set_level(self, level: int) -> None:
+        """Set every pipeline to a quality level"""
+        self.level = level
+        for pipeline in self.pipelines:
+            pipeline.set_quality(QUALITY_LEVELS[level])
+
+    def _get_counts(self) -> tuple:
+        return (sum(pipeline.stats.bytes_sent for pipeline in self.pipelines),
+                sum(pipeline.stats.frames_sent for pipeline in self.pipelines),
+                sum(pipeline.stats.frames_dropped for pipeline in self.pipelines))
+
+    def _run(self) -> None:
+        deadline = perf_counter()
+        while True:
+            deadline += self.interval
+            if self._stopped.wait(max(deadline - perf_counter(), 0)):
+                return
+            self.update()
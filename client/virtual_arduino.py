@@ -0,0 +1,140 @@
+import os
+import threading
+import tty
+from select import select
+from time import perf_counter, sleep
+from typing import List, Optional, Tuple
+
+from client import serial_protocol
+from client.arduino import Arduino
+from client.serial_protocol import CommandParser, MotorSpeeds
+
+"""Software emulation of arduino/arduino.ino over a pseudo-terminal
+
+The virtual Arduino opens a pty and parses everything written to it like the firmware does, so Arduino(port=...) can
+connect to it unchanged. Run with `python3 -m client.virtual_arduino` to print the pty path and log every command.
+"""
+
+# The maximum time to wait for a command, in seconds, matching COMMAND_TIMEOUT in arduino/arduino.ino
+COMMAND_TIMEOUT = 0.25
+
+MOTORS_OFF = (1500, 1500, 1500, 1500, 1500, 1500, 0)
+
+
+class ReceivedFrame:
+    """A single command received by the virtual Arduino"""
+
+    def __init__(self, timestamp: float, motor_speeds: Optional[MotorSpeeds]) -> None:
+        self.timestamp = timestamp
+        self.motor_speeds = motor_speeds
+
+    def __repr__(self) -> str:
+        return 'ReceivedFrame(timestamp={:.6f}, motor_speeds={})'.format(self.timestamp, self.motor_speeds)
+
+
+class VirtualArduino:
+    """Emulated Arduino on a pseudo-terminal, recording every command it receives
+
+    Timestamps come from time.perf_counter. If emulate_baud_rate is set, each command is timestamped when its last byte
+    would have finished arriving over a real serial line at Arduino.BAUD_RATE.
+    """
+
+    BITS_PER_BYTE = 10
+
+    def __init__(self, supports_binary: bool = True, emulate_baud_rate: bool = False) -> None:
+        self.supports_binary = supports_binary
+        self.emulate_baud_rate = emulate_baud_rate
+
+        self.frames = []  # type: List[ReceivedFrame]
+        self.motor_speeds = MOTORS_OFF
+        self.failsafe_count = 0
+        self.bytes_received = 0
+
+        self._master_fd, self._slave_fd = os.openpty()
+        # Disable echo and line processing, so that bytes pass through unchanged like on a real serial port
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+
+        self._parser = CommandParser()
+        self._line_free_time = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """Start emulating the Arduino on a background thread"""
+        self._thread = threading.Thread(target=self._run, name='virtual-arduino', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop emulating the Arduino and close the pseudo-terminal"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+
+    def get_valid_frames(self) -> List[ReceivedFrame]:
+        """Return every received command that was valid"""
+        return [frame for frame in self.frames if frame.motor_speeds is not None]
+
+    def _run(self) -> None:
+        last_valid_time = perf_counter()
+        while not self._stopped.is_set():
+            # Wait for data until the command timeout expires
+            remaining = max(last_valid_time + COMMAND_TIMEOUT - perf_counter(), 0)
+            if select([self._master_fd], [], [], min(remaining, 0.05))[0]:
+                try:
+                    data = os.read(self._master_fd, 4096)
+                except OSError:
+                    return
+                for timestamp, motor_speeds in self._receive(data):
+                    self.frames.append(ReceivedFrame(timestamp, motor_speeds))
+                    if motor_speeds is not None:
+                        last_valid_time = perf_counter()
+                    self._apply(motor_speeds)
+            elif perf_counter() - last_valid_time >= COMMAND_TIMEOUT:
+                # Timed out waiting for a command, stop the motors like the firmware does
+                if self.motor_speeds != MOTORS_OFF:
+                    self.failsafe_count += 1
+                self._apply(None)
+                last_valid_time = perf_counter()
+
+    def _receive(self, data: bytes) -> List[Tuple[float, Optional[MotorSpeeds]]]:
+        now = perf_counter()
+        self.bytes_received += len(data)
+        queries_received = self._parser.queries_received
+        commands = self._parser.feed(data)
+        if self.supports_binary and self._parser.queries_received > queries_received:
+            os.write(self._master_fd, serial_protocol.BINARY_REPLY)
+        if not self.emulate_baud_rate:
+            return [(now, motor_speeds) for motor_speeds in commands]
+        # Spread the commands over the time the data would have taken to arrive
+        byte_time = self.BITS_PER_BYTE / Arduino.BAUD_RATE
+        start_time = max(now, self._line_free_time)
+        self._line_free_time = start_time + len(data) * byte_time
+        received = []
+        for index, motor_speeds in enumerate(commands):
+            timestamp = start_time + (index + 1) * (self._line_free_time - start_time) / len(commands)
+            received.append((timestamp, motor_speeds))
+        return received
+
+    def _apply(self, motor_speeds: Optional[MotorSpeeds]) -> None:
+        self.motor_speeds = motor_speeds if motor_speeds is not None else MOTORS_OFF
+
+
+if __name__ == '__main__':
+    virtual_arduino = VirtualArduino()
+    virtual_arduino.start()
+    print('Virtual Arduino listening on {}'.format(virtual_arduino.port))
+    printed = 0
+    try:
+        while True:
+            sleep(0.1)
+            for frame in virtual_arduino.frames[printed:]:
+                print(frame)
+            printed = len(virtual_arduino.frames)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        virtual_arduino.stop()
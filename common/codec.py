@@ -0,0 +1,108 @@
+import struct
+from typing import Callable, Dict, Tuple
+
+from common.command import SetMotorSpeedsCommand, SetCameraCommand, PlaySoundCommand, VideoFeedbackCommand
+from common.message import SystemInfoMessage, ArduinoConnectionMessage, DatagramChannelMessage, ClientConnectionMessage
+
+"""Compact binary encoding for commands and messages
+
+Every encoded object is a type id byte followed by a fixed struct layout specific to its type. Types with a single
+variable-length string field append it to the end of the fixed layout as UTF-8, since the frame length is already known.
+"""
+
+
+class Schema:
+    """Binary layout of a single command or message type"""
+
+    def __init__(self, type_id: int, cls: type, fmt: str, to_fields: Callable[[object], tuple],
+                 from_fields: Callable[..., object], has_tail: bool = False) -> None:
+        self.type_id = type_id
+        self.cls = cls
+        self.struct = struct.Struct('!B' + fmt)
+        self.to_fields = to_fields
+        self.from_fields = from_fields
+        self.has_tail = has_tail
+
+
+_schemas_by_id = {}  # type: Dict[int, Schema]
+_schemas_by_cls = {}  # type: Dict[type, Schema]
+
+
+def register(schema: Schema) -> None:
+    """Register a schema, raising ValueError if its type id or class is already registered"""
+    if schema.type_id in _schemas_by_id or schema.cls in _schemas_by_cls:
+        raise ValueError('schema already registered: {}'.format(schema.cls.__name__))
+    _schemas_by_id[schema.type_id] = schema
+    _schemas_by_cls[schema.cls] = schema
+
+
+def encode(obj: object) -> bytes:
+    """Encode a registered command or message, raising ValueError if its type is not registered"""
+    schema = _schemas_by_cls.get(type(obj))
+    if schema is None:
+        raise ValueError('no schema registered for {}'.format(type(obj).__name__))
+    fields = schema.to_fields(obj)
+    if schema.has_tail:
+        return schema.struct.pack(schema.type_id, *fields[:-1]) + fields[-1].encode()
+    return schema.struct.pack(schema.type_id, *fields)
+
+
+def decode(data: bytes) -> object:
+    """Decode a command or message, raising ValueError if the data is malformed"""
+    if not data:
+        raise ValueError('empty frame')
+    schema = _schemas_by_id.get(data[0])
+    if schema is None:
+        raise ValueError('unknown type id: {}'.format(data[0]))
+    if schema.has_tail:
+        if len(data) < schema.struct.size:
+            raise ValueError('truncated frame for {}'.format(schema.cls.__name__))
+        fields = schema.struct.unpack_from(data)[1:] + (bytes(data[schema.struct.size:]).decode(),)
+    else:
+        try:
+            fields = schema.struct.unpack(data)[1:]
+        except struct.error as err:
+            raise ValueError('malformed frame for {}: {}'.format(schema.cls.__name__, err))
+    return schema.from_fields(*fields)
+
+
+def _motor_speeds_to_fields(command: SetMotorSpeedsCommand) -> tuple:
+    if command.motor_speeds is None:
+        return (False,) + (0,) * 7
+    return (True,) + tuple(command.motor_speeds)
+
+
+def _motor_speeds_from_fields(has_speeds: bool, *motor_speeds: int) -> SetMotorSpeedsCommand:
+    return SetMotorSpeedsCommand(motor_speeds if has_speeds else None)
+
+
+def _system_info_to_fields(message: SystemInfoMessage) -> tuple:
+    has_temp = message.cpu_temp is not None
+    return message.cpu_usage, has_temp, message.cpu_temp if has_temp else 0.0, message.mem_usage
+
+
+def _system_info_from_fields(cpu_usage: float, has_temp: bool, cpu_temp: float, mem_usage: float) -> SystemInfoMessage:
+    return SystemInfoMessage(cpu_usage, cpu_temp if has_temp else None, mem_usage)
+
+
+def _play_sound_to_fields(command: PlaySoundCommand) -> Tuple[bool, int, int, str]:
+    return command.filename is not None, command.vol_mb, command.amp_mb, command.filename or ''
+
+
+def _play_sound_from_fields(has_filename: bool, vol_mb: int, amp_mb: int, filename: str) -> PlaySoundCommand:
+    return PlaySoundCommand(filename if has_filename else None, vol_mb, amp_mb)
+
+
+# Commands (server -> client)
+register(Schema(0x01, SetMotorSpeedsCommand, '?7h', _motor_speeds_to_fields, _motor_speeds_from_fields))
+register(Schema(0x02, SetCameraCommand, 'B', lambda c: (c.camera_index,), SetCameraCommand))
+register(Schema(0x03, PlaySoundCommand, '?ii', _play_sound_to_fields, _play_sound_from_fields, has_tail=True))
+register(Schema(0x04, VideoFeedbackCommand, 'II', lambda c: (c.frames_received, c.frames_lost), VideoFeedbackCommand))
+
+# Messages (client -> server)
+register(Schema(0x81, SystemInfoMessage, 'd?dd', _system_info_to_fields, _system_info_from_fields))
+register(Schema(0x82, ArduinoConnectionMessage, '?', lambda m: (m.connected,), ArduinoConnectionMessage))
+register(Schema(0x83, DatagramChannelMessage, 'H', lambda m: (m.port,), DatagramChannelMessage))
+
+# Messages (server -> observers)
+register(Schema(0x84, ClientConnectionMessage, '?', lambda m: (m.connected,), ClientConnectionMessage))
@@ -33,3 +33,14 @@ class PlaySoundCommand:
 
     def __repr__(self) -> str:
         return 'PlaySoundCommand(filename={!r}, vol_mb={}, amp_mb={})'.format(self.filename, self.vol_mb, self.amp_mb)
+
+
+class VideoFeedbackCommand:
+    """Report how many video frames were received and lost since the previous report, so the client can adapt"""
+
+    def __init__(self, frames_received: int, frames_lost: int) -> None:
+        self.frames_received = frames_received
+        self.frames_lost = frames_lost
+
+    def __repr__(self) -> str:
+        return 'VideoFeedbackCommand(frames_received={}, frames_lost={})'.format(self.frames_received, self.frames_lost)
@@ -0,0 +1,105 @@
+import socket
+import struct
+from time import time
+from typing import List, Optional, Tuple
+
+from common import codec
+
+"""Unreliable, unordered channel for "latest value wins" commands
+
+Each datagram contains a sequence number and send timestamp followed by a single encoded object. Receivers drop any
+datagram that is older than the newest one they have accepted, so a lost datagram never delays the ones after it.
+Latency is measured against the sender's wall clock, so it is only meaningful if the clocks are synchronized (for
+example, when testing on loopback).
+"""
+
+_HEADER_STRUCT = struct.Struct('!Id')
+_SEQUENCE_MODULUS = 1 << 32
+
+MAX_DATAGRAM_SIZE = 512
+
+
+class DatagramSender:
+    """Sends sequenced objects to a single address"""
+
+    def __init__(self, sock: socket, addr: Tuple[str, int]) -> None:
+        self.sock = sock
+        self.addr = addr
+        self.sequence = 0
+
+    def send(self, obj: object) -> None:
+        """Send an object as a single datagram"""
+        self.sequence = (self.sequence + 1) % _SEQUENCE_MODULUS
+        self.sock.sendto(_HEADER_STRUCT.pack(self.sequence, time()) + codec.encode(obj), self.addr)
+
+
+class DatagramStats:
+    """Counters describing the datagrams seen by a receiver"""
+
+    def __init__(self) -> None:
+        self.received = 0
+        self.accepted = 0
+        self.lost = 0
+        self.late = 0
+        self.malformed = 0
+        self.latency_last = 0.0
+        self.latency_max = 0.0
+        self.latency_total = 0.0
+
+    def get_latency_mean(self) -> float:
+        """Return the mean latency of accepted datagrams in seconds"""
+        return self.latency_total / self.accepted if self.accepted else 0.0
+
+    def __repr__(self) -> str:
+        return 'DatagramStats(received={}, accepted={}, lost={}, late={}, malformed={}, latency_mean={:.2f}ms, ' \
+               'latency_max={:.2f}ms)'.format(self.received, self.accepted, self.lost, self.late, self.malformed,
+                                              self.get_latency_mean() * 1e3, self.latency_max * 1e3)
+
+
+class DatagramReceiver:
+    """Receives sequenced objects, dropping any that arrive out of order
+
+    Sequence numbers skipped over by an accepted datagram are counted as lost, and datagrams that arrive after a newer
+    one has been accepted are counted as late. A datagram that arrives late was previously counted as lost.
+    """
+
+    def __init__(self, sock: socket) -> None:
+        self.sock = sock
+        self.sequence = None
+        self.stats = DatagramStats()
+
+    def accept(self, data: bytes) -> Optional[object]:
+        """Parse a datagram, returning its object, or None if it is stale or malformed"""
+        self.stats.received += 1
+        try:
+            sequence, timestamp = _HEADER_STRUCT.unpack_from(data)
+            obj = codec.decode(memoryview(data)[_HEADER_STRUCT.size:])
+        except (struct.error, ValueError):
+            self.stats.malformed += 1
+            return None
+        if self.sequence is not None:
+            # Compare sequence numbers using serial number arithmetic so that wrapping around is handled
+            delta = (sequence - self.sequence) % _SEQUENCE_MODULUS
+            if delta == 0 or delta >= _SEQUENCE_MODULUS // 2:
+                self.stats.late += 1
+                return None
+            self.stats.lost += delta - 1
+        self.sequence = sequence
+        latency = time() - timestamp
+        self.stats.accepted += 1
+        self.stats.latency_last = latency
+        self.stats.latency_max = max(self.stats.latency_max, latency)
+        self.stats.latency_total += latency
+        return obj
+
+    def recv_all(self) -> List[object]:
+        """Read every datagram that is available without blocking, returning the objects that were accepted"""
+        objs = []
+        while True:
+            try:
+                data = self.sock.recv(MAX_DATAGRAM_SIZE, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return objs
+            obj = self.accept(data)
+            if obj is not None:
+                objs.append(obj)
@@ -0,0 +1,46 @@
+from time import perf_counter
+from typing import Callable, Optional, Sequence
+
+
+class DeltaFilter:
+    """Decides whether a value needs to be sent, based on how much it has changed and when it was last sent
+
+    A value is sent if any element differs from the last sent value by more than its threshold, if it changes to or
+    from None, or if keepalive_interval seconds have passed since the last send.
+    """
+
+    def __init__(self, thresholds: Sequence[float], keepalive_interval: float,
+                 clock: Callable[[], float] = perf_counter) -> None:
+        self.thresholds = tuple(thresholds)
+        self.keepalive_interval = keepalive_interval
+        self.clock = clock
+        self.last_value = None
+        self.last_send_time = None
+        self.sent = 0
+        self.skipped = 0
+
+    def should_send(self, value: Optional[Sequence[float]]) -> bool:
+        """Return whether a value needs to be sent, recording it as sent if so"""
+        now = self.clock()
+        if self.last_send_time is None or now - self.last_send_time >= self.keepalive_interval \
+                or self._changed(value):
+            self.last_value = value
+            self.last_send_time = now
+            self.sent += 1
+            return True
+        self.skipped += 1
+        return False
+
+    def reset(self) -> None:
+        """Forget the last sent value, so that the next value is always sent"""
+        self.last_value = None
+        self.last_send_time = None
+
+    def _changed(self, value: Optional[Sequence[float]]) -> bool:
+        last_value = self.last_value
+        if value is None or last_value is None:
+            return value is not last_value
+        for element, last_element, threshold in zip(value, last_value, self.thresholds):
+            if abs(element - last_element) > threshold:
+                return True
+        return False
@@ -1,42 +1,377 @@
+import atexit
 import os
+import queue
+import struct
 import sys
+import threading
 from datetime import datetime
+from time import time
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+"""Non-blocking logging
+
+Logging functions only check the level and enqueue the record. A writer thread formats records and writes them to
+standard output (or standard error for warnings and above), and optionally to a rotating text file and a compact binary
+trace. If the queue is full, records are dropped rather than blocking the caller. Arguments other than numbers,
+strings, booleans and None are converted to strings when they are enqueued, so that an object that changes afterwards
+is logged as it was.
+
+Text output is rate-limited per message: beyond RATE_LIMIT identical messages in a RATE_WINDOW, repeats are coalesced
+into a single line counting how many were suppressed, written when the window ends. The binary trace is not
+rate-limited, so it holds every record.
+
+Configuration comes from the environment:
+
+- DEBUG: log records with level DEBUG
+- LOG_FILE: path of a text log file, rotated when it exceeds LOG_FILE_MAX_BYTES with LOG_FILE_BACKUPS old files kept
+- LOG_BINARY_FILE: path of a binary trace, which can be printed with `python3 -m common.logging FILE`
+"""
 
 LVL_DEBUG, LVL_INFO, LVL_WARN, LVL_ERROR, LVL_FATAL = range(5)
+LEVEL_NAMES = ('DEBUG', 'INFO', 'WARN', 'ERROR', 'FATAL')
 
 MIN_LEVEL = LVL_DEBUG if os.getenv('DEBUG') is not None else LVL_INFO
 
+LOG_FILE = os.getenv('LOG_FILE')
+LOG_FILE_MAX_BYTES = int(os.getenv('LOG_FILE_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_FILE_BACKUPS = int(os.getenv('LOG_FILE_BACKUPS', '3'))
+LOG_BINARY_FILE = os.getenv('LOG_BINARY_FILE')
+
+QUEUE_SIZE = 4096
+RATE_WINDOW = 1.0
+RATE_LIMIT = 20
+
+# Binary trace format: a magic header, then a definition record the first time each format string is used, and a
+# record for every message referring to its format string by index. Arguments are tagged with their type.
+BINARY_MAGIC = b'ROVLOG1\n'
+_DEFINITION_STRUCT = struct.Struct('<cHH')
+_RECORD_STRUCT = struct.Struct('<cdBHB')
+_INT_STRUCT = struct.Struct('<q')
+_FLOAT_STRUCT = struct.Struct('<d')
+_LENGTH_STRUCT = struct.Struct('<H')
+
+Record = Tuple[int, float, str, tuple]
+
+# Types of arguments that are enqueued as they are, along with None, since they cannot change before being formatted
+_IMMUTABLE_TYPES = (int, float, str)
+
+
+class LogStats:
+    """Counters for the records passing through the logging queue"""
+
+    def __init__(self) -> None:
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __repr__(self) -> str:
+        return 'LogStats(enqueued={}, written={}, dropped={}, coalesced={})' \
+            .format(self.enqueued, self.written, self.dropped, self.coalesced)
+
+
+class RotatingFile:
+    """File that is renamed to path.1 (shifting older files up to path.backups) once it reaches max_bytes"""
+
+    def __init__(self, path: str, max_bytes: int, backups: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(path, 'ab')
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+
+    def is_full(self) -> bool:
+        """Return whether the file has reached max_bytes and should be rotated"""
+        return self.file.tell() >= self.max_bytes
+
+    def rotate(self) -> None:
+        """Close the file, shift the backups, and start a new file"""
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists('{}.{}'.format(self.path, index)):
+                os.replace('{}.{}'.format(self.path, index), '{}.{}'.format(self.path, index + 1))
+        if self.backups:
+            os.replace(self.path, '{}.1'.format(self.path))
+        self.file = open(self.path, 'wb')
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+class BinaryTraceWriter:
+    """Writer for the compact binary trace format"""
+
+    def __init__(self, file: RotatingFile) -> None:
+        self.file = file
+        self.format_ids = {}  # type: Dict[str, int]
+        if file.file.tell() == 0:
+            file.write(BINARY_MAGIC)
+        else:
+            # Appending to an existing trace, whose format definitions are unknown, so start a new file
+            self._start_new_file()
+
+    def write(self, record: Record) -> None:
+        level, timestamp, fmt, args = record
+        parts = []
+        if fmt not in self.format_ids:
+            self.format_ids[fmt] = len(self.format_ids)
+            encoded = fmt.encode()
+            parts.append(_DEFINITION_STRUCT.pack(b'F', self.format_ids[fmt], len(encoded)) + encoded)
+        parts.append(_RECORD_STRUCT.pack(b'R', timestamp, level, self.format_ids[fmt], len(args)))
+        for arg in args:
+            if isinstance(arg, bool) or arg is None:
+                parts.append(b'?' if arg is None else b'T' if arg else b'F')
+            elif isinstance(arg, int) and -2 ** 63 <= arg < 2 ** 63:
+                parts.append(b'i' + _INT_STRUCT.pack(arg))
+            elif isinstance(arg, float):
+                parts.append(b'f' + _FLOAT_STRUCT.pack(arg))
+            else:
+                encoded = str(arg).encode()[:0xFFFF]
+                parts.append(b's' + _LENGTH_STRUCT.pack(len(encoded)) + encoded)
+        self.file.write(b''.join(parts))
+        if self.file.is_full():
+            self._start_new_file()
+
+    def _start_new_file(self) -> None:
+        # Each file has its own header and format definitions, so that it can be read on its own
+        self.file.rotate()
+        self.file.write(BINARY_MAGIC)
+        self.format_ids.clear()
+
+
+def read_binary_trace(file: BinaryIO) -> Iterator[Tuple[float, int, str]]:
+    """Read a binary trace, yielding (timestamp, level, message) for every record"""
+    if file.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError('not a binary log trace')
+    formats = {}  # type: Dict[int, str]
+    while True:
+        kind = file.read(1)
+        if not kind:
+            return
+        if kind == b'F':
+            format_id, length = _DEFINITION_STRUCT.unpack(kind + file.read(_DEFINITION_STRUCT.size - 1))[1:]
+            formats[format_id] = file.read(length).decode()
+        elif kind == b'R':
+            _, timestamp, level, format_id, argc = _RECORD_STRUCT.unpack(kind + file.read(_RECORD_STRUCT.size - 1))
+            args = []
+            for _ in range(argc):
+                tag = file.read(1)
+                if tag == b'i':
+                    args.append(_INT_STRUCT.unpack(file.read(_INT_STRUCT.size))[0])
+                elif tag == b'f':
+                    args.append(_FLOAT_STRUCT.unpack(file.read(_FLOAT_STRUCT.size))[0])
+                elif tag == b's':
+                    length = _LENGTH_STRUCT.unpack(file.read(_LENGTH_STRUCT.size))[0]
+                    args.append(file.read(length).decode(errors='replace'))
+                else:
+                    args.append({b'?': None, b'T': True, b'F': False}[tag])
+            yield timestamp, level, formats[format_id].format(*args)
+        else:
+            raise ValueError('malformed binary log trace')
 
-def _fmt_log_msg(lvl: str, fmt: str, *fmt_args) -> str:
-    timestamp = datetime.now().strftime('%H:%M:%S')
-    return "[{}] {}: {}".format(timestamp, lvl, fmt.format(*fmt_args))
+
+class LogWriter:
+    """Thread that formats and writes queued records"""
+
+    def __init__(self, text_file: Optional[RotatingFile], binary_file: Optional[RotatingFile]) -> None:
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.stats = LogStats()
+        self.text_file = text_file
+        self.binary_writer = BinaryTraceWriter(binary_file) if binary_file is not None else None
+
+        # Rate limiting state for each (level, message): the start of its window, the number of records written in
+        # that window, and the number suppressed. States are removed when their window ends.
+        self._rate_state = {}  # type: Dict[Tuple[int, str], List]
+        # The earliest time at which a window ends, or None if there are no windows
+        self._next_expiry = None
+        self._timestamp_second = None
+        self._timestamp_str = None
+
+        self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def enqueue(self, record: Record) -> None:
+        """Queue a record to be written, dropping it if the queue is full"""
+        try:
+            self.queue.put_nowait(record)
+            self.stats.enqueued += 1
+        except queue.Full:
+            self.stats.dropped += 1
+
+    def flush(self, timeout: float = 1.0) -> None:
+        """Wait until every record queued so far has been written"""
+        flushed = threading.Event()
+        try:
+            self.queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return
+        flushed.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            # Wake up when the earliest window ends, to write its suppressed count even if nothing else is logged
+            timeout = max(self._next_expiry - time(), 0) if self._next_expiry is not None else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._expire_windows(time())
+                self._flush_files()
+                continue
+            if isinstance(item, threading.Event):
+                self._flush_suppressed()
+                self._flush_files()
+                item.set()
+                continue
+            self._write(item)
+            if self._next_expiry is not None and item[1] >= self._next_expiry:
+                self._expire_windows(item[1])
+            # Flush the files once the queue is empty, rather than after every record
+            if self.queue.empty():
+                self._flush_files()
+
+    def _write(self, record: Record) -> None:
+        level, timestamp, fmt, args = record
+        if self.binary_writer is not None:
+            self.binary_writer.write(record)
+        try:
+            message = fmt.format(*args)
+        except (IndexError, KeyError, ValueError) as err:
+            message = '{} (formatting failed: {!r})'.format(fmt, err)
+        state = self._rate_state.get((level, message))
+        if state is not None and timestamp >= state[0] + RATE_WINDOW:
+            # The window ended before it was expired
+            if state[2]:
+                self._write_suppressed(level, state[0] + RATE_WINDOW, message, state[2])
+            state = None
+        if state is None:
+            state = self._rate_state[(level, message)] = [timestamp, 0, 0]
+            if self._next_expiry is None or timestamp + RATE_WINDOW < self._next_expiry:
+                self._next_expiry = timestamp + RATE_WINDOW
+        if state[1] >= RATE_LIMIT:
+            state[2] += 1
+            self.stats.coalesced += 1
+            return
+        state[1] += 1
+        self._write_text(level, timestamp, message)
+        self.stats.written += 1
+
+    def _expire_windows(self, now: float) -> None:
+        # Write the suppressed counts of the windows that have ended and forget them
+        self._next_expiry = None
+        for key, state in list(self._rate_state.items()):
+            window_end = state[0] + RATE_WINDOW
+            if window_end <= now:
+                if state[2]:
+                    self._write_suppressed(key[0], window_end, key[1], state[2])
+                del self._rate_state[key]
+            elif self._next_expiry is None or window_end < self._next_expiry:
+                self._next_expiry = window_end
+
+    def _flush_suppressed(self) -> None:
+        # Write the suppressed counts of every message, so that none are lost when flushing
+        for (level, message), state in self._rate_state.items():
+            if state[2]:
+                self._write_suppressed(level, state[0], message, state[2])
+                state[2] = 0
+
+    def _write_suppressed(self, level: int, timestamp: float, message: str, count: int) -> None:
+        self._write_text(level, timestamp, '({} repeats suppressed) {}'.format(count, message))
+
+    def _write_text(self, level: int, timestamp: float, message: str) -> None:
+        second = int(timestamp)
+        if second != self._timestamp_second:
+            self._timestamp_second = second
+            self._timestamp_str = datetime.fromtimestamp(second).strftime('%H:%M:%S')
+        line = '[{}] {}: {}'.format(self._timestamp_str, LEVEL_NAMES[level], message)
+        print(line, file=sys.stdout if level <= LVL_INFO else sys.stderr)
+        if self.text_file is not None:
+            self.text_file.write((line + '\n').encode())
+            if self.text_file.is_full():
+                self.text_file.rotate()
+
+    def _flush_files(self) -> None:
+        sys.stdout.flush()
+        for file in (self.text_file, self.binary_writer.file if self.binary_writer is not None else None):
+            if file is not None:
+                file.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> LogWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            text_file = RotatingFile(LOG_FILE, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUPS) if LOG_FILE else None
+            binary_file = RotatingFile(LOG_BINARY_FILE, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUPS) \
+                if LOG_BINARY_FILE else None
+            _writer = LogWriter(text_file, binary_file)
+            atexit.register(_shutdown)
+        return _writer
+
+
+def _shutdown() -> None:
+    _writer.flush()
+    stats = _writer.stats
+    if stats.dropped or stats.coalesced:
+        print('Logging: {} records dropped, {} coalesced'.format(stats.dropped, stats.coalesced), file=sys.stderr)
+
+
+def _log(level: int, fmt: str, fmt_args: tuple) -> None:
+    for arg in fmt_args:
+        if arg is not None and not isinstance(arg, _IMMUTABLE_TYPES):
+            fmt_args = tuple(arg if arg is None or isinstance(arg, _IMMUTABLE_TYPES) else str(arg) for arg in fmt_args)
+            break
+    (_writer or _get_writer()).enqueue((level, time(), fmt, fmt_args))
+
+
+def flush(timeout: float = 1.0) -> None:
+    """Wait until every message logged so far has been written"""
+    if _writer is not None:
+        _writer.flush(timeout)
+
+
+def get_stats() -> LogStats:
+    """Return the counters for the records passing through the logging queue"""
+    return (_writer or _get_writer()).stats
 
 
 def debug(fmt, *fmt_args) -> None:
     """Format and log a message with level DEBUG"""
     if MIN_LEVEL <= LVL_DEBUG:
-        print(_fmt_log_msg('DEBUG', fmt, *fmt_args))
+        _log(LVL_DEBUG, fmt, fmt_args)
 
 
 def info(fmt, *fmt_args) -> None:
     """Format and log a message with level INFO"""
     if MIN_LEVEL <= LVL_INFO:
-        print(_fmt_log_msg('INFO', fmt, *fmt_args))
+        _log(LVL_INFO, fmt, fmt_args)
 
 
 def warn(fmt, *fmt_args) -> None:
     """Format and log a message with level WARN"""
     if MIN_LEVEL <= LVL_WARN:
-        print(_fmt_log_msg('WARN', fmt, *fmt_args), file=sys.stderr)
+        _log(LVL_WARN, fmt, fmt_args)
 
 
 def error(fmt, *fmt_args) -> None:
     """Format and log a message with level ERROR"""
     if MIN_LEVEL <= LVL_ERROR:
-        print(_fmt_log_msg('ERROR', fmt, *fmt_args), file=sys.stderr)
+        _log(LVL_ERROR, fmt, fmt_args)
 
 
 def fatal(fmt, *fmt_args) -> None:
     """Format and log a message with level FATAL"""
     if MIN_LEVEL <= LVL_FATAL:
-        print(_fmt_log_msg('FATAL', fmt, *fmt_args), file=sys.stderr)
+        _log(LVL_FATAL, fmt, fmt_args)
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'rb') as trace:
+        for record_time, record_level, record_message in read_binary_trace(trace):
+            print('[{}] {}: {}'.format(datetime.fromtimestamp(record_time).strftime('%H:%M:%S.%f'),
+                                       LEVEL_NAMES[record_level], record_message))
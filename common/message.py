@@ -24,3 +24,23 @@ class ArduinoConnectionMessage:
 
     def __repr__(self) -> str:
         return 'ArduinoConnectionMessage(connected={})'.format(self.connected)
+
+
+class DatagramChannelMessage:
+    """Request that motor speeds be sent as datagrams to a UDP port on the client"""
+
+    def __init__(self, port: int) -> None:
+        self.port = port
+
+    def __repr__(self) -> str:
+        return 'DatagramChannelMessage(port={})'.format(self.port)
+
+
+class ClientConnectionMessage:
+    """Information about the state of the controlling client's connection, sent by the server to observers"""
+
+    def __init__(self, connected: bool) -> None:
+        self.connected = connected
+
+    def __repr__(self) -> str:
+        return 'ClientConnectionMessage(connected={})'.format(self.connected)
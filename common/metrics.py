@@ -0,0 +1,250 @@
+import json
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence
+
+from common import logging
+
+"""Lightweight metrics for watching the performance of the client and server
+
+Counters, gauges, and histograms are created once by the module that updates them, usually at import time, and are
+registered by name in REGISTRY. Updating a metric only changes a few of its attributes, so it costs well under a
+microsecond and can be done on every frame or command. Updates are not locked, so concurrent updates to the same metric
+from different threads can occasionally be lost, which is fine for monitoring.
+
+MetricsServer serves every metric over HTTP, as text at /metrics in the Prometheus exposition format, and as JSON at
+/metrics.json.
+"""
+
+# Histogram bucket upper bounds for durations, in seconds
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Counter:
+    """Metric that counts events or amounts, and only increases"""
+
+    TYPE = 'counter'
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        """Increase the counter"""
+        self.value += amount
+
+    def to_dict(self) -> dict:
+        return {'type': self.TYPE, 'value': self.value}
+
+    def to_text(self) -> List[str]:
+        return ['{} {}'.format(self.name, self.value)]
+
+
+class Gauge:
+    """Metric that holds the current value of something, such as a number of connections"""
+
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        """Set the value of the gauge"""
+        self.value = value
+
+    def to_dict(self) -> dict:
+        return {'type': self.TYPE, 'value': self.value}
+
+    def to_text(self) -> List[str]:
+        return ['{} {}'.format(self.name, self.value)]
+
+
+class Histogram:
+    """Metric that counts observed values in fixed buckets, such as the durations of an operation
+
+    Each bucket counts the values up to and including its upper bound, and greater than the previous bound, and a
+    final bucket counts the values greater than every bound.
+    """
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float] = TIME_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Count a value in its bucket"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def get_count(self) -> int:
+        """Return the number of values observed"""
+        return sum(self.counts)
+
+    def get_percentile(self, fraction: float, counts: Optional[Sequence[int]] = None) -> Optional[float]:
+        """Return an estimate of a percentile of the values, or of some counts of them in the same buckets
+
+        The values in the bucket containing the percentile are assumed to be spread evenly across it, starting from 0
+        for the first bucket. Returns infinity if the percentile is above every bound, or None if there are no values.
+        """
+        counts = self.counts if counts is None else counts
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = fraction * total
+        cumulative = 0
+        lower_bound = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and cumulative + count >= rank:
+                return lower_bound + (bound - lower_bound) * (rank - cumulative) / count
+            cumulative += count
+            lower_bound = bound
+        return float('inf')
+
+    def to_dict(self) -> dict:
+        return {'type': self.TYPE, 'buckets': list(self.buckets), 'counts': list(self.counts),
+                'count': self.get_count(), 'sum': self.sum}
+
+    def to_text(self) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, cumulative))
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, cumulative + self.counts[-1]))
+        lines.append('{}_sum {}'.format(self.name, self.sum))
+        lines.append('{}_count {}'.format(self.name, cumulative + self.counts[-1]))
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics, indexed by name"""
+
+    def __init__(self) -> None:
+        self.metrics = {}  # type: Dict[str, object]
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, description: str) -> Counter:
+        """Return the counter with a name, creating it if it does not exist"""
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        """Return the gauge with a name, creating it if it does not exist"""
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name: str, description: str, buckets: Sequence[float] = TIME_BUCKETS) -> Histogram:
+        """Return the histogram with a name, creating it with some buckets if it does not exist"""
+        return self._get_or_create(Histogram, name, description, buckets)
+
+    def get(self, name: str) -> Optional[object]:
+        """Return the metric with a name, or None if there is none"""
+        return self.metrics.get(name)
+
+    def to_dict(self) -> dict:
+        """Return the values of every metric, indexed by name"""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.to_dict() for metric in metrics}
+
+    def to_text(self) -> str:
+        """Return the values of every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.description))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            lines += metric.to_text()
+        return '\n'.join(lines) + '\n'
+
+    def _get_or_create(self, cls: type, name: str, *args) -> object:
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError('metric already registered as a {}: {}'.format(metric.TYPE, name))
+            return metric
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, description: str) -> Counter:
+    """Return the counter with a name in REGISTRY, creating it if it does not exist"""
+    return REGISTRY.counter(name, description)
+
+
+def gauge(name: str, description: str) -> Gauge:
+    """Return the gauge with a name in REGISTRY, creating it if it does not exist"""
+    return REGISTRY.gauge(name, description)
+
+
+def histogram(name: str, description: str, buckets: Sequence[float] = TIME_BUCKETS) -> Histogram:
+    """Return the histogram with a name in REGISTRY, creating it with some buckets if it does not exist"""
+    return REGISTRY.histogram(name, description, buckets)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path == '/metrics':
+            body, content_type = self.registry.to_text().encode(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(self.registry.to_dict()).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt: str, *args) -> None:
+        # Requests are polled frequently, so only log them when debugging
+        logging.debug('Metrics request: {}', fmt % args)
+
+
+class MetricsServer:
+    """Thread that serves the metrics in a registry over HTTP"""
+
+    def __init__(self, host: str, port: int, registry: MetricsRegistry = REGISTRY) -> None:
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+        self._thread = None
+
+    def is_running(self) -> bool:
+        """Return whether the server thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Bind the server socket and start the server thread"""
+        handler = type('MetricsRequestHandler', (_MetricsRequestHandler,), {'registry': self.registry})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        # Port 0 binds to any free port
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+        logging.info('Serving metrics on http://{}:{}/metrics', self.host, self.port)
+
+    def stop(self) -> None:
+        """Stop the server thread and close the server socket"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -1,40 +1,145 @@
-import pickle
+import asyncio
 import socket
 import struct
 from select import select
-from typing import Union
+from typing import List, Optional, Union
 
+from common import codec, metrics
 from common.timer import Timer
 
+_LENGTH_STRUCT = struct.Struct('!I')
+
+FRAMES_SENT = metrics.counter('protocol_frames_sent_total', 'Length-delimited frames sent')
+BYTES_SENT = metrics.counter('protocol_bytes_sent_total', 'Bytes of length-delimited frames sent')
+FRAMES_RECEIVED = metrics.counter('protocol_frames_received_total', 'Length-delimited frames received')
+BYTES_RECEIVED = metrics.counter('protocol_bytes_received_total', 'Bytes received by frame readers')
+
+
+class FrameReader:
+    """Buffered reader for length-delimited frames from a socket
+
+    Data is read in large chunks into a preallocated buffer, and frames are returned as memoryviews into that buffer.
+    A returned frame is only valid until the next call to read_frame or read_frames.
+    """
+
+    BUFFER_SIZE = 65536
+
+    def __init__(self, sock: socket, buffer_size: int = BUFFER_SIZE) -> None:
+        self.sock = sock
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def read_frame(self, timeout: Union[Timer, float]) -> memoryview:
+        """Read a single frame, or raise socket.error if the timeout is exceeded or the connection is closed"""
+        timer = timeout if isinstance(timeout, Timer) else Timer(timeout)
+        frame = self._next_frame()
+        while frame is None:
+            if timer.is_expired() or not self._fill(timer.get_remaining_time()):
+                raise socket.error('timed out')
+            frame = self._next_frame()
+        return frame
+
+    def read_frames(self, timeout: Union[Timer, float] = 0) -> List[memoryview]:
+        """Read every frame that is buffered or becomes available before the timeout, which may be none"""
+        timer = timeout if isinstance(timeout, Timer) else Timer(timeout)
+        frames = []
+        frame = self._next_frame()
+        while frame is None and self._fill(timer.get_remaining_time()):
+            frame = self._next_frame()
+        while frame is not None:
+            frames.append(frame)
+            frame = self._next_frame()
+        return frames
+
+    def _next_frame(self) -> Optional[memoryview]:
+        # Return the next complete frame in the buffer, if there is one
+        available = self._end - self._start
+        if available < _LENGTH_STRUCT.size:
+            return None
+        length, = _LENGTH_STRUCT.unpack_from(self._buffer, self._start)
+        if available < _LENGTH_STRUCT.size + length:
+            self._reserve(_LENGTH_STRUCT.size + length)
+            return None
+        frame_start = self._start + _LENGTH_STRUCT.size
+        self._start = frame_start + length
+        FRAMES_RECEIVED.inc()
+        return self._view[frame_start:self._start]
+
+    def _reserve(self, size: int) -> None:
+        # Grow the buffer if a single frame is larger than it
+        if size > len(self._buffer):
+            buffer = bytearray(max(size, len(self._buffer) * 2))
+            buffer[:self._end - self._start] = self._view[self._start:self._end]
+            self._buffer, self._view = buffer, memoryview(buffer)
+            self._start, self._end = 0, self._end - self._start
+
+    def _fill(self, timeout: float) -> bool:
+        # Wait for data and read as much of it as fits in the buffer, returning whether any data was read
+        if not recv_avail(self.sock, timeout):
+            return False
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            # Move the partial frame at the end of the buffer to the start to make room
+            self._buffer[:self._end - self._start] = self._view[self._start:self._end]
+            self._start, self._end = 0, self._end - self._start
+        count = self.sock.recv_into(self._view[self._end:])
+        if count == 0:
+            raise socket.error('connection closed')
+        self._end += count
+        BYTES_RECEIVED.inc(count)
+        return True
+
+
+def pack_frame(data: Union[bytes, memoryview]) -> bytes:
+    """Return a length-delimited frame containing some data"""
+    return _LENGTH_STRUCT.pack(len(data)) + data
+
+
+def pack_obj(obj: object) -> bytes:
+    """Return a length-delimited serialized object"""
+    return pack_frame(codec.encode(obj))
+
+
+def send_frame(sock: socket, frame: bytes) -> None:
+    """Write a length-delimited frame to the socket"""
+    sock.sendall(frame)
+    FRAMES_SENT.inc()
+    BYTES_SENT.inc(len(frame))
+
 
 def send_obj(sock: socket, obj: object) -> None:
     """Write a length-delimited serialized object to the socket"""
-    data = pickle.dumps(obj)
-    sock.sendall(struct.pack('!I', len(data)))
-    sock.sendall(data)
+    send_frame(sock, pack_obj(obj))
 
 
-def recv_obj(sock: socket, timeout: Union[Timer, float]) -> object:
-    """Read a length-delimited serialized object from the socket, or raise socket.error if the timeout is exceeded"""
-    timer = timeout if isinstance(timeout, Timer) else Timer(timeout)
-    len_data = recv_len(sock, 4, timer)
-    length, = struct.unpack('!I', len_data)
-    obj_data = recv_len(sock, length, timer)
-    return pickle.loads(obj_data)
+def recv_obj(reader: FrameReader, timeout: Union[Timer, float]) -> object:
+    """Read a length-delimited serialized object, or raise socket.error if the timeout is exceeded"""
+    return codec.decode(reader.read_frame(timeout))
 
 
-def recv_avail(sock: socket, timeout: float = 0) -> bool:
-    """Return whether the socket has data available for reading, either immediately or before a timeout"""
-    return len(select([sock], [], [], timeout)[0]) != 0
+def recv_all_obj(reader: FrameReader, timeout: Union[Timer, float] = 0) -> List[object]:
+    """Read every length-delimited serialized object that is available before the timeout, which may be none"""
+    return [codec.decode(frame) for frame in reader.read_frames(timeout)]
 
 
-def recv_len(sock: socket, length: int, timeout: Union[Timer, float]) -> bytes:
-    """Read an exact number of bytes from the socket, or raise socket.error if the timeout is exceeded"""
-    timer = timeout if isinstance(timeout, Timer) else Timer(timeout)
-    buffer = bytearray()
-    while len(buffer) < length and not timer.is_expired():
-        if recv_avail(sock, timer.get_remaining_time()):
-            buffer += sock.recv(length - len(buffer))
-    if len(buffer) != length:
+async def recv_obj_async(stream: asyncio.StreamReader, timeout: float) -> object:
+    """Read a length-delimited serialized object from the stream, or raise socket.error if the timeout is exceeded"""
+    try:
+        len_data = await asyncio.wait_for(stream.readexactly(_LENGTH_STRUCT.size), timeout)
+        length, = _LENGTH_STRUCT.unpack(len_data)
+        obj_data = await asyncio.wait_for(stream.readexactly(length), timeout)
+    except asyncio.TimeoutError:
         raise socket.error('timed out')
-    return buffer
+    except asyncio.IncompleteReadError:
+        raise socket.error('connection closed')
+    FRAMES_RECEIVED.inc()
+    BYTES_RECEIVED.inc(_LENGTH_STRUCT.size + length)
+    return codec.decode(obj_data)
+
+
+def recv_avail(sock: socket, timeout: float = 0) -> bool:
+    """Return whether the socket has data available for reading, either immediately or before a timeout"""
+    return len(select([sock], [], [], timeout)[0]) != 0
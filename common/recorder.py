@@ -0,0 +1,202 @@
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left
+from collections import deque
+from time import monotonic, time
+from typing import Callable, Iterator, Optional, Tuple
+
+from common import codec
+
+"""Flight recorder for dives
+
+A FlightRecorder appends timestamped objects to a binary log. Each record is a monotonic timestamp and a length,
+followed by the object encoded with common.codec, so any registered command or message can be recorded. Every
+INDEX_INTERVAL seconds, the offset of the next record is also appended to a seek index next to the log (at path.idx).
+
+Recording only takes a timestamp and appends to a queue, and a writer thread encodes and writes the records in batches.
+A FlightLog memory-maps a recorded log and uses the seek index to find the records in any time range without reading
+the rest of the log.
+"""
+
+MAGIC = b'ROVREC1\n'
+# The wall clock time and monotonic time when recording started, for converting timestamps to wall clock times
+_HEADER_STRUCT = struct.Struct('<dd')
+_RECORD_STRUCT = struct.Struct('<dH')
+_INDEX_STRUCT = struct.Struct('<dQ')
+HEADER_SIZE = len(MAGIC) + _HEADER_STRUCT.size
+
+
+def get_index_path(path: str) -> str:
+    """Return the path of the seek index for a log"""
+    return path + '.idx'
+
+
+class FlightRecorder:
+    """Append-only recorder of timestamped commands, messages, and other objects registered with common.codec"""
+
+    INDEX_INTERVAL = 1.0
+    WRITE_INTERVAL = 0.1
+    # Records waiting to be written beyond this are dropped, so that a stalled disk cannot exhaust memory
+    MAX_PENDING = 100000
+
+    def __init__(self, path: str, clock: Callable[[], float] = monotonic) -> None:
+        self.path = path
+        self.clock = clock
+        self.file = open(path, 'wb')
+        self.index_file = open(get_index_path(path), 'wb')
+        self.file.write(MAGIC + _HEADER_STRUCT.pack(time(), clock()))
+        self.offset = HEADER_SIZE
+        self.last_time = float('-inf')
+        self.next_index_time = None
+
+        self.recorded = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._pending = deque()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='flight-recorder', daemon=True)
+        self._thread.start()
+
+    def record(self, obj: object) -> None:
+        """Record an object with the current time, without waiting for it to be written
+
+        The object is encoded later on the writer thread, so it must not be modified after it is recorded.
+        """
+        if len(self._pending) >= self.MAX_PENDING:
+            self.dropped += 1
+            return
+        self._pending.append((self.clock(), obj))
+
+    def close(self) -> None:
+        """Write every pending record, then close the log"""
+        self._stopped.set()
+        self._thread.join()
+        self.file.close()
+        self.index_file.close()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.WRITE_INTERVAL):
+            self._write_pending()
+        self._write_pending()
+
+    def _write_pending(self) -> None:
+        chunks = []
+        index_entries = []
+        pending = self._pending
+        while pending:
+            timestamp, obj = pending.popleft()
+            # Records from different threads can be queued slightly out of order, but the log must stay sorted
+            timestamp = self.last_time = max(timestamp, self.last_time)
+            try:
+                data = codec.encode(obj)
+            except (ValueError, struct.error):
+                self.failed += 1
+                continue
+            if self.next_index_time is None or timestamp >= self.next_index_time:
+                index_entries.append(_INDEX_STRUCT.pack(timestamp, self.offset))
+                self.next_index_time = timestamp + self.INDEX_INTERVAL
+            chunks.append(_RECORD_STRUCT.pack(timestamp, len(data)))
+            chunks.append(data)
+            self.offset += _RECORD_STRUCT.size + len(data)
+            self.recorded += 1
+        if chunks:
+            self.file.write(b''.join(chunks))
+            self.file.flush()
+        if index_entries:
+            # The index is written after the records it points to, so it never points past the end of the log
+            self.index_file.write(b''.join(index_entries))
+            self.index_file.flush()
+
+
+class _IndexTimes:
+    """Sequence of the timestamps in a seek index, for bisecting without unpacking the whole index"""
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.data) // _INDEX_STRUCT.size
+
+    def __getitem__(self, index: int) -> float:
+        return _INDEX_STRUCT.unpack_from(self.data, index * _INDEX_STRUCT.size)[0]
+
+
+class FlightLog:
+    """Memory-mapped reader for a log written by a FlightRecorder
+
+    Objects are decoded with common.codec, so the modules that register their schemas must be imported first. A log
+    that was cut off part way through a record, for example by a crash, is read up to the last complete record.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError('not a flight recorder log: {}'.format(path))
+        self.start_wall_time, self.start_time = _HEADER_STRUCT.unpack_from(self.data, len(MAGIC))
+
+        index_path = get_index_path(path)
+        if os.path.exists(index_path) and os.path.getsize(index_path) >= _INDEX_STRUCT.size:
+            with open(index_path, 'rb') as file:
+                self.index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.index = b''
+        self._index_times = _IndexTimes(self.index)
+
+    def close(self) -> None:
+        """Unmap the log and its index"""
+        self.data.close()
+        if isinstance(self.index, mmap.mmap):
+            self.index.close()
+
+    def to_wall_time(self, timestamp: float) -> float:
+        """Convert a monotonic timestamp from the log to a wall clock time"""
+        return self.start_wall_time + timestamp - self.start_time
+
+    def seek(self, timestamp: float) -> int:
+        """Return the offset of an indexed record before every record with a timestamp at or after the timestamp"""
+        position = bisect_left(self._index_times, timestamp) - 1
+        if position < 0:
+            return HEADER_SIZE
+        return _INDEX_STRUCT.unpack_from(self.index, position * _INDEX_STRUCT.size)[1]
+
+    def read_raw(self, start: float = float('-inf'), end: float = float('inf')) -> Iterator[Tuple[float, memoryview]]:
+        """Yield (timestamp, encoded object) for every record with start <= timestamp <= end"""
+        data = memoryview(self.data)
+        for timestamp, offset, length in self._scan(self.seek(start)):
+            if timestamp > end:
+                return
+            if timestamp >= start:
+                yield timestamp, data[offset:offset + length]
+
+    def read(self, start: float = float('-inf'), end: float = float('inf'),
+             types: Optional[Tuple[type, ...]] = None) -> Iterator[Tuple[float, object]]:
+        """Yield (timestamp, object) for every record with start <= timestamp <= end, optionally only of some types"""
+        for timestamp, data in self.read_raw(start, end):
+            obj = codec.decode(data)
+            if types is None or isinstance(obj, types):
+                yield timestamp, obj
+
+    def get_time_range(self) -> Tuple[Optional[float], Optional[float]]:
+        """Return the timestamps of the first and last records, or (None, None) if the log is empty"""
+        first = next(self._scan(HEADER_SIZE), (None,))[0]
+        last = None
+        # Only the records after the last index entry need to be scanned to find the last record
+        for last, _, _ in self._scan(self.seek(float('inf'))):
+            pass
+        return first, last
+
+    def _scan(self, offset: int) -> Iterator[Tuple[float, int, int]]:
+        # Yield the timestamp, payload offset, and payload length of each complete record from an offset onwards
+        data = self.data
+        size = len(data)
+        while offset + _RECORD_STRUCT.size <= size:
+            timestamp, length = _RECORD_STRUCT.unpack_from(data, offset)
+            offset += _RECORD_STRUCT.size
+            if offset + length > size:
+                return
+            yield timestamp, offset, length
+            offset += length
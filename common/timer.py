@@ -1,4 +1,12 @@
+import heapq
+import threading
 from time import sleep, perf_counter
+from typing import Callable, List, Optional
+
+from common import logging, metrics
+
+SKIPPED_TICKS = metrics.counter('scheduler_skipped_ticks_total', 'Ticks of periodic jobs skipped after falling behind')
+OVERRUNS = metrics.counter('scheduler_overruns_total', 'Ticks of periodic jobs that finished after the next was due')
 
 
 class Timer:
@@ -29,3 +37,175 @@ class Timer:
     def restart(self) -> None:
         """Restart the timer"""
         self.start_time = perf_counter()
+
+
+class JitterStats:
+    """Statistics about how late each tick of a periodic loop started relative to its deadline"""
+
+    def __init__(self) -> None:
+        self.samples = []  # type: List[float]
+
+    def add(self, jitter: float) -> None:
+        """Record the jitter of a single tick, in seconds"""
+        self.samples.append(jitter)
+
+    def summary(self) -> str:
+        """Return a summary of the recorded jitter in milliseconds"""
+        if not self.samples:
+            return 'no ticks'
+        samples = sorted(self.samples)
+        return '{} ticks, p50={:.2f}ms, p99={:.2f}ms, max={:.2f}ms'.format(
+            len(samples), samples[len(samples) // 2] * 1e3, samples[int(len(samples) * 0.99)] * 1e3, samples[-1] * 1e3)
+
+    def reset(self) -> None:
+        """Discard all recorded jitter"""
+        self.samples = []
+
+
+class PeriodicJob:
+    """Job run by a PeriodicScheduler, with statistics about how well it kept to its deadlines
+
+    The callback is passed the jitter of each tick: how late it started relative to its deadline, in seconds. If ticks
+    were skipped, the jitter is relative to the first deadline that was missed, so it includes the whole stall.
+    """
+
+    def __init__(self, name: str, interval: float, callback: Callable[[float], None], deadline: float) -> None:
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.deadline = deadline
+        # Ticks run since the last report, and of those, ticks that finished after the next tick was due, and ticks that
+        # were skipped because the job fell behind
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter_stats = JitterStats()
+
+    def __lt__(self, other: 'PeriodicJob') -> bool:
+        return self.deadline < other.deadline
+
+    def reset_stats(self) -> None:
+        """Reset the tick counts and jitter"""
+        self.ticks = self.overruns = self.skipped = 0
+        self.jitter_stats.reset()
+
+    def __repr__(self) -> str:
+        return 'PeriodicJob(name={}, interval={}s, ticks={}, overruns={}, skipped={}, jitter=({}))'.format(
+            self.name, self.interval, self.ticks, self.overruns, self.skipped, self.jitter_stats.summary())
+
+
+class PeriodicScheduler:
+    """Runs periodic jobs on absolute deadlines, either on its own thread or from another loop with run_pending
+
+    Each job's deadlines are fixed multiples of its interval from when it was added, so its period never drifts with
+    the time its callback takes or how late it was woken. A job that falls more than a whole interval behind skips the
+    ticks it missed instead of running them back-to-back, and stays on the same deadlines afterwards. Jobs share a
+    thread, so a job whose timing matters should not share a scheduler with slow jobs.
+    """
+
+    # Interval to log and reset the statistics of every job at, in seconds. Skipped ticks and overruns are also counted
+    # in the metrics registry.
+    REPORT_INTERVAL = 10.0
+
+    def __init__(self, name: str = 'scheduler') -> None:
+        self.name = name
+        self.jobs = []  # type: List[PeriodicJob]
+        self._lock = threading.Lock()
+        self._report_time = perf_counter()
+
+        self._thread = None
+        self._stopped = threading.Event()
+        self._changed = threading.Event()
+
+    def add_job(self, name: str, interval: float, callback: Callable[[float], None],
+                delay: Optional[float] = None) -> PeriodicJob:
+        """Add a job whose first tick is due after a delay, which defaults to a whole interval"""
+        job = PeriodicJob(name, interval, callback, perf_counter() + (interval if delay is None else delay))
+        with self._lock:
+            heapq.heappush(self.jobs, job)
+        self._changed.set()
+        return job
+
+    def remove_job(self, job: PeriodicJob) -> None:
+        """Remove a job, if it has not already been removed"""
+        with self._lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+                heapq.heapify(self.jobs)
+
+    def get_remaining_time(self) -> Optional[float]:
+        """Return the time until the next tick is due in seconds, or None if there are no jobs"""
+        with self._lock:
+            if not self.jobs:
+                return None
+            return max(self.jobs[0].deadline - perf_counter(), 0)
+
+    def run_pending(self) -> int:
+        """Run every job whose tick is due, returning the number of ticks run
+
+        Exceptions raised by a callback are passed on, after the job has been scheduled for its next tick.
+        """
+        ran = 0
+        while True:
+            now = perf_counter()
+            with self._lock:
+                if not self.jobs or self.jobs[0].deadline > now:
+                    break
+                job = self.jobs[0]
+                jitter = now - job.deadline
+                # Skip any whole ticks that were missed, keeping to the same deadlines
+                missed = int(jitter // job.interval)
+                if missed:
+                    job.skipped += missed
+                    SKIPPED_TICKS.inc(missed)
+                job.deadline += (missed + 1) * job.interval
+                heapq.heapreplace(self.jobs, job)
+            job.ticks += 1
+            job.jitter_stats.add(jitter)
+            ran += 1
+            try:
+                job.callback(jitter)
+            finally:
+                if perf_counter() > job.deadline:
+                    job.overruns += 1
+                    OVERRUNS.inc()
+        if now >= self._report_time + self.REPORT_INTERVAL:
+            self.report()
+        return ran
+
+    def report(self) -> None:
+        """Log the statistics of every job, then reset them"""
+        with self._lock:
+            jobs = list(self.jobs)
+        for job in jobs:
+            logging.debug('{}: {}', self.name, repr(job))
+            job.reset_stats()
+        self._report_time = perf_counter()
+
+    def is_running(self) -> bool:
+        """Return whether the scheduler thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start running jobs on the scheduler thread"""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the scheduler thread and wait for it to exit"""
+        self._stopped.set()
+        self._changed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.run_pending()
+            except Exception as err:
+                logging.error('{}: job failed: {}', self.name, err)
+            # Wait for the next tick, or for a job to be added
+            self._changed.wait(self.get_remaining_time())
+            self._changed.clear()
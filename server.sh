@@ -9,10 +9,26 @@
 export HOST=localhost
 export PORT=1234
 
+## Uncomment to accept read-only observers, such as a co-pilot's console, on
+## another port. Observers are sent the ROV's messages, the commands sent to
+## it, and whether it is connected, but cannot control it.
+#export OBSERVER_PORT=1235
+
 ## Port to receive video on.
 ## This should match the port set in `client.sh`.
 export GST_PORT=5000
 
+## Video encoder used by the client (jpeg or h264).
+## This should match the encoder set in `client.sh`.
+export VIDEO_ENCODER=jpeg
+
+## Uncomment to receive the video in the server's own window instead of a
+## separate GStreamer window, with the video stats overlaid on it.
+#export VIDEO_RECEIVER=1
+
+## Size to show the video at in the server's window.
+export VIDEO_SIZE=1280x720
+
 ## Uncomment to use a specific joystick index.
 #export JOYSTICK_INDEX=0
 
@@ -20,17 +36,66 @@ export GST_PORT=5000
 ## This can lead to odd behavior so it is disabled by default.
 #export ENABLE_JOYSTICK_HOTPLUG=1
 
+## Uncomment to update the joystick's state from its events instead of polling
+## it every control loop tick, which makes a CONTROL_RATE of 100-250 cheap.
+#export JOYSTICK_EVENTS=1
+
+## Rate to read the joystick and send motor speeds at, in Hz.
+export CONTROL_RATE=20
+
+## Maximum rate to redraw the window at, in Hz.
+## This is independent of CONTROL_RATE.
+export FRAME_RATE=30
+
+## Uncomment to only send motor speeds when they change.
+## A keepalive is still sent every 100ms while they stay the same.
+#export DELTA_MODE=1
+
+## Uncomment to also write log messages to a file, which is rotated at 10MB.
+#export LOG_FILE=/tmp/server.log
+
+## Uncomment to record every log message in a compact binary trace.
+## Print it with `python3 -m common.logging FILE`.
+#export LOG_BINARY_FILE=/tmp/server.trace
+
+## Uncomment to record every command and message (and joystick input on the
+## server) in an indexed flight recorder log, for replaying dives later.
+#export FLIGHT_RECORDER_FILE=/tmp/server.rec
+
+## Uncomment to serve the server's metrics over HTTP, as text at /metrics and
+## as JSON at /metrics.json.
+#export METRICS_PORT=9101
+#export METRICS_HOST=localhost
+
+## Uncomment to show the server's metrics in the sidebar of its window.
+#export SHOW_METRICS=1
+
 
 echo "----------------"
 echo "HOST=$HOST"
 echo "PORT=$PORT"
 echo "GST_PORT=$GST_PORT"
+echo "VIDEO_ENCODER=$VIDEO_ENCODER"
+echo "CONTROL_RATE=$CONTROL_RATE"
+echo "FRAME_RATE=$FRAME_RATE"
 echo "----------------"
 
-gst-launch-1.0 udpsrc port=$GST_PORT \
-    ! application/x-rtp,encoding-name=JPEG,payload=26 \
-    ! rtpjpegdepay \
-    ! jpegdec \
-    ! autovideosink &
+if [ -n "$VIDEO_RECEIVER" ]; then
+    : # The server receives the video itself
+elif [ "$VIDEO_ENCODER" = "h264" ]; then
+    gst-launch-1.0 udpsrc port=$GST_PORT \
+        ! application/x-rtp,media=video,clock-rate=90000,encoding-name=H264,payload=96 \
+        ! rtpjitterbuffer latency=50 \
+        ! rtph264depay \
+        ! avdec_h264 \
+        ! videoconvert \
+        ! autovideosink sync=false &
+else
+    gst-launch-1.0 udpsrc port=$GST_PORT \
+        ! application/x-rtp,encoding-name=JPEG,payload=26 \
+        ! rtpjpegdepay \
+        ! jpegdec \
+        ! autovideosink &
+fi
 
 python3 -m server
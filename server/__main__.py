@@ -3,33 +3,59 @@ import os
 import pygame
 
 from common import logging
+from common.metrics import MetricsServer
+from common.recorder import FlightRecorder
 from server import events
 from server.joystick import Joystick
 from server.server import Server
+from server.text_render import text_cache
 from server.window import Window
 
 if __name__ == '__main__':
     # Read configuration details from the environment
     host = os.getenv('HOST', 'localhost')
     port = int(os.getenv('PORT', '1234'))
+    observer_port = int(os.environ['OBSERVER_PORT']) if os.getenv('OBSERVER_PORT') else None
 
     joystick_index = int(os.getenv('JOYSTICK_INDEX', '0'))
 
     enable_joystick_hotplug = os.getenv('ENABLE_JOYSTICK_HOTPLUG') is not None
+    joystick_events = os.getenv('JOYSTICK_EVENTS') is not None
+
+    control_rate = float(os.getenv('CONTROL_RATE', '20'))
+    frame_rate = float(os.getenv('FRAME_RATE', '30'))
+    delta_mode = os.getenv('DELTA_MODE') is not None
+
+    flight_recorder_file = os.getenv('FLIGHT_RECORDER_FILE')
+
+    metrics_port = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None
+    metrics_host = os.getenv('METRICS_HOST', 'localhost')
+    show_metrics = os.getenv('SHOW_METRICS') is not None
+
+    gst_port = int(os.getenv('GST_PORT', '5000'))
+    video_encoder = os.getenv('VIDEO_ENCODER', 'jpeg')
+    use_video_receiver = os.getenv('VIDEO_RECEIVER') is not None
+    video_size = tuple(int(size) for size in os.getenv('VIDEO_SIZE', '1280x720').split('x'))
 
     # Initialize Pygame
     pygame.init()
 
-    # Start a Pygame timer to read the joystick's axes every 50ms
-    pygame.time.set_timer(events.READ_JOYSTICK, 50)
-
     if enable_joystick_hotplug:
         # Start a Pygame timer to shutdown and reinitialize the joystick system every 1000ms
         pygame.time.set_timer(events.CHECK_JOYSTICK, 1000)
 
+    # Receive the video in-process, if enabled, in the same pixel layout as the window
+    video_receiver = None
+    if use_video_receiver:
+        from server.video_receiver import VideoReceiver, get_pixel_format
+        display_info = pygame.display.Info()
+        video_receiver = VideoReceiver(gst_port, video_size, video_encoder,
+                                       get_pixel_format(display_info.bitsize, display_info.masks))
+        video_receiver.start()
+
     # Initialize the joystick and window
-    joystick = Joystick(joystick_index)
-    window = Window()
+    joystick = Joystick(joystick_index, joystick_events)
+    window = Window(video_receiver, show_metrics)
     joystick.connect()
     window.show()
 
@@ -38,10 +64,28 @@ if __name__ == '__main__':
         logging.warn('Joystick not detected and ENABLE_JOYSTICK_HOTPLUG is not set!')
         logging.warn('Connect a joystick and restart the program to fix this.')
 
+    # Start recording joystick input, commands, and messages, if enabled
+    recorder = FlightRecorder(flight_recorder_file) if flight_recorder_file else None
+
+    # Serve metrics, if enabled
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = MetricsServer(metrics_host, metrics_port)
+        metrics_server.start()
+
     # Create and run the server
-    server = Server(host, port, joystick, window)
+    server = Server(host, port, joystick, window, control_rate, frame_rate, delta_mode, recorder, observer_port)
     try:
         server.run()
     finally:
+        logging.debug('Text render cache: {}', text_cache)
+        if video_receiver is not None:
+            video_receiver.stop()
+            logging.info('Video receiver: {}', video_receiver.stats)
+        if recorder is not None:
+            recorder.close()
+            logging.info('Flight recorder: {} recorded, {} dropped', recorder.recorded, recorder.dropped)
+        if metrics_server is not None:
+            metrics_server.stop()
         window.hide()
         pygame.quit()
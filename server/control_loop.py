@@ -0,0 +1,108 @@
+import socket
+import threading
+from time import perf_counter
+from typing import Callable, Optional, Tuple
+
+from common import logging, metrics
+from common.command import SetMotorSpeedsCommand
+from common.delta import DeltaFilter
+from common.recorder import FlightRecorder
+from common.timer import PeriodicScheduler
+from server.joystick import Joystick, JoystickData
+from server.mixer import Mixer
+
+
+JITTER = metrics.histogram('server_control_jitter_seconds', 'Time each control loop tick started after its deadline')
+
+
+class ControlSnapshot:
+    """Snapshot of the most recent control loop tick, shared with the rendering thread
+
+    The snapshot itself is never modified, but joystick_data is the joystick's own data, which is updated in place on
+    every tick, so it must only be read while holding the control loop's joystick_lock.
+    """
+
+    def __init__(self, tick: int, joystick_data: Optional[JoystickData],
+                 motor_speeds: Optional[Tuple[int, int, int, int, int, int, int]], jitter: float) -> None:
+        self.tick = tick
+        self.joystick_data = joystick_data
+        self.motor_speeds = motor_speeds
+        self.jitter = jitter
+
+
+class ControlLoop:
+    """Thread that samples the joystick and sends motor speeds to the client at a fixed rate
+
+    Ticks are run by a PeriodicScheduler on absolute deadlines, so a slow tick or slow rendering on the main thread does
+    not shift the cadence of later ticks, and the jitter, overruns, and skipped ticks are logged periodically.
+    """
+
+    # In delta mode, motor speeds are only sent when an ESC value changes by more than 2us or the camera rotation
+    # changes, or otherwise at KEEPALIVE_INTERVAL so that the Arduino's COMMAND_TIMEOUT (250ms) never expires. The
+    # client only filters out speeds received within Arduino.REFRESH_INTERVAL of its last write, which must stay
+    # clearly shorter than this so that keepalives are always written.
+    DELTA_THRESHOLDS = (2, 2, 2, 2, 2, 2, 0)
+    KEEPALIVE_INTERVAL = 0.1
+
+    def __init__(self, joystick: Joystick, send_command: Callable[[object], None], interval: float = 0.05,
+                 delta_mode: bool = False, recorder: Optional[FlightRecorder] = None,
+                 clock: Callable[[], float] = perf_counter, mixer: Optional[Mixer] = None) -> None:
+        self.joystick = joystick
+        self.send_command = send_command
+        self.interval = interval
+        self.recorder = recorder
+        # Converts joystick data into motor speeds for the frame's thruster geometry, only ever from the control thread
+        self.mixer = mixer or Mixer()
+        # Only used for delta mode keepalives, so that a replay can run the filter on simulated time
+        self.delta_filter = DeltaFilter(self.DELTA_THRESHOLDS, self.KEEPALIVE_INTERVAL, clock) if delta_mode else None
+
+        # Held while reading the joystick, and by other threads that reinitialize it
+        self.joystick_lock = threading.Lock()
+        self.snapshot = ControlSnapshot(0, None, None, 0.0)
+
+        self.scheduler = PeriodicScheduler('control-loop')
+        self.job = None
+
+    def start(self) -> None:
+        """Start the control loop thread, running the first tick immediately"""
+        self.job = self.scheduler.add_job('control-loop', self.interval, self.step, delay=0)
+        self.scheduler.start()
+
+    def stop(self) -> None:
+        """Stop the control loop thread and wait for it to exit"""
+        self.scheduler.stop()
+        if self.job is not None:
+            self.scheduler.remove_job(self.job)
+            self.job = None
+
+    def get_snapshot(self) -> ControlSnapshot:
+        """Return a snapshot of the most recent tick"""
+        return self.snapshot
+
+    def reset(self) -> None:
+        """Ensure the next motor speeds are sent regardless of delta mode, for example to a newly connected client"""
+        if self.delta_filter is not None:
+            self.delta_filter.reset()
+
+    def step(self, jitter: float = 0.0) -> ControlSnapshot:
+        """Run a single tick: sample the joystick, calculate motor speeds, and send them to the client"""
+        JITTER.observe(jitter)
+        # Read data from the joystick if it is connected, and calculate motor speeds before it can be updated in place
+        with self.joystick_lock:
+            joystick_data = self.joystick.read_all() if self.joystick.is_connected() else None
+            motor_speeds = self.mixer.mix(joystick_data) if joystick_data is not None else None
+            # The recorder encodes samples later on its own thread, so only it needs a copy that is never updated
+            if self.recorder is not None and joystick_data is not None:
+                self.recorder.record(joystick_data.copy())
+        # Send new motor speeds to the client, unless delta mode determines they are redundant
+        if self.delta_filter is None or self.delta_filter.should_send(motor_speeds):
+            command = SetMotorSpeedsCommand(motor_speeds)
+            if self.recorder is not None:
+                self.recorder.record(command)
+            try:
+                self.send_command(command)
+            except socket.error as err:
+                # The main thread will notice the broken connection when it next reads from it
+                logging.debug('Unable to send motor speeds: {}', err)
+        self.snapshot = ControlSnapshot(self.snapshot.tick + 1, joystick_data, motor_speeds, jitter)
+        return self.snapshot
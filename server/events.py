@@ -2,4 +2,4 @@ import pygame
 
 """Pygame event type constants"""
 
-READ_JOYSTICK, CHECK_JOYSTICK = range(pygame.USEREVENT, pygame.USEREVENT + 2)
+CHECK_JOYSTICK, = range(pygame.USEREVENT, pygame.USEREVENT + 1)
@@ -2,22 +2,46 @@ from typing import List, Tuple
 
 import pygame
 
+from common import codec
+
+"""Joystick input for the control loop
+
+The joystick's state is kept in a single JoystickData that is updated in place, so that sampling it at a high control
+rate does not allocate new lists every tick. It is either polled from Pygame on every read, or, in event-driven mode,
+kept up to date by applying Pygame's joystick events as they arrive, which makes every read free.
+"""
+
+# Pygame events that change the state of a joystick
+JOYSTICK_EVENTS = (pygame.JOYAXISMOTION, pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP, pygame.JOYHATMOTION)
+
 
 class JoystickData:
     """Container for data read from the joystick"""
 
+    __slots__ = ('axes', 'buttons', 'hat')
+
     def __init__(self, axes: List[float], buttons: List[bool], hat: Tuple[int, int]) -> None:
         self.axes = axes
         self.buttons = buttons
         self.hat = hat
 
+    def copy(self) -> 'JoystickData':
+        """Return a copy that is not affected by later updates to this data"""
+        return JoystickData(list(self.axes), list(self.buttons), self.hat)
+
 
 class Joystick:
-    """Wrapper for a Pygame joystick connection"""
+    """Wrapper for a Pygame joystick connection
+
+    If event_driven is set, the joystick is only polled when it connects, and handle_event must be called with every
+    Pygame joystick event to keep its data up to date.
+    """
 
-    def __init__(self, index: int) -> None:
+    def __init__(self, index: int, event_driven: bool = False) -> None:
         self.index = index
+        self.event_driven = event_driven
         self.joystick = None
+        self.data = None
 
     def is_connected(self) -> bool:
         """Return whether the joystick is connected"""
@@ -28,7 +52,9 @@ class Joystick:
         if pygame.joystick.get_count() > self.index:
             self.joystick = pygame.joystick.Joystick(self.index)
             self.joystick.init()
-            self.read_all()
+            self.data = JoystickData([0.0] * self.joystick.get_numaxes(), [False] * self.joystick.get_numbuttons(),
+                                     (0, 0))
+            self.poll()
             return True
         return False
 
@@ -36,10 +62,56 @@ class Joystick:
         """Close the connection to the joystick"""
         self.joystick.quit()
         self.joystick = None
+        self.data = None
 
     def read_all(self) -> JoystickData:
-        """Read the values of the joystick's axes, buttons, and hat, returning a JoystickData"""
-        axes = [self.joystick.get_axis(i) for i in range(self.joystick.get_numaxes())]
-        buttons = [self.joystick.get_button(i) for i in range(self.joystick.get_numbuttons())]
-        hat = self.joystick.get_hat(0)
-        return JoystickData(axes, buttons, hat)
+        """Return the values of the joystick's axes, buttons, and hat, polling them unless the joystick is event-driven
+
+        The same JoystickData is returned by every read and updated in place, so it must be copied to be kept.
+        """
+        if not self.event_driven:
+            self.poll()
+        return self.data
+
+    def poll(self) -> None:
+        """Read the values of the joystick's axes, buttons, and hat into its data"""
+        axes, buttons = self.data.axes, self.data.buttons
+        for i in range(len(axes)):
+            axes[i] = self.joystick.get_axis(i)
+        for i in range(len(buttons)):
+            buttons[i] = bool(self.joystick.get_button(i))
+        self.data.hat = self.joystick.get_hat(0)
+
+    def handle_event(self, event: pygame.event.EventType) -> None:
+        """Apply a Pygame joystick event to the joystick's data, ignoring events from other joysticks"""
+        if self.data is None or event.joy != self.index:
+            return
+        if event.type == pygame.JOYAXISMOTION:
+            self.data.axes[event.axis] = event.value
+        elif event.type == pygame.JOYBUTTONDOWN or event.type == pygame.JOYBUTTONUP:
+            self.data.buttons[event.button] = event.type == pygame.JOYBUTTONDOWN
+        elif event.type == pygame.JOYHATMOTION and event.hat == 0:
+            self.data.hat = event.value
+
+
+# Joystick data is encoded so that it can be recorded by common.recorder, keeping up to MAX_AXES axes and MAX_BUTTONS
+# buttons
+MAX_AXES = 6
+MAX_BUTTONS = 32
+
+
+def _joystick_data_to_fields(data: JoystickData) -> tuple:
+    axes = data.axes[:MAX_AXES]
+    buttons = data.buttons[:MAX_BUTTONS]
+    button_mask = sum(1 << index for index, button in enumerate(buttons) if button)
+    return (len(axes), len(buttons)) + tuple(axes) + (0.0,) * (MAX_AXES - len(axes)) + (button_mask,) + tuple(data.hat)
+
+
+def _joystick_data_from_fields(num_axes: int, num_buttons: int, *fields) -> JoystickData:
+    axes, (button_mask, hat_x, hat_y) = list(fields[:num_axes]), fields[MAX_AXES:]
+    buttons = [bool(button_mask >> index & 1) for index in range(num_buttons)]
+    return JoystickData(axes, buttons, (hat_x, hat_y))
+
+
+codec.register(codec.Schema(0x41, JoystickData, 'BB{}dIbb'.format(MAX_AXES), _joystick_data_to_fields,
+                            _joystick_data_from_fields))
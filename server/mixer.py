@@ -0,0 +1,155 @@
+import math
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from server.joystick import JoystickData
+
+"""Thruster mixing from a configurable frame geometry
+
+The pilot's joystick input is first shaped into a vector of desired motion along each degree of freedom (DOF), and
+then multiplied by a mixing matrix that is precomputed from the position and direction of each thruster. The control
+loop mixes one sample per tick with Mixer.mix, in plain Python with reused buffers, since NumPy's overhead dominates for
+a single sample. Mixer.mix_batch mixes whole arrays of samples at once, which makes replaying a long log cheap (see
+server.replay --mix-only).
+"""
+
+Vec3D = Tuple[float, float, float]
+
+# Degrees of freedom, in the order used by the mixing matrix
+SURGE, SWAY, HEAVE, ROLL, PITCH, YAW = range(6)
+
+# Columns of the joystick sample arrays accepted by Mixer.mix_batch
+AXIS_X, AXIS_Y, AXIS_TWIST, AXIS_THROTTLE, BUTTON_PITCH_UP, BUTTON_PITCH_DOWN, HAT_X, HAT_Y = range(8)
+SAMPLE_WIDTH = 8
+
+DEADBAND = 0.08
+YAW_SCALE = 0.5
+PITCH_COMPENSATION = 0.3
+PITCH_UP_BUTTON, PITCH_DOWN_BUTTON = 10, 11
+
+
+class ThrusterConfig:
+    """Position and thrust direction of a single thruster
+
+    Thrusters with normalize set are scaled down together whenever any of them would exceed full speed.
+    """
+
+    def __init__(self, position: Vec3D, direction: Vec3D, normalize: bool = False) -> None:
+        self.position = position
+        self.direction = direction
+        self.normalize = normalize
+
+    def get_dof_effects(self) -> Tuple[float, float, float, float, float, float]:
+        """Return the force and torque produced along each DOF by this thruster at full forward speed"""
+        (x, y, z), (dx, dy, dz) = self.position, self.direction
+        return dx, dy, dz, y * dz - z * dy, z * dx - x * dz, x * dy - y * dx
+
+
+# The 2018 vector frame: four horizontal thrusters angled 30 degrees from the surge axis at the corners of the frame,
+# and two vertical thrusters at the front and back. Positions are scaled so that each horizontal thruster's yaw lever
+# arm is sqrt(3)/2, matching the original calculate_motor_speeds.
+_S3 = math.sqrt(3)
+VECTOR_FRAME_2018 = [
+    ThrusterConfig((_S3 / 4, -3 / 4, 0), (_S3 / 2, 1 / 2, 0), normalize=True),
+    ThrusterConfig((_S3 / 4, 3 / 4, 0), (_S3 / 2, -1 / 2, 0), normalize=True),
+    ThrusterConfig((-_S3 / 4, -3 / 4, 0), (_S3 / 2, -1 / 2, 0), normalize=True),
+    ThrusterConfig((-_S3 / 4, 3 / 4, 0), (_S3 / 2, 1 / 2, 0), normalize=True),
+    ThrusterConfig((1, 0, 0), (0, 0, 1)),
+    ThrusterConfig((-1, 0, 0), (0, 0, 1))
+]
+
+
+def pack_samples(samples: Sequence[JoystickData]) -> np.ndarray:
+    """Pack joystick data into an N x SAMPLE_WIDTH array for Mixer.mix_batch"""
+    array = np.empty((len(samples), SAMPLE_WIDTH))
+    for index, data in enumerate(samples):
+        array[index] = data.axes[:4] + [data.buttons[PITCH_UP_BUTTON], data.buttons[PITCH_DOWN_BUTTON]] + list(data.hat)
+    return array
+
+
+class Mixer:
+    """Converts joystick input into ESC values using a mixing matrix precomputed from the thruster geometry"""
+
+    def __init__(self, thrusters: Sequence[ThrusterConfig] = VECTOR_FRAME_2018) -> None:
+        self.thrusters = list(thrusters)
+        self.matrix = np.array([thruster.get_dof_effects() for thruster in self.thrusters])
+        self.normalize_mask = np.array([thruster.normalize for thruster in self.thrusters])
+        # Rows of the matrix as plain tuples, and buffers reused by mix for every sample
+        self._rows = [tuple(row) for row in self.matrix.tolist()]
+        self._normalize = [thruster.normalize for thruster in self.thrusters]
+        self._speeds = [0.0] * len(self.thrusters)
+        self._output = [0] * (len(self.thrusters) + 1)
+
+    def mix(self, joystick_data: JoystickData) -> Tuple[int, ...]:
+        """Calculate ESC values and the camera rotation speed for a single joystick sample
+
+        Intermediate values are kept in buffers that are reused for every sample, so the only container allocated is
+        the returned tuple. The buffers make this unsafe to call from more than one thread at a time.
+        """
+        axes = joystick_data.axes
+        sideways, forwards, twist, throttle = axes[AXIS_X], axes[AXIS_Y], axes[AXIS_TWIST], axes[AXIS_THROTTLE]
+        # Filter out joystick axis values close to zero (deadband)
+        if abs(sideways) < DEADBAND:
+            sideways = 0
+        if abs(forwards) < DEADBAND:
+            forwards = 0
+        if abs(twist) < DEADBAND:
+            twist = 0
+        if abs(throttle) < DEADBAND:
+            throttle = 0
+        forwards = -forwards
+        throttle = (1 - throttle) / 2
+        buttons = joystick_data.buttons
+
+        # Convert the square joystick input area into a circle, and apply a slight pitch to stay level moving forwards
+        surge = forwards * math.sqrt(1 - sideways ** 2 / 2)
+        sway = sideways * math.sqrt(1 - forwards ** 2 / 2)
+        heave = joystick_data.hat[1] * throttle
+        pitch = (int(buttons[PITCH_UP_BUTTON]) - int(buttons[PITCH_DOWN_BUTTON])) * throttle \
+            + forwards * PITCH_COMPENSATION
+        yaw = twist * YAW_SCALE
+
+        # The joystick never commands roll, so that column of the matrix is skipped
+        speeds = self._speeds
+        scale = 1
+        for index, (s, w, h, _, p, y) in enumerate(self._rows):
+            speed = speeds[index] = s * surge + w * sway + h * heave + p * pitch + y * yaw
+            # Find the factor to scale the normalized group down by, if necessary
+            if self._normalize[index] and abs(speed) > scale:
+                scale = abs(speed)
+
+        # Convert the speeds ([-1.0, 1.0]) to values for the ESCs ([1100, 1900]) and append the camera rotation speed
+        output = self._output
+        for index, speed in enumerate(speeds):
+            if scale != 1 and self._normalize[index]:
+                speed /= scale
+            output[index] = int(1500 + speed * 400)
+        output[-1] = joystick_data.hat[0]
+        return tuple(output)
+
+    def mix_batch(self, samples: np.ndarray) -> np.ndarray:
+        """Calculate ESC values and camera rotation speeds for an N x SAMPLE_WIDTH array of joystick samples"""
+        axes = samples[:, AXIS_X:AXIS_THROTTLE + 1]
+        axes = np.where(np.abs(axes) >= DEADBAND, axes, 0)
+        forwards = -axes[:, AXIS_Y]
+        sideways = axes[:, AXIS_X]
+        throttle = (1 - axes[:, AXIS_THROTTLE]) / 2
+
+        dof = np.zeros((len(samples), 6))
+        dof[:, SURGE] = forwards * np.sqrt(1 - sideways ** 2 / 2)
+        dof[:, SWAY] = sideways * np.sqrt(1 - forwards ** 2 / 2)
+        dof[:, HEAVE] = samples[:, HAT_Y] * throttle
+        dof[:, PITCH] = (samples[:, BUTTON_PITCH_UP] - samples[:, BUTTON_PITCH_DOWN]) * throttle \
+            + forwards * PITCH_COMPENSATION
+        dof[:, YAW] = axes[:, AXIS_TWIST] * YAW_SCALE
+
+        speeds = dof @ self.matrix.T
+        if self.normalize_mask.any():
+            scale = np.maximum(np.abs(speeds[:, self.normalize_mask]).max(axis=1), 1)
+            speeds[:, self.normalize_mask] /= scale[:, np.newaxis]
+
+        output = np.empty((len(samples), len(self.thrusters) + 1), dtype=np.int64)
+        output[:, :-1] = np.trunc(1500 + speeds * 400)
+        output[:, -1] = samples[:, HAT_X]
+        return output
@@ -0,0 +1,320 @@
+import queue
+import selectors
+import socket
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from common import codec, logging, metrics
+from common.message import ClientConnectionMessage
+from common.protocol import FrameReader, pack_frame, pack_obj, send_frame
+
+"""Non-blocking network core for the server
+
+NetworkCore runs a selectors loop on its own thread that accepts the controlling ROV client and any number of
+read-only observers, such as a co-pilot's console or a telemetry logger. Messages from the client are passed to the
+main thread as events, and everything sent to or received from the client is fanned out to the observers.
+
+Commands are still written to the client directly by whichever thread sends them, so observers can never delay the
+control stream. Each observer instead has a bounded queue of frames that the network thread writes without blocking.
+When an observer falls too far behind, the oldest queued frames are dropped, since only recent state is useful.
+"""
+
+# Types of events passed to the main thread, with the client's address, a message, or an error
+EVENT_CONNECTED, EVENT_MESSAGE, EVENT_DISCONNECTED = range(3)
+
+OBSERVERS = metrics.gauge('server_observers', 'Observers connected')
+OBSERVER_FRAMES_DROPPED = metrics.counter('server_observer_frames_dropped_total',
+                                          'Frames dropped because an observer fell behind')
+
+
+class ObserverConnection:
+    """Read-only connection that is sent a copy of the server's traffic through a bounded queue"""
+
+    MAX_QUEUED_FRAMES = 100
+
+    def __init__(self, sock: socket.socket, addr: Tuple[str, int]) -> None:
+        self.sock = sock
+        self.addr = addr
+        self.frames = deque()
+        # Remainder of a frame that was only partly sent, which can no longer be dropped
+        self.partial = None
+        self.sent = 0
+        self.dropped = 0
+
+    def enqueue(self, frame: bytes) -> None:
+        """Queue a frame to be sent, dropping the oldest queued frame if the queue is full"""
+        if len(self.frames) >= self.MAX_QUEUED_FRAMES:
+            self.frames.popleft()
+            self.dropped += 1
+            OBSERVER_FRAMES_DROPPED.inc()
+        self.frames.append(frame)
+
+    def has_pending(self) -> bool:
+        """Return whether there is data waiting to be sent"""
+        return self.partial is not None or len(self.frames) > 0
+
+    def flush(self) -> None:
+        """Send as much queued data as the socket accepts without blocking, raising socket.error if it fails"""
+        while self.has_pending():
+            if self.partial is None:
+                self.partial = memoryview(self.frames.popleft())
+            try:
+                count = self.sock.send(self.partial)
+            except BlockingIOError:
+                return
+            self.partial = self.partial[count:] if count < len(self.partial) else None
+            if self.partial is None:
+                self.sent += 1
+
+
+class NetworkCore:
+    """Thread that serves the controlling client and observers from a single selector"""
+
+    SOCKET_TIMEOUT = 0.5
+    SELECT_TIMEOUT = 1.0
+    # Size of the kernel's send buffer for each observer, kept small so that stale data is dropped from the bounded
+    # queue instead of waiting in the kernel
+    OBSERVER_SEND_BUFFER = 16384
+
+    def __init__(self, host: str, port: int, observer_port: Optional[int] = None) -> None:
+        self.host = host
+        self.port = port
+        self.observer_port = observer_port
+
+        self.events = queue.Queue()
+        self.client_sock = None
+        self.client_addr = None
+        self.observers = {}  # type: Dict[socket.socket, ObserverConnection]
+        # The most recent message of each type from the client, sent to observers when they connect
+        self.latest_messages = {}  # type: Dict[type, bytes]
+
+        # Held while using the client socket, since commands are sent to it from other threads
+        self._client_lock = threading.Lock()
+        # Held while sending to the client, so that frames sent from different threads are not interleaved. The network
+        # thread never takes it, so a client that stops reading cannot stall the network thread.
+        self._send_lock = threading.Lock()
+        self._client_reader = None
+        self._close_client_error = None
+        # Held while using the observers and their queues
+        self._observer_lock = threading.Lock()
+
+        self._selector = None
+        self._server_socks = []  # type: List[socket.socket]
+        self._wakeup_recv, self._wakeup_send = None, None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Bind the server sockets and start the network thread"""
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ, self._handle_wakeup)
+        self._listen(self.port, self._accept_client)
+        if self.observer_port is not None:
+            self._listen(self.observer_port, self._accept_observer)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='network', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the network thread, then close every connection"""
+        self._stopped.set()
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._close_client(None)
+        for sock in list(self.observers):
+            self._close_observer(sock)
+        for sock in self._server_socks + [self._wakeup_recv, self._wakeup_send]:
+            sock.close()
+        self._server_socks = []
+        self._selector.close()
+
+    def is_client_connected(self) -> bool:
+        """Return whether the controlling client is connected"""
+        return self.client_sock is not None
+
+    def send_to_client(self, obj: object) -> None:
+        """Send an object to the client if it is connected, and to every observer
+
+        If sending to the client fails, the error is logged and the client is disconnected by the network thread.
+        """
+        frame = pack_obj(obj)
+        self.broadcast(frame)
+        with self._client_lock:
+            sock = self.client_sock if self._close_client_error is None else None
+        if sock is None:
+            return
+        with self._send_lock:
+            try:
+                send_frame(sock, frame)
+            except socket.error as err:
+                logging.debug('Unable to send to client: {}', err)
+                with self._client_lock:
+                    # The network thread may have already replaced or closed this connection
+                    if self.client_sock is sock and self._close_client_error is None:
+                        self._close_client_error = err
+                self._wake()
+
+    def broadcast(self, frame: bytes) -> None:
+        """Queue a length-delimited frame to be sent to every observer"""
+        with self._observer_lock:
+            if not self.observers:
+                return
+            for observer in self.observers.values():
+                observer.enqueue(frame)
+        self._wake()
+
+    def get_events(self) -> List[Tuple[int, object]]:
+        """Return every (event type, value) waiting to be handled by the main thread, without blocking"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _listen(self, port: int, accept) -> None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, port))
+        sock.listen(4)
+        sock.setblocking(False)
+        self._server_socks.append(sock)
+        self._selector.register(sock, selectors.EVENT_READ, accept)
+
+    def _wake(self) -> None:
+        try:
+            self._wakeup_send.send(b'\0')
+        except (OSError, AttributeError):
+            # A wakeup is already pending, or the core has not been started or has been stopped
+            pass
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            for key, mask in self._selector.select(self.SELECT_TIMEOUT):
+                key.data(key.fileobj, mask)
+
+    def _handle_wakeup(self, sock: socket.socket, mask: int) -> None:
+        try:
+            while sock.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        if self._close_client_error is not None:
+            self._close_client(self._close_client_error)
+        with self._observer_lock:
+            failed = [observer for observer in self.observers.values()
+                      if observer.has_pending() and not self._flush_observer(observer)]
+        for observer in failed:
+            self._close_observer(observer.sock)
+
+    def _accept_client(self, server_sock: socket.socket, mask: int) -> None:
+        sock, addr = server_sock.accept()
+        if self.client_sock is not None:
+            # The client only reconnects when it has given up on its previous connection
+            logging.warn('Client reconnected from {}, closing the previous connection', addr[0])
+            self._close_client(socket.error('replaced by a new connection'))
+        sock.setblocking(True)
+        sock.settimeout(self.SOCKET_TIMEOUT)
+        with self._client_lock:
+            self.client_sock, self.client_addr = sock, addr
+            self._client_reader = FrameReader(sock)
+            self._close_client_error = None
+        self._selector.register(sock, selectors.EVENT_READ, self._read_client)
+        self.events.put((EVENT_CONNECTED, addr))
+        self.broadcast(pack_obj(ClientConnectionMessage(True)))
+
+    def _read_client(self, sock: socket.socket, mask: int) -> None:
+        try:
+            frames = self._client_reader.read_frames(0)
+        except socket.error as err:
+            self._close_client(err)
+            return
+        for frame in frames:
+            try:
+                message = codec.decode(frame)
+            except ValueError as err:
+                logging.warn('Invalid message from client: {}', err)
+                continue
+            self.events.put((EVENT_MESSAGE, message))
+            frame = pack_frame(frame)
+            self.latest_messages[type(message)] = frame
+            self.broadcast(frame)
+
+    def _close_client(self, err: Optional[Exception]) -> None:
+        with self._client_lock:
+            sock = self.client_sock
+            if sock is None:
+                return
+            self.client_sock = self.client_addr = self._client_reader = None
+            self._close_client_error = None
+        self._selector.unregister(sock)
+        sock.close()
+        self.events.put((EVENT_DISCONNECTED, err))
+        self.broadcast(pack_obj(ClientConnectionMessage(False)))
+
+    def _accept_observer(self, server_sock: socket.socket, mask: int) -> None:
+        sock, addr = server_sock.accept()
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.OBSERVER_SEND_BUFFER)
+        observer = ObserverConnection(sock, addr)
+        # Start the observer off with the current state
+        observer.enqueue(pack_obj(ClientConnectionMessage(self.client_sock is not None)))
+        for frame in self.latest_messages.values():
+            observer.enqueue(frame)
+        with self._observer_lock:
+            self.observers[sock] = observer
+            self._selector.register(sock, selectors.EVENT_READ, self._handle_observer)
+            OBSERVERS.set(len(self.observers))
+        logging.info('Observer connected: {}', addr[0])
+        self._wake()
+
+    def _handle_observer(self, sock: socket.socket, mask: int) -> None:
+        observer = self.observers.get(sock)
+        if observer is None:
+            return
+        if mask & selectors.EVENT_READ:
+            # Observers are read-only, so anything they send is discarded
+            try:
+                if not sock.recv(4096):
+                    logging.info('Observer disconnected: {}', observer.addr[0])
+                    self._close_observer(sock)
+                    return
+            except BlockingIOError:
+                pass
+            except socket.error as err:
+                logging.info('Observer disconnected: {} ({})', observer.addr[0], err)
+                self._close_observer(sock)
+                return
+        if mask & selectors.EVENT_WRITE:
+            with self._observer_lock:
+                flushed = self._flush_observer(observer)
+            if not flushed:
+                self._close_observer(sock)
+
+    def _flush_observer(self, observer: ObserverConnection) -> bool:
+        # Write what the observer accepts, then only watch for it becoming writable while data is still queued,
+        # returning whether the observer is still connected
+        try:
+            observer.flush()
+        except socket.error as err:
+            logging.info('Observer disconnected: {} ({})', observer.addr[0], err)
+            return False
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if observer.has_pending() else 0)
+        self._selector.modify(observer.sock, events, self._handle_observer)
+        return True
+
+    def _close_observer(self, sock: socket.socket) -> None:
+        with self._observer_lock:
+            observer = self.observers.pop(sock, None)
+            OBSERVERS.set(len(self.observers))
+        if observer is None:
+            return
+        self._selector.unregister(sock)
+        sock.close()
+        logging.debug('Observer {}: {} frames sent, {} dropped', observer.addr[0], observer.sent, observer.dropped)
@@ -0,0 +1,224 @@
+import json
+import sys
+from argparse import ArgumentParser
+from itertools import islice, zip_longest
+from time import perf_counter
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+import pygame
+
+from common.command import SetMotorSpeedsCommand
+from common.recorder import MAGIC, FlightLog
+from server.joystick import JoystickData
+from server.mixer import Mixer, pack_samples
+from server.server import Server
+
+"""Faster-than-realtime replay of joystick input through the server
+
+A ReplayServer feeds timestamped joystick samples through the same code as a live server: button presses go through
+Server.handle_event, and the control loop's step calculates and sends motor speeds. Time is simulated, so no display,
+joystick, or client is needed, and a replay runs as fast as the CPU allows. Every command the server would have sent
+is collected with its simulated time, so that the command stream can be diffed against a golden file after changing
+the motor vectoring or protocol code.
+
+Samples are read from a flight recorder log (see common.recorder) or from a script with one JSON object per line, for
+example {"time": 0.05, "axes": [0.0, -0.5, 0.0, -1.0], "buttons": [0, 0, 0, 0, 0, 0, 1], "hat": [0, 0]}.
+
+With --mix-only, the server is skipped and the motor speeds of every sample are calculated in batches by
+Mixer.mix_batch instead, using the same thruster geometry as the control loop's Mixer.mix, which is much faster for
+long logs. This only reproduces the motor speed commands of a replay with one tick per sample and no delta mode, so its
+golden files should also be made with --mix-only.
+
+Run with `python3 -m server.replay INPUT [--control-rate HZ] [--delta-mode] [--mix-only] [--output FILE]
+[--golden FILE]`.
+"""
+
+
+class ReplayJoystick:
+    """Stand-in for server.joystick.Joystick that returns the most recently replayed sample"""
+
+    event_driven = False
+
+    def __init__(self) -> None:
+        self.joystick_data = None
+
+    def is_connected(self) -> bool:
+        return self.joystick_data is not None
+
+    def connect(self) -> bool:
+        return self.is_connected()
+
+    def read_all(self) -> JoystickData:
+        return self.joystick_data
+
+
+class ReplayServer(Server):
+    """Headless server that replays joystick samples on simulated time, collecting the commands it sends
+
+    If control_rate is None, the control loop ticks once at the time of each sample, which reproduces a recorded log
+    whose samples were taken by the control loop. Otherwise it ticks at control_rate, reading the latest sample.
+    """
+
+    def __init__(self, control_rate: Optional[float] = None, delta_mode: bool = False) -> None:
+        self.replay_time = 0.0
+        super().__init__(None, 0, ReplayJoystick(), None, control_rate or 20, delta_mode=delta_mode,
+                         clock=self.get_replay_time)
+        self.control_rate = control_rate
+        self.commands = []  # type: List[Tuple[float, object]]
+        self.samples = 0
+
+    def get_replay_time(self) -> float:
+        """Return the simulated time"""
+        return self.replay_time
+
+    def send_command(self, command: object) -> None:
+        """Collect a command instead of sending it to a client"""
+        self.commands.append((self.replay_time, command))
+
+    def replay(self, samples: Iterable[Tuple[float, JoystickData]]) -> Iterator[Tuple[float, object]]:
+        """Replay (timestamp, JoystickData) samples in order, yielding (timestamp, command) for each command sent"""
+        interval = self.control_loop.interval
+        next_tick = None
+        timestamp = None
+        for timestamp, joystick_data in samples:
+            if self.control_rate is not None:
+                if next_tick is None:
+                    next_tick = timestamp
+                # Ticks before this sample still read the previous sample
+                while next_tick < timestamp:
+                    yield from self.tick(next_tick)
+                    next_tick += interval
+            self.replay_time = timestamp
+            self.apply_sample(joystick_data)
+            yield from self.get_commands()
+            if self.control_rate is None:
+                yield from self.tick(timestamp)
+        if self.control_rate is not None and timestamp is not None:
+            while next_tick <= timestamp:
+                yield from self.tick(next_tick)
+                next_tick += interval
+
+    def apply_sample(self, joystick_data: JoystickData) -> None:
+        """Make a sample the current joystick state, handling a JOYBUTTONDOWN event for each newly pressed button"""
+        previous = self.joystick.joystick_data
+        previous_buttons = previous.buttons if previous is not None else []
+        self.joystick.joystick_data = joystick_data
+        self.samples += 1
+        for button, (pressed, was_pressed) in enumerate(zip_longest(joystick_data.buttons, previous_buttons)):
+            if pressed and not was_pressed:
+                self.handle_event(pygame.event.Event(pygame.JOYBUTTONDOWN, joy=0, instance_id=0, button=button))
+
+    def tick(self, timestamp: float) -> Iterator[Tuple[float, object]]:
+        """Run a single control loop tick at a simulated time, yielding the commands it sent"""
+        self.replay_time = timestamp
+        self.control_loop.step()
+        return self.get_commands()
+
+    def get_commands(self) -> Iterator[Tuple[float, object]]:
+        """Yield and forget the commands collected so far"""
+        commands, self.commands = self.commands, []
+        return iter(commands)
+
+
+def read_script(file: IO[str]) -> Iterator[Tuple[float, JoystickData]]:
+    """Read (timestamp, JoystickData) samples from a script with one JSON object per line"""
+    for line in file:
+        if line.strip():
+            sample = json.loads(line)
+            yield sample['time'], JoystickData(sample['axes'], [bool(button) for button in sample['buttons']],
+                                               tuple(sample['hat']))
+
+
+def read_samples(path: str) -> Iterator[Tuple[float, JoystickData]]:
+    """Read (timestamp, JoystickData) samples from a flight recorder log or a JSON script"""
+    with open(path, 'rb') as file:
+        is_log = file.read(len(MAGIC)) == MAGIC
+    if is_log:
+        log = FlightLog(path)
+        try:
+            yield from log.read(types=(JoystickData,))
+        finally:
+            log.close()
+    else:
+        with open(path) as file:
+            yield from read_script(file)
+
+
+def mix_samples(samples: Iterable[Tuple[float, JoystickData]], batch_size: int = 4096) \
+        -> Iterator[Tuple[float, SetMotorSpeedsCommand]]:
+    """Calculate the motor speeds of (timestamp, JoystickData) samples in batches, yielding (timestamp, command)"""
+    mixer = Mixer()
+    samples = iter(samples)
+    while True:
+        batch = list(islice(samples, batch_size))
+        if not batch:
+            return
+        motor_speeds = mixer.mix_batch(pack_samples([joystick_data for _, joystick_data in batch])).tolist()
+        for (timestamp, _), speeds in zip(batch, motor_speeds):
+            yield timestamp, SetMotorSpeedsCommand(tuple(speeds))
+
+
+def format_command(timestamp: float, command: object) -> str:
+    """Format a command and a timestamp in seconds as a line of a command stream"""
+    return '{:.3f} {!r}\n'.format(timestamp, command)
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Replay joystick input through the server faster than realtime')
+    parser.add_argument('input', help='flight recorder log or JSON script of joystick samples')
+    parser.add_argument('--control-rate', type=float,
+                        help='control loop rate in Hz (default: one tick per sample, as the log was recorded)')
+    parser.add_argument('--delta-mode', action='store_true')
+    parser.add_argument('--mix-only', action='store_true',
+                        help='only calculate the motor speeds of each sample, in batches, skipping the server')
+    parser.add_argument('--output', help='file to write the command stream to (default: standard output)')
+    parser.add_argument('--golden', help='golden command stream to compare against, exiting with 1 on a difference')
+    args = parser.parse_args()
+    if args.mix_only and (args.control_rate or args.delta_mode):
+        parser.error('--mix-only calculates one command per sample, without delta mode')
+
+    if args.mix_only:
+        server = None
+        commands = mix_samples(read_samples(args.input))
+    else:
+        server = ReplayServer(args.control_rate, args.delta_mode)
+        commands = server.replay(read_samples(args.input))
+    output = open(args.output, 'w') if args.output else (None if args.golden else sys.stdout)
+    lines = []
+    command_count = 0
+    first_timestamp = None
+    start_time = perf_counter()
+    try:
+        for timestamp, command in commands:
+            command_count += 1
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            # Times in the command stream are relative to the first command, so that they do not depend on the input
+            line = format_command(timestamp - first_timestamp, command)
+            if output is not None:
+                output.write(line)
+            if args.golden:
+                lines.append(line)
+    finally:
+        if output is not None and output is not sys.stdout:
+            output.close()
+    elapsed = perf_counter() - start_time
+    # Mixing produces exactly one command per sample
+    samples = server.samples if server is not None else command_count
+    print('Replayed {} samples in {:.3f}s ({:.0f} samples/s)'.format(
+        samples, elapsed, samples / elapsed if elapsed else 0), file=sys.stderr)
+
+    if args.golden:
+        with open(args.golden) as file:
+            golden_lines = file.readlines()
+        for line_number, (line, golden_line) in enumerate(zip_longest(lines, golden_lines), 1):
+            if line != golden_line:
+                print('Command stream differs from {} at line {}:\n  expected: {}  actual:   {}'.format(
+                    args.golden, line_number, golden_line or '<end of stream>\n', line or '<end of stream>\n'),
+                    file=sys.stderr)
+                sys.exit(1)
+        print('Command stream matches {} ({} commands)'.format(args.golden, len(lines)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,97 +1,186 @@
 import socket
+import threading
+from time import perf_counter
+from typing import Callable, Optional
 
 import pygame
 
-from common import logging
-from common.command import SetMotorSpeedsCommand, SetCameraCommand, PlaySoundCommand
-from common.message import ArduinoConnectionMessage, SystemInfoMessage
-from common.protocol import recv_avail, recv_obj, send_obj
+from common import logging, metrics
+from common.command import SetMotorSpeedsCommand, SetCameraCommand, PlaySoundCommand, VideoFeedbackCommand
+from common.datagram import DatagramSender
+from common.message import ArduinoConnectionMessage, SystemInfoMessage, DatagramChannelMessage
+from common.recorder import FlightRecorder
+from common.protocol import pack_obj
+from common.timer import Timer
 from server import events
-from server.joystick import Joystick
-from server.motor_vectoring import calculate_motor_speeds
+from server.control_loop import ControlLoop
+from server.joystick import JOYSTICK_EVENTS, Joystick
+from server.network import EVENT_CONNECTED, EVENT_DISCONNECTED, EVENT_MESSAGE, NetworkCore
 from server.window import Window
 
 
+FRAME_INTERVAL = metrics.histogram('server_frame_interval_seconds', 'Time between updates of the window')
+COMMANDS_SENT = metrics.counter('server_commands_sent_total', 'Commands sent to the client')
+MESSAGES_RECEIVED = metrics.counter('server_messages_received_total', 'Messages received from the client')
+CLIENT_CONNECTS = metrics.counter('server_client_connects_total', 'Connections accepted from the client')
+CLIENT_CONNECTED = metrics.gauge('server_client_connected', 'Whether the client is connected')
+
+
 class Server:
-    SOCKET_TIMEOUT = 0.5
+    VIDEO_FEEDBACK_INTERVAL = 1.0
 
-    def __init__(self, host: str, port: int, joystick: Joystick, window: Window) -> None:
+    def __init__(self, host: str, port: int, joystick: Joystick, window: Window, control_rate: float = 20,
+                 frame_rate: float = 30, delta_mode: bool = False, recorder: Optional[FlightRecorder] = None,
+                 observer_port: Optional[int] = None, clock: Callable[[], float] = perf_counter) -> None:
         self.host = host
         self.port = port
+        self.observer_port = observer_port
 
         self.joystick = joystick
         self.window = window
+        self.recorder = recorder
 
-        self.server_sock = None
-        self.client_sock = None
+        # The network core accepts the controlling client and any observers, and is only started by run
+        self.network = NetworkCore(host, port, observer_port)
         self.client_addr = None
+        self.datagram_sender = None
+        # Held while using the datagram sender, since both the control loop and the main thread send commands
+        self.send_lock = threading.Lock()
+
+        # The clock is only used for delta mode keepalives, so that a replay can run on simulated time
+        self.control_loop = ControlLoop(joystick, self.send_command, 1 / control_rate, delta_mode, recorder, clock)
+        self.frame_timer = Timer(1 / frame_rate)
+        self.frame_time = None
+        self.video_feedback_timer = Timer(self.VIDEO_FEEDBACK_INTERVAL)
+        self.video_feedback_counts = (0, 0)
+
+        # Table of message handlers, indexed by message type
+        self.message_handlers = {
+            ArduinoConnectionMessage: self.handle_arduino_connection,
+            SystemInfoMessage: self.handle_system_info,
+            DatagramChannelMessage: self.handle_datagram_channel
+        }
 
     def run(self) -> None:
         """Run the server"""
+        self.network.start()
         try:
-            # Create, configure, and bind the server socket
-            self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_sock.settimeout(self.SOCKET_TIMEOUT)
-            self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_sock.bind((self.host, self.port))
-            self.server_sock.listen(1)
             logging.info('Server started on {}:{}', self.host or 'INADDR_ANY', self.port)
+            if self.observer_port is not None:
+                logging.info('Accepting observers on {}:{}', self.host or 'INADDR_ANY', self.observer_port)
+            self.control_loop.start()
             while True:
-                # Handle Pygame events and update the window while waiting for an incoming connection
-                while not recv_avail(self.server_sock):
-                    self.handle_event(pygame.event.wait())
-                    self.window.update()
-                # Once an incoming connection is being made, handle it
-                self.handle_connection()
+                # Handle Pygame events and update the window, then handle anything that happened on the network
+                self.run_frame()
+                for event_type, value in self.network.get_events():
+                    self.handle_network_event(event_type, value)
+                # Report how much of the video is getting through, if it is received in-process
+                if self.window.video_receiver is not None and self.network.is_client_connected() and \
+                        self.video_feedback_timer.is_expired():
+                    self.send_video_feedback()
+                    self.video_feedback_timer.restart()
         finally:
-            self.server_sock.close()
+            self.control_loop.stop()
+            self.network.stop()
 
-    def handle_connection(self) -> None:
-        """Accept and handle a client connection"""
-        try:
-            # Accept the incoming connection
-            self.client_sock, self.client_addr = self.server_sock.accept()
+    def run_frame(self) -> None:
+        """Handle Pygame events until the next frame is due, then update the window"""
+        # Keep waiting on events between frames, since the joystick state is only updated while events are pumped
+        remaining_ms = int(self.frame_timer.get_remaining_time() * 1000)
+        while remaining_ms > 0:
+            event = pygame.event.wait(remaining_ms)
+            if event.type != pygame.NOEVENT:
+                self.handle_event(event)
+            remaining_ms = int(self.frame_timer.get_remaining_time() * 1000)
+        self.frame_timer.restart()
+        if self.frame_time is not None:
+            FRAME_INTERVAL.observe(self.frame_timer.start_time - self.frame_time)
+        self.frame_time = self.frame_timer.start_time
+        self.window.update(self.control_loop.get_snapshot())
+
+    def handle_network_event(self, event_type: int, value: object) -> None:
+        """Handle an event from the network core"""
+        if event_type == EVENT_CONNECTED:
+            self.client_addr = value
+            self.control_loop.reset()
             logging.info('Client connected: {}', self.client_addr[0])
-            # TODO: Update self.window
-            while True:
-                # Handle Pygame events and update the window
-                self.handle_event(pygame.event.wait())
-                self.window.update()
-                # Receive and handle a message from the client if one is available
-                if recv_avail(self.client_sock):
-                    message = recv_obj(self.client_sock, self.SOCKET_TIMEOUT)
-                    self.handle_message(message)
-        except socket.error as err:
-            logging.error('Client disconnected: {}', err)
-        finally:
-            self.client_sock.close()
-            self.client_sock = None
+            CLIENT_CONNECTS.inc()
+            CLIENT_CONNECTED.set(1)
+        elif event_type == EVENT_MESSAGE:
+            self.handle_message(value)
+        elif event_type == EVENT_DISCONNECTED:
+            logging.error('Client disconnected: {}', value)
+            CLIENT_CONNECTED.set(0)
+            with self.send_lock:
+                if self.datagram_sender is not None:
+                    self.datagram_sender.sock.close()
+                    self.datagram_sender = None
             self.client_addr = None
-            # TODO: Update self.window
+
+    def send_command(self, command: object) -> None:
+        """Send a command to the client if it is connected, and to any observers
+
+        If sending to the client fails, it is disconnected by the network core instead of raising an error.
+        """
+        COMMANDS_SENT.inc()
+        with self.send_lock:
+            if self.datagram_sender is not None and isinstance(command, SetMotorSpeedsCommand):
+                self.datagram_sender.send(command)
+                self.network.broadcast(pack_obj(command))
+                return
+        self.network.send_to_client(command)
+
+    def send_video_feedback(self) -> None:
+        """Send the number of video frames received and lost since the previous report"""
+        stats = self.window.video_receiver.stats
+        counts = (stats.frames_received, stats.get_frames_lost())
+        self.send_command(VideoFeedbackCommand(counts[0] - self.video_feedback_counts[0],
+                                               max(counts[1] - self.video_feedback_counts[1], 0)))
+        self.video_feedback_counts = counts
 
     def handle_message(self, message: object) -> None:
         """Handle a message from the client"""
         logging.debug('Client message: {}', message)
-        if isinstance(message, ArduinoConnectionMessage):
-            pass  # TODO: Update self.window
-        elif isinstance(message, SystemInfoMessage):
-            pass  # TODO: Update self.window
+        MESSAGES_RECEIVED.inc()
+        if self.recorder is not None:
+            self.recorder.record(message)
+        handler = self.message_handlers.get(type(message))
+        if handler is not None:
+            handler(message)
+
+    def handle_arduino_connection(self, message: ArduinoConnectionMessage) -> None:
+        """Handle a change in the state of the Arduino connection"""
+        pass  # TODO: Update self.window
+
+    def handle_system_info(self, message: SystemInfoMessage) -> None:
+        """Handle information about the state of the client's system"""
+        timestamp = perf_counter()
+        self.window.telemetry.record('cpu_usage', timestamp, message.cpu_usage)
+        if message.cpu_temp is not None:
+            self.window.telemetry.record('cpu_temp', timestamp, message.cpu_temp)
+        self.window.telemetry.record('mem_usage', timestamp, message.mem_usage)
+
+    def handle_datagram_channel(self, message: DatagramChannelMessage) -> None:
+        """Handle a request to send motor speeds as datagrams"""
+        logging.info('Sending motor speeds as datagrams to {}:{}', self.client_addr[0], message.port)
+        with self.send_lock:
+            if self.datagram_sender is not None:
+                self.datagram_sender.sock.close()
+            datagram_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.datagram_sender = DatagramSender(datagram_sock, (self.client_addr[0], message.port))
 
     def handle_event(self, event: pygame.event.EventType) -> None:
         """Handle a Pygame event"""
-        if event.type == events.READ_JOYSTICK:
-            # Read data from the joystick if it is connected
-            joystick_data = self.joystick.read_all() if self.joystick.is_connected() else None
-            # TODO: Update self.window
-            # Calculate and send new motor speeds to the client if it is connected
-            if self.client_sock is not None:
-                motor_speeds = calculate_motor_speeds(joystick_data) if joystick_data is not None else None
-                send_obj(self.client_sock, SetMotorSpeedsCommand(motor_speeds))
-        elif event.type == events.CHECK_JOYSTICK:
-            # Reinitialize the joystick module to check for changes
-            pygame.joystick.quit()
-            pygame.joystick.init()
-            self.joystick.connect()
+        if self.joystick.event_driven and event.type in JOYSTICK_EVENTS:
+            # Keep the joystick's data up to date, without the control loop polling it
+            with self.control_loop.joystick_lock:
+                self.joystick.handle_event(event)
+        if event.type == events.CHECK_JOYSTICK:
+            # Reinitialize the joystick module to check for changes, pausing the control loop's joystick reads
+            with self.control_loop.joystick_lock:
+                pygame.joystick.quit()
+                pygame.joystick.init()
+                self.joystick.connect()
         elif event.type == pygame.JOYBUTTONDOWN:
             # Handle the button press
             camera_button_min = 6
@@ -99,10 +188,10 @@ class Server:
             play_sound_button = 9
             if camera_button_min <= event.button <= camera_button_max:
                 # Send a command to change the active camera
-                send_obj(self.client_sock, SetCameraCommand(event.button - camera_button_min))
+                self.send_command(SetCameraCommand(event.button - camera_button_min))
             elif event.button == play_sound_button:
                 # Send a command to play the OBS release sound
-                send_obj(self.client_sock, PlaySoundCommand('/home/rov/obs_release.wav'))
+                self.send_command(PlaySoundCommand('/home/rov/obs_release.wav'))
         elif event.type == pygame.QUIT:
             # Exit when the window is closed
             raise SystemExit
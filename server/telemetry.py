@@ -0,0 +1,162 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+"""Fixed-capacity telemetry history
+
+Each metric is stored in a RingBuffer of NumPy arrays, so memory use stays constant however long the server runs. The
+min/max downsamplers reduce a time window of a buffer to one column per pixel for plotting: downsample_min_max for any
+window, and MinMaxDownsampler incrementally for a window that follows the newest sample.
+"""
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of (timestamp, value) samples, overwriting the oldest samples when full
+
+    Timestamps must be appended in non-decreasing order.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros(capacity)
+        # Total number of samples ever appended, which also locates the next slot to write
+        self.appended = 0
+
+    def __len__(self) -> int:
+        return min(self.appended, self.capacity)
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Append a sample, overwriting the oldest sample if the buffer is full"""
+        index = self.appended % self.capacity
+        self.times[index] = timestamp
+        self.values[index] = value
+        self.appended += 1
+
+    def get_last(self) -> Tuple[float, float]:
+        """Return the most recent sample, raising IndexError if the buffer is empty"""
+        if not self.appended:
+            raise IndexError('buffer is empty')
+        index = (self.appended - 1) % self.capacity
+        return self.times[index], self.values[index]
+
+    def get_appended_since(self, appended: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the timestamps and values of the samples appended after the buffer held a total of appended samples
+
+        Samples that have already been overwritten are left out.
+        """
+        first = max(appended, self.appended - self.capacity)
+        start, count = first % self.capacity, self.appended - first
+        if start + count <= self.capacity:
+            return self.times[start:start + count], self.values[start:start + count]
+        end = start + count - self.capacity
+        return np.concatenate([self.times[start:], self.times[:end]]), \
+            np.concatenate([self.values[start:], self.values[:end]])
+
+    def get_range(self, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the timestamps and values of the samples with start <= timestamp <= end, oldest first"""
+        if self.appended <= self.capacity:
+            segments = [(self.times[:self.appended], self.values[:self.appended])]
+        else:
+            split = self.appended % self.capacity
+            segments = [(self.times[split:], self.values[split:]), (self.times[:split], self.values[:split])]
+        selected = []
+        for times, values in segments:
+            first, last = np.searchsorted(times, start, 'left'), np.searchsorted(times, end, 'right')
+            selected.append((times[first:last], values[first:last]))
+        if len(selected) == 1:
+            return selected[0]
+        return np.concatenate([selected[0][0], selected[1][0]]), np.concatenate([selected[0][1], selected[1][1]])
+
+
+def _reduce_columns(columns: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Return each distinct column with the minimum and maximum of its values. The columns must be sorted, so that the
+    # samples in each column are contiguous and can be reduced in a single pass.
+    firsts = np.flatnonzero(np.concatenate(([True], columns[1:] != columns[:-1])))
+    return columns[firsts], np.minimum.reduceat(values, firsts), np.maximum.reduceat(values, firsts)
+
+
+def downsample_min_max(times: np.ndarray, values: np.ndarray, start: float, end: float,
+                       width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the minimum and maximum values in each of width equal time columns between start and end
+
+    Columns without any samples are NaN. The timestamps must be sorted.
+    """
+    minimums = np.full(width, np.nan)
+    maximums = np.full(width, np.nan)
+    if not len(times) or end <= start:
+        return minimums, maximums
+    columns = ((times - start) * (width / (end - start))).astype(np.intp)
+    np.clip(columns, 0, width - 1, out=columns)
+    columns, column_minimums, column_maximums = _reduce_columns(columns, values)
+    minimums[columns] = column_minimums
+    maximums[columns] = column_maximums
+    return minimums, maximums
+
+
+class MinMaxDownsampler:
+    """Incrementally reduces the last duration seconds of a RingBuffer to the minimum and maximum of width columns
+
+    Columns are aligned to a fixed grid of timestamps, so each update only has to fold in the samples appended since the
+    last one, and its cost never depends on the number of samples in the window.
+    """
+
+    def __init__(self, buffer: RingBuffer, duration: float, width: int) -> None:
+        self.buffer = buffer
+        self.width = width
+        self.column_duration = duration / width
+        # Columns are stored in slots indexed by column number modulo width, tagged with the column number
+        self.column_ids = np.full(width, -1, dtype=np.int64)
+        self.minimums = np.full(width, np.nan)
+        self.maximums = np.full(width, np.nan)
+        self.consumed = 0
+
+    def is_stale(self) -> bool:
+        """Return whether samples have been appended to the buffer since the last update"""
+        return self.buffer.appended != self.consumed
+
+    def update(self) -> None:
+        """Fold the samples appended since the last update into their columns"""
+        times, values = self.buffer.get_appended_since(self.consumed)
+        self.consumed = self.buffer.appended
+        if not len(times):
+            return
+        ids, minimums, maximums = _reduce_columns(np.floor(times / self.column_duration).astype(np.int64), values)
+        # Only the newest width columns can be shown
+        ids, minimums, maximums = ids[-self.width:], minimums[-self.width:], maximums[-self.width:]
+        slots = ids % self.width
+        existing = self.column_ids[slots] == ids
+        self.minimums[slots] = np.where(existing, np.fmin(self.minimums[slots], minimums), minimums)
+        self.maximums[slots] = np.where(existing, np.fmax(self.maximums[slots], maximums), maximums)
+        self.column_ids[slots] = ids
+
+    def get_columns(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the minimum and maximum of each column up to the newest sample, oldest first, NaN where empty"""
+        if not len(self.buffer):
+            return np.full(self.width, np.nan), np.full(self.width, np.nan)
+        last = int(self.buffer.get_last()[0] // self.column_duration)
+        ids = np.arange(last - self.width + 1, last + 1)
+        slots = ids % self.width
+        valid = self.column_ids[slots] == ids
+        return np.where(valid, self.minimums[slots], np.nan), np.where(valid, self.maximums[slots], np.nan)
+
+
+class TelemetryHistory:
+    """Collection of ring buffers, one per named metric, created when the metric is first recorded"""
+
+    DEFAULT_CAPACITY = 4096
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        self.capacity = capacity
+        self.buffers = {}  # type: Dict[str, RingBuffer]
+
+    def get(self, name: str) -> RingBuffer:
+        """Return the buffer for a metric, creating it if necessary"""
+        buffer = self.buffers.get(name)
+        if buffer is None:
+            buffer = self.buffers[name] = RingBuffer(self.capacity)
+        return buffer
+
+    def record(self, name: str, timestamp: float, value: float) -> None:
+        """Append a sample to the buffer for a metric"""
+        self.get(name).append(timestamp, value)
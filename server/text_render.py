@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import pygame
+
+"""Shared caches for rendered text
+
+Font rendering is the most expensive part of drawing the window, so rendered strings are kept in a process-wide LRU
+cache. Numbers that change every frame would still miss the cache, so they can instead be composed from a GlyphAtlas
+of pre-rendered characters.
+"""
+
+Color = Tuple[int, int, int]
+
+
+class GlyphAtlas:
+    """Pre-rendered characters of a single font and color, which strings are composed from
+
+    Characters are placed at their advance widths without kerning, which matches the font exactly for monospaced fonts.
+    """
+
+    DEFAULT_CHARACTERS = '0123456789.,:-+%/ '
+
+    def __init__(self, font: pygame.font.Font, color: Color, antialias: bool = True,
+                 characters: str = DEFAULT_CHARACTERS) -> None:
+        self.glyphs = {char: font.render(char, antialias, color) for char in characters}
+        self.advances = {char: font.size(char)[0] for char in characters}
+
+    def can_render(self, text: str) -> bool:
+        """Return whether every character of the text is in the atlas"""
+        glyphs = self.glyphs
+        return all(char in glyphs for char in text)
+
+    def blit(self, surface: pygame.Surface, text: str, pos: Tuple[int, int]) -> bool:
+        """Blit the text onto a surface, returning False without drawing anything if a character is not in the atlas"""
+        if not self.can_render(text):
+            return False
+        x, y = pos
+        blits = []
+        for char in text:
+            blits.append((self.glyphs[char], (x, y)))
+            x += self.advances[char]
+        # Blit every glyph in a single call
+        surface.blits(blits, False)
+        return True
+
+
+class TextRenderCache:
+    """LRU cache of rendered text surfaces, keyed by font, text, color, and antialiasing
+
+    The least recently used surfaces are evicted when either max_entries or max_bytes is exceeded.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 8 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._surfaces = OrderedDict()  # type: OrderedDict
+        self._atlases = {}  # type: Dict[Tuple[pygame.font.Font, Color, bool], GlyphAtlas]
+
+    def render(self, font: pygame.font.Font, text: str, color: Color, antialias: bool = True) -> pygame.Surface:
+        """Return the rendered text, rendering it only if it is not already cached"""
+        key = (font, text, color, antialias)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self._surfaces[key] = surface
+        self.size_bytes += self._get_size_bytes(surface)
+        while self._surfaces and (len(self._surfaces) > self.max_entries or self.size_bytes > self.max_bytes):
+            _, evicted = self._surfaces.popitem(last=False)
+            self.size_bytes -= self._get_size_bytes(evicted)
+            self.evictions += 1
+        return surface
+
+    def get_glyph_atlas(self, font: pygame.font.Font, color: Color, antialias: bool = True) -> GlyphAtlas:
+        """Return the glyph atlas for a font and color, creating it the first time it is needed"""
+        key = (font, color, antialias)
+        atlas = self._atlases.get(key)
+        if atlas is None:
+            atlas = self._atlases[key] = GlyphAtlas(font, color, antialias)
+        return atlas
+
+    def clear(self) -> None:
+        """Discard every cached surface and glyph atlas"""
+        self._surfaces.clear()
+        self._atlases.clear()
+        self.size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._surfaces)
+
+    def __repr__(self) -> str:
+        return 'TextRenderCache(entries={}, bytes={}, hits={}, misses={}, evictions={}, atlases={})'.format(
+            len(self._surfaces), self.size_bytes, self.hits, self.misses, self.evictions, len(self._atlases))
+
+    @staticmethod
+    def _get_size_bytes(surface: pygame.Surface) -> int:
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
+# The cache shared by every TextWidget
+text_cache = TextRenderCache()
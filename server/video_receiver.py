@@ -0,0 +1,168 @@
+import threading
+from time import perf_counter
+from typing import Optional, Tuple
+
+import gi
+import numpy as np
+import pygame
+
+gi.require_version('Gst', '1.0')  # noqa
+from gi.repository import Gst
+
+Gst.init(None)
+
+"""In-process receiver for the video stream from the client
+
+VideoReceiver receives, depayloads, decodes, and scales the RTP stream in a GStreamer pipeline, which hands decoded
+frames to an appsink in the same pixel layout as the window. Only the newest decoded frame is kept, so a slow window
+drops frames instead of falling behind the stream. Drawing a frame copies it straight from the GStreamer buffer into
+the window's pixels, without converting it or copying it anywhere else first.
+"""
+
+ENCODER_JPEG = 'jpeg'
+ENCODER_H264 = 'h264'
+
+DEPAYLOADERS = {
+    ENCODER_JPEG: 'application/x-rtp, media=video, clock-rate=90000, encoding-name=JPEG, payload=26 ! '
+                  'rtpjpegdepay name=depay ! jpegdec',
+    ENCODER_H264: 'application/x-rtp, media=video, clock-rate=90000, encoding-name=H264, payload=96 ! '
+                  'rtph264depay name=depay ! avdec_h264'
+}
+
+
+class VideoReceiverStats:
+    """Counters for the frames passing through a VideoReceiver"""
+
+    def __init__(self) -> None:
+        # Frames with at least one packet received, whether or not they were complete
+        self.frames_started = 0
+        self.frames_received = 0
+        self.frames_decoded = 0
+        self.frames_displayed = 0
+        # Frames that were decoded but replaced by a newer frame before they were displayed
+        self.frames_dropped = 0
+        # Time from a frame being decoded until it was displayed, in seconds
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def get_frames_lost(self) -> int:
+        """Return the number of frames that were only partly received, and so could not be depayloaded"""
+        # The depayloader holds at most one frame at a time
+        return max(self.frames_started - self.frames_received - 1, 0)
+
+    def __repr__(self) -> str:
+        mean_latency = self.total_latency / self.frames_displayed if self.frames_displayed else 0.0
+        return 'VideoReceiverStats(frames_received={}, frames_lost={}, frames_decoded={}, frames_displayed={}, ' \
+               'frames_dropped={}, mean_latency={:.1f}ms, max_latency={:.1f}ms)'.format(
+                   self.frames_received, self.get_frames_lost(), self.frames_decoded, self.frames_displayed,
+                   self.frames_dropped, mean_latency * 1e3, self.max_latency * 1e3)
+
+
+def get_pixel_format(bitsize: int, masks: Tuple[int, ...]) -> Optional[str]:
+    """Return the GStreamer format with the same pixel layout as a display with a bit depth and masks, if any"""
+    if bitsize != 32:
+        return None
+    masks = tuple(masks[:3])
+    if masks == (0xff0000, 0xff00, 0xff):
+        return 'BGRx'
+    if masks == (0xff, 0xff00, 0xff0000):
+        return 'RGBx'
+    return None
+
+
+class VideoReceiver:
+    """GStreamer pipeline that receives the video stream and keeps the newest decoded frame for drawing
+
+    Frames are scaled to size by GStreamer. If pixel_format is None, frames are decoded as RGBx and converted by
+    pygame while they are drawn instead.
+    """
+
+    def __init__(self, port: int, size: Tuple[int, int], encoder: str = ENCODER_JPEG,
+                 pixel_format: Optional[str] = 'BGRx') -> None:
+        self.port = port
+        self.size = size
+        self.pixel_format = pixel_format
+        self.stats = VideoReceiverStats()
+
+        self._lock = threading.Lock()
+        self._sample = None
+        self._sample_time = None
+        self._last_rtp_time = None
+
+        pipeline_args = 'udpsrc name=source port={} ! {} ! videoconvert ! videoscale ! ' \
+                        'video/x-raw, format={}, width={}, height={} ! ' \
+                        'appsink name=sink emit-signals=true max-buffers=1 drop=true sync=false'.format(
+                            port, self._get_depayloader_description(encoder), pixel_format or 'RGBx', size[0],
+                            size[1])
+        self._pipeline = Gst.parse_launch(pipeline_args)
+        self._pipeline.get_by_name('source').get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER,
+                                                                             self._on_packet)
+        self._pipeline.get_by_name('depay').get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER,
+                                                                            self._on_frame)
+        self._pipeline.get_by_name('sink').connect('new-sample', self._on_sample)
+
+    def start(self) -> None:
+        """Start receiving video"""
+        self._pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self) -> None:
+        """Stop receiving video, discarding any frame that has not been drawn"""
+        self._pipeline.set_state(Gst.State.NULL)
+        with self._lock:
+            self._sample = None
+
+    def draw_frame(self, surface: pygame.Surface) -> bool:
+        """Draw the newest decoded frame onto a surface of the receiver's size, returning whether there was one"""
+        with self._lock:
+            sample, sample_time = self._sample, self._sample_time
+            self._sample = None
+        if sample is None:
+            return False
+        buffer = sample.get_buffer()
+        success, map_info = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            return False
+        try:
+            width, height = self.size
+            if self.pixel_format is not None:
+                # Copy the frame straight into the surface's pixels, which have the same layout
+                pixels = pygame.surfarray.pixels2d(surface)
+                np.copyto(pixels, np.frombuffer(map_info.data, np.uint32, width * height).reshape(height, width).T)
+                del pixels
+            else:
+                surface.blit(pygame.image.frombuffer(map_info.data, self.size, 'RGBX'), (0, 0))
+        finally:
+            buffer.unmap(map_info)
+        latency = perf_counter() - sample_time
+        self.stats.frames_displayed += 1
+        self.stats.total_latency += latency
+        self.stats.max_latency = max(self.stats.max_latency, latency)
+        return True
+
+    @staticmethod
+    def _get_depayloader_description(encoder: str) -> str:
+        if encoder not in DEPAYLOADERS:
+            raise ValueError('unknown video encoder: {}'.format(encoder))
+        return DEPAYLOADERS[encoder]
+
+    def _on_packet(self, pad: Gst.Pad, info: Gst.PadProbeInfo) -> Gst.PadProbeReturn:
+        # Every packet of a frame has the same RTP timestamp, in bytes 4-7 of the header
+        rtp_time = info.get_buffer().extract_dup(4, 4)
+        if rtp_time != self._last_rtp_time:
+            self._last_rtp_time = rtp_time
+            self.stats.frames_started += 1
+        return Gst.PadProbeReturn.OK
+
+    def _on_frame(self, pad: Gst.Pad, info: Gst.PadProbeInfo) -> Gst.PadProbeReturn:
+        self.stats.frames_received += 1
+        return Gst.PadProbeReturn.OK
+
+    def _on_sample(self, sink: Gst.Element) -> Gst.FlowReturn:
+        sample = sink.emit('pull-sample')
+        with self._lock:
+            if self._sample is not None:
+                self.stats.frames_dropped += 1
+            self._sample = sample
+            self._sample_time = perf_counter()
+        self.stats.frames_decoded += 1
+        return Gst.FlowReturn.OK
@@ -1,20 +1,33 @@
 from math import ceil
 from typing import Dict, List, Tuple
 
+import numpy as np
 import pygame
 
+from common.metrics import Counter, Histogram
+from server.telemetry import MinMaxDownsampler, RingBuffer
+from server.text_render import text_cache
+
 Vec2D = Tuple[int, int]
 
 """Widgets are UI elements that can be rendered to a PyGame Surface"""
 
 
 class Widget:
-    """Base widget class"""
+    """Base widget class
+
+    Widgets cache their rendered surface, and are only redrawn when they are dirty or one of their children changed.
+    Setting any attribute listed in STATE_ATTRIBUTES to a new value marks the widget dirty, and widgets with other state
+    call mark_dirty when it changes.
+    """
 
     DEFAULT_FG_COLOR = (255, 255, 255)
     DEFAULT_BG_COLOR = (0, 0, 0)
 
+    STATE_ATTRIBUTES = ('color', 'visible')
+
     def __init__(self, pos: Vec2D, size: Vec2D, children: List['Widget'] = None, name: str = None) -> None:
+        self.dirty = True
         self.pos = pos
         self.size = size
         self.children = children if children is not None else []
@@ -24,15 +37,54 @@ class Widget:
         self.visible = True
         self.surface = pygame.Surface(size, pygame.SRCALPHA)
 
+    def __setattr__(self, name: str, value: object) -> None:
+        if name in self.STATE_ATTRIBUTES:
+            if name in self.__dict__ and self.__dict__[name] == value:
+                return
+            self.__dict__['dirty'] = True
+        super().__setattr__(name, value)
+
+    def mark_dirty(self) -> None:
+        """Mark the widget as needing to be redrawn"""
+        self.dirty = True
+
+    def render(self, origin: Vec2D = (0, 0), dirty_rects: List[pygame.Rect] = None) -> bool:
+        """Recursively redraw the widget's surface where it or its children changed, returning whether it changed
+
+        If dirty_rects is provided, the areas that changed are appended to it, offset by the origin of the widget.
+        """
+        if self.dirty:
+            for child in self.children:
+                child.render()
+            self._composite()
+            if dirty_rects is not None:
+                dirty_rects.append(pygame.Rect(origin, self.size))
+        else:
+            changed_rects = [pygame.Rect(child.pos, child.size) for child in self.children
+                             if child.render((origin[0] + child.pos[0], origin[1] + child.pos[1]), dirty_rects)]
+            if not changed_rects:
+                return False
+            # Only recomposite the area covered by the children that changed
+            self._composite(changed_rects[0].unionall(changed_rects[1:]))
+        self.dirty = False
+        return True
+
     def blit(self, surface: pygame.Surface) -> None:
-        """Recursively draw the widget and its children, and blit the result onto the provided surface"""
+        """Redraw the widget and its children if they changed, and blit the result onto the provided surface"""
+        self.render()
         if self.visible:
-            self.surface.fill((0, 0, 0, 0))
-            self.draw()
-            for child in self.children:
-                child.blit(self.surface)
             surface.blit(self.surface, self.pos)
 
+    def _composite(self, clip: pygame.Rect = None) -> None:
+        # Clear and draw the widget, and blit its visible children on top, within the clipping area if provided
+        self.surface.set_clip(clip)
+        self.surface.fill((0, 0, 0, 0))
+        self.draw()
+        for child in self.children:
+            if child.visible:
+                self.surface.blit(child.surface, child.pos)
+        self.surface.set_clip(None)
+
     def get_name_dict(self) -> Dict[str, 'Widget']:
         """Recursively search for named widgets, returning a dictionary indexed by name"""
         name_dict = {}
@@ -107,28 +159,34 @@ class BorderLayoutWidget(Widget):
 
 
 class TextWidget(Widget):
-    """Widget that displays text"""
+    """Widget that displays text
+
+    Rendered text is shared through text_render.text_cache. Widgets with use_glyph_atlas set compose their text from
+    pre-rendered characters where possible, which suits numbers that change every frame.
+    """
 
     FONT_SM = ('Roboto Mono Medium', 11)
     FONT_MD = ('Roboto Mono Medium', 13)
     FONT_LG = ('Roboto Mono Medium', 15)
 
+    STATE_ATTRIBUTES = Widget.STATE_ATTRIBUTES + ('text',)
+
     _loaded_fonts = {}
 
-    def __init__(self, pos: Vec2D, text: str, font: Tuple[str, int] = FONT_MD, name: str = None) -> None:
+    def __init__(self, pos: Vec2D, text: str, font: Tuple[str, int] = FONT_MD, use_glyph_atlas: bool = False,
+                 name: str = None) -> None:
         if font not in self._loaded_fonts:
             self._loaded_fonts[font] = pygame.font.SysFont(*font)
         self.font = self._loaded_fonts[font]
         self.text = text
-        self._text = None
-        self.text_surface = None
+        self.use_glyph_atlas = use_glyph_atlas
         super().__init__(pos, self.font.size(text), name=name)
 
     def draw(self) -> None:
-        if self.text != self._text:
-            self.text_surface = self.font.render(self.text, True, self.color)
-            self._text = self.text
-        self.surface.blit(self.text_surface, (0, 0))
+        if self.use_glyph_atlas and text_cache.get_glyph_atlas(self.font, self.color).blit(self.surface, self.text,
+                                                                                           (0, 0)):
+            return
+        self.surface.blit(text_cache.render(self.font, self.text, self.color), (0, 0))
 
 
 class GlyphWidget(Widget):
@@ -136,6 +194,8 @@ class GlyphWidget(Widget):
 
     GLYPH_NONE, GLYPH_ERROR, GLYPH_SQUARE = range(3)
 
+    STATE_ATTRIBUTES = Widget.STATE_ATTRIBUTES + ('glyph',)
+
     def __init__(self, pos: Vec2D, size: int, glyph: int, margin: int = 0, name: str = None) -> None:
         self.glyph = glyph
         self.margin = margin
@@ -156,6 +216,8 @@ class BarWidget(Widget):
 
     FROM_TOP, FROM_RIGHT, FROM_BOTTOM, FROM_LEFT = range(4)
 
+    STATE_ATTRIBUTES = Widget.STATE_ATTRIBUTES + ('value',)
+
     def __init__(self, pos: Vec2D, size: Vec2D, direction: int = FROM_LEFT,
                  border: Tuple[bool, bool, bool, bool] = None, margin: int = 2, name: str = None) -> None:
         self.direction = direction
@@ -203,3 +265,87 @@ class LabeledContainerWidget(Widget):
         width, height = self.size
         pygame.draw.rect(surface, color, (0, 0, width, label_height + 4))
         pygame.draw.rect(surface, color, (0, label_height + 4, width, height - label_height - 4), 1)
+
+
+class SparklineWidget(Widget):
+    """Widget that plots the recent history of a metric from a RingBuffer
+
+    The samples from the last duration seconds are reduced to the minimum and maximum in each pixel column by a
+    MinMaxDownsampler, so the cost of drawing depends on the width of the widget rather than the number of samples. The
+    widget redraws itself whenever a sample is appended to the buffer.
+    """
+
+    def __init__(self, pos: Vec2D, size: Vec2D, buffer: RingBuffer, duration: float, value_range: Tuple[float, float],
+                 name: str = None) -> None:
+        self.downsampler = MinMaxDownsampler(buffer, duration, size[0])
+        self.value_range = value_range
+        super().__init__(pos, size, name=name)
+
+    def render(self, origin: Vec2D = (0, 0), dirty_rects: List[pygame.Rect] = None) -> bool:
+        if self.downsampler.is_stale():
+            self.mark_dirty()
+        return super().render(origin, dirty_rects)
+
+    def draw(self) -> None:
+        self.downsampler.update()
+        minimums, maximums = self.downsampler.get_columns()
+        columns = np.flatnonzero(~np.isnan(minimums))
+        if not len(columns):
+            return
+        # Draw a line through the top and bottom of the range of each column that has samples
+        low, high = self.value_range
+        scale = (self.size[1] - 1) / (high - low)
+        tops = np.clip((high - maximums[columns]) * scale, 0, self.size[1] - 1).astype(int)
+        bottoms = np.clip((high - minimums[columns]) * scale, 0, self.size[1] - 1).astype(int)
+        points = []
+        for column, top, bottom in zip(columns.tolist(), tops.tolist(), bottoms.tolist()):
+            points.append((column, top))
+            points.append((column, bottom))
+        pygame.draw.lines(self.surface, self.color, False, points)
+
+
+class MetricsWidget(Widget):
+    """Widget that displays a line of text for each of some metrics, as (label, metric) pairs
+
+    Counters are shown as their rate and total, gauges as their value, and histograms of durations in seconds as their
+    50th and 99th percentiles in milliseconds. Rates and percentiles cover the time since the previous update.
+    """
+
+    LINE_LENGTH = 40
+    LABEL_LENGTH = 16
+
+    def __init__(self, pos: Vec2D, metrics: List[Tuple[str, object]], name: str = None) -> None:
+        self.metrics = metrics
+        # Size the lines from digits rather than spaces, which are narrower if the font is not monospaced
+        self.lines = [TextWidget((0, 0), '0' * self.LINE_LENGTH, TextWidget.FONT_SM, use_glyph_atlas=True)
+                      for _ in metrics]
+        for index, line in enumerate(self.lines):
+            line.pos = (0, index * line.size[1])
+            line.text = ' ' * self.LINE_LENGTH
+        width = self.lines[0].size[0] if self.lines else 0
+        height = sum(line.size[1] for line in self.lines)
+        # The values of each metric at the previous update
+        self.last_values = [self._get_value(metric) for _, metric in metrics]
+        super().__init__(pos, (width, height), children=self.lines, name=name)
+
+    def update(self, elapsed: float) -> None:
+        """Update the text of every line, given the time in seconds since the previous update"""
+        for index, (label, metric) in enumerate(self.metrics):
+            label = label.ljust(self.LABEL_LENGTH)[:self.LABEL_LENGTH]
+            value = self._get_value(metric)
+            last_value, self.last_values[index] = self.last_values[index], value
+            if isinstance(metric, Counter):
+                text = '{}{:>9.1f}/s{:>13}'.format(label, (value - last_value) / elapsed, value)
+            elif isinstance(metric, Histogram):
+                counts = [count - last_count for count, last_count in zip(value, last_value)]
+                p50, p99 = metric.get_percentile(0.5, counts), metric.get_percentile(0.99, counts)
+                if p50 is not None:
+                    text = '{}p50{:>7.2f} p99{:>7.2f}ms'.format(label, p50 * 1e3, p99 * 1e3)
+                else:
+                    text = '{}{:>24}'.format(label, '-')
+            else:
+                text = '{}{:>24g}'.format(label, value)
+            self.lines[index].text = text.ljust(self.LINE_LENGTH)[:self.LINE_LENGTH]
+
+    def _get_value(self, metric: object) -> object:
+        return list(metric.counts) if isinstance(metric, Histogram) else metric.value
@@ -1,30 +1,161 @@
+from time import perf_counter
+from typing import List, Optional, TYPE_CHECKING
+
 import pygame
 
-from server.widget import VerticalLayoutWidget, Widget
+from common import metrics
+from server.control_loop import ControlSnapshot
+from server.telemetry import TelemetryHistory
+from server.widget import LabeledContainerWidget, MetricsWidget, SparklineWidget, TextWidget, VerticalLayoutWidget, \
+    Widget
+
+if TYPE_CHECKING:
+    # Only imported for type checking, since receiving video in-process is optional and needs GStreamer
+    from server.video_receiver import VideoReceiver
+
+UPDATE_TIME = metrics.histogram('window_update_seconds', 'Time taken to update the window')
+DIRTY_RECTS = metrics.counter('window_dirty_rects_total', 'Areas of the window pushed to the display')
 
 
 class Window:
-    def __init__(self) -> None:
+    # Metrics plotted in the window, as (name, title, duration in seconds, value range)
+    SPARKLINES = [
+        ('cpu_usage', 'CPU USAGE (%)', 300, (0, 100)),
+        ('cpu_temp', 'CPU TEMPERATURE (C)', 300, (20, 90)),
+        ('mem_usage', 'MEMORY USAGE (%)', 300, (0, 100)),
+        ('motor_output', 'MOTOR OUTPUT (%)', 60, (0, 100))
+    ]
+
+    # Metrics shown in the sidebar if enabled, as (label, metric name)
+    METRICS = [
+        ('FRAME INTERVAL', 'server_frame_interval_seconds'),
+        ('WINDOW UPDATE', 'window_update_seconds'),
+        ('CONTROL JITTER', 'server_control_jitter_seconds'),
+        ('TICKS SKIPPED', 'scheduler_skipped_ticks_total'),
+        ('TICK OVERRUNS', 'scheduler_overruns_total'),
+        ('COMMANDS SENT', 'server_commands_sent_total'),
+        ('MESSAGES RECV', 'server_messages_received_total'),
+        ('BYTES SENT', 'protocol_bytes_sent_total'),
+        ('BYTES RECV', 'protocol_bytes_received_total'),
+        ('CONNECTS', 'server_client_connects_total'),
+        ('OBSERVERS', 'server_observers'),
+        ('OBS DROPPED', 'server_observer_frames_dropped_total')
+    ]
+    METRICS_INTERVAL = 1.0
+
+    SIDEBAR_SIZE = (324, 768)
+    VIDEO_STATS_FORMAT = '{:4.1f} FPS {:6d} DROPPED {:6d} LOST'
+    VIDEO_STATS_INTERVAL = 1.0
+    # Time without a new video frame before the video area is cleared
+    VIDEO_TIMEOUT = 1.0
+
+    def __init__(self, video_receiver: Optional['VideoReceiver'] = None, show_metrics: bool = False) -> None:
         self.surface = None
-        self.widgets = VerticalLayoutWidget((4, 4), children=[], name='root').get_name_dict()
+        self.control_snapshot = None
+        self.telemetry = TelemetryHistory()
+        sparklines = [LabeledContainerWidget((0, 0), 316, SparklineWidget((0, 0), (308, 40), self.telemetry.get(name),
+                                                                          duration, value_range, name=name), title)
+                      for name, title, duration, value_range in self.SPARKLINES]
+        # Only metrics registered by the modules that have been imported are shown
+        self.metrics_time = perf_counter()
+        if show_metrics:
+            shown_metrics = [(label, metrics.REGISTRY.get(name)) for label, name in self.METRICS
+                             if metrics.REGISTRY.get(name) is not None]
+            sparklines.append(LabeledContainerWidget((0, 0), 316, MetricsWidget((0, 0), shown_metrics, name='metrics'),
+                                                     'METRICS'))
+        self.widgets = VerticalLayoutWidget((4, 4), children=sparklines, name='root').get_name_dict()
+
+        # The video is drawn to the right of the sidebar, with overlay widgets drawn on top of each frame
+        self.video_receiver = video_receiver
+        self.video_rect = None
+        self.video_surface = None
+        self.last_video_time = 0.0
+        self.video_cleared = True
+        self.video_stats_time = 0.0
+        self.video_stats_frames = 0
+        if video_receiver is not None:
+            self.video_rect = pygame.Rect((self.SIDEBAR_SIZE[0], 0), video_receiver.size)
+            video_stats = TextWidget((4, 4), self.VIDEO_STATS_FORMAT.format(0, 0, 0), TextWidget.FONT_SM,
+                                     use_glyph_atlas=True, name='video_stats')
+            overlay = Widget((0, 0), video_receiver.size, children=[video_stats], name='overlay')
+            self.widgets.update(overlay.get_name_dict())
 
     def show(self) -> None:
         """Show the window"""
         pygame.display.init()
-        self.surface = pygame.display.set_mode((324, 768))
+        if self.video_receiver is not None:
+            self.surface = pygame.display.set_mode((self.video_rect.right, max(self.SIDEBAR_SIZE[1],
+                                                                               self.video_rect.bottom)))
+            self.video_surface = self.surface.subsurface(self.video_rect)
+        else:
+            self.surface = pygame.display.set_mode(self.SIDEBAR_SIZE)
+        self.surface.fill(Widget.DEFAULT_BG_COLOR)
+        pygame.display.flip()
+        self.widgets.get('root').mark_dirty()
         self.update()
 
     def is_showing(self) -> bool:
         """Return whether the window is showing"""
         return self.surface is not None
 
-    def update(self) -> None:
-        """Update the contents of the window"""
-        self.surface.fill(Widget.DEFAULT_BG_COLOR)
-        self.widgets.get('root').blit(self.surface)
-        pygame.display.flip()
+    def update(self, control_snapshot: Optional[ControlSnapshot] = None) -> None:
+        """Update the contents of the window, optionally from a new snapshot of the control loop
+
+        Only the areas of the window covered by widgets that changed are redrawn and pushed to the display.
+        """
+        start_time = perf_counter()
+        if control_snapshot is not None:
+            if control_snapshot.motor_speeds is not None and control_snapshot is not self.control_snapshot:
+                # Record the output of the most heavily loaded horizontal or vertical motor
+                output = max(abs(speed - 1500) for speed in control_snapshot.motor_speeds[:6]) / 4
+                self.telemetry.record('motor_output', perf_counter(), output)
+            self.control_snapshot = control_snapshot
+        if 'metrics' in self.widgets and start_time >= self.metrics_time + self.METRICS_INTERVAL:
+            self.widgets.get('metrics').update(start_time - self.metrics_time)
+            self.metrics_time = start_time
+        root = self.widgets.get('root')
+        dirty_rects = []
+        root.render(root.pos, dirty_rects)
+        for rect in dirty_rects:
+            self.surface.fill(Widget.DEFAULT_BG_COLOR, rect)
+            if root.visible:
+                self.surface.blit(root.surface, rect, rect.move(-root.pos[0], -root.pos[1]))
+        if self.video_receiver is not None:
+            self.update_video(dirty_rects)
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+            DIRTY_RECTS.inc(len(dirty_rects))
+        UPDATE_TIME.observe(perf_counter() - start_time)
+
+    def update_video(self, dirty_rects: List[pygame.Rect]) -> None:
+        """Draw the newest video frame and the overlay on top of it, appending the video area to dirty_rects if so"""
+        now = perf_counter()
+        if now >= self.video_stats_time + self.VIDEO_STATS_INTERVAL:
+            stats = self.video_receiver.stats
+            frame_rate = (stats.frames_displayed - self.video_stats_frames) / (now - self.video_stats_time)
+            self.widgets.get('video_stats').text = self.VIDEO_STATS_FORMAT.format(
+                min(frame_rate, 99.9), stats.frames_dropped, stats.get_frames_lost())
+            self.video_stats_time, self.video_stats_frames = now, stats.frames_displayed
+        overlay = self.widgets.get('overlay')
+        if self.video_receiver.draw_frame(self.video_surface):
+            self.last_video_time = now
+            self.video_cleared = False
+            overlay.render()
+        elif now - self.last_video_time >= self.VIDEO_TIMEOUT:
+            # The video has stopped, so draw the overlay over a blank area instead of the last frame
+            if not overlay.render() and self.video_cleared:
+                return
+            self.video_surface.fill(Widget.DEFAULT_BG_COLOR)
+            self.video_cleared = True
+        else:
+            # The overlay can only be redrawn over a new frame, so any changes to it wait until then
+            return
+        if overlay.visible:
+            self.video_surface.blit(overlay.surface, overlay.pos)
+        dirty_rects.append(self.video_rect)
 
     def hide(self) -> None:
         """Hide the window"""
         self.surface = None
+        self.video_surface = None
         pygame.display.quit()